@@ -0,0 +1,456 @@
+"""Throughput, latency and memory of the wrapper functions, offline
+
+Every public function of `drive` and `mail` is run against a
+`fake.FakeBackend`, at a range of data sizes: numbers of files, messages...
+or, for the transfers, sizes in bytes (`BYTES_PER_ITEM` times the size).
+Functions handling a single item run at one size only. For each function
+and size, reports:
+- the throughput, in items or MiB per second,
+- the median (p50) and 99th percentile (p99) durations of the calls,
+- the peak memory allocated during a call, measured with tracemalloc in an
+  extra run, since tracing slows the calls down.
+
+The requests go through the transport of the package (see `transport.py`),
+httplib2 or httpx, with only its connections replaced by the backend. The
+quotas (see `quota.py`) are not enforced, so that the numbers measure the
+package rather than the throttling. Injected errors are retried with the
+usual backoff delays.
+
+Usage: python benchmarks/functions.py [--runs N] [--sizes 10,100,1000]
+           [--latency SECONDS] [--error-rate RATE]
+           [--transport httplib2|httpx] [name filter]
+"""
+
+import argparse
+import math
+import tempfile
+import time
+import tracemalloc
+from itertools import count
+from pathlib import Path
+
+from google_services import config, drive, mail
+from google_services.drive_index import DriveIndex
+from google_services.fake import FakeBackend
+
+# Size unit of the transfers
+BYTES_PER_ITEM = 16 * 1024
+
+_names = count()
+
+
+def _name(prefix: str)->str:
+    return f'{prefix}_{next(_names)}'
+
+
+def _local_file(workdir: Path, size: int)->Path:
+    path = workdir / _name('local')
+    path.write_bytes(b'x' * size)
+    return path
+
+
+def _folder(backend: FakeBackend, files: int=0)->str:
+    folder = backend.drive.add_folder(_name('folder'))
+    for i in range(files):
+        backend.drive.add_file(f'file_{i}', b'x', folder['id'])
+    return folder['id']
+
+
+def _messages(backend: FakeBackend, messages: int)->list:
+    return [backend.gmail.add_message(_name('subject'), 'text')['id']
+            for _ in range(messages)]
+
+
+# Scenarios: (name, unit, setup). `setup(backend, size, workdir)` prepares
+# the data of a size, and returns a function preparing each run, which
+# returns the call to measure. unit is None for the functions handling a
+# single item, "bytes" for the transfers.
+
+def _listing(function, **kwargs):
+    def setup(backend, size, workdir):
+        query = f"'{_folder(backend, size)}' in parents"
+        return lambda: lambda: list(function(query, **kwargs))
+    return setup
+
+
+def _create_folder(backend, size, workdir):
+    return lambda: lambda: drive.create_folder(_name('folder'))
+
+
+def _create_folders(backend, size, workdir):
+    return lambda: lambda: drive.create_folders(
+        [_name('folder') for _ in range(size)])
+
+
+def _copy_file(backend, size, workdir):
+    file_id = backend.drive.add_file('source', b'x')['id']
+    return lambda: lambda: drive.copy_file(file_id, _name('copy'))
+
+
+def _copy_files(backend, size, workdir):
+    file_id = backend.drive.add_file('source', b'x')['id']
+    return lambda: lambda: drive.copy_files(
+        [(file_id, _name('copy')) for _ in range(size)])
+
+
+def _create_file(backend, size, workdir):
+    path = _local_file(workdir, size)
+    return lambda: lambda: drive.create_file(str(path), _name('file'))
+
+
+def _update_file(backend, size, workdir):
+    path = _local_file(workdir, size)
+    file_id = backend.drive.add_file('updated', b'x')['id']
+    return lambda: lambda: drive.update_file(str(path), file_id)
+
+
+def _download(function, **kwargs):
+    def setup(backend, size, workdir):
+        file_id = backend.drive.add_file('download', b'x' * size)['id']
+        destination = workdir / 'download'
+        return lambda: lambda: function(file_id, destination=destination,
+                                        **kwargs)
+    return setup
+
+
+def _delete_file(backend, size, workdir):
+    def prepare():
+        file_id = backend.drive.add_file(_name('file'))['id']
+        return lambda: drive.delete_file(file_id)
+    return prepare
+
+
+def _delete_files(backend, size, workdir):
+    def prepare():
+        file_ids = [backend.drive.add_file(_name('file'))['id']
+                    for _ in range(size)]
+        return lambda: drive.delete_files(file_ids)
+    return prepare
+
+
+def _resolve_paths(backend, size, workdir):
+    folder_id = _folder(backend)
+    paths = []
+    for i in range(size):
+        parent = f'folder_{i % 10}'
+        if i < 10:
+            backend.drive.add_folder(parent, folder_id)
+        paths.append(f'{parent}/file_{i}')
+    parents = {file['name']: file['id'] for file in drive.get_files(
+        f"'{folder_id}' in parents")} if size else {}
+    for i, path in enumerate(paths):
+        backend.drive.add_file(f'file_{i}', b'x', parents[f'folder_{i % 10}'])
+
+    def prepare():
+        # Measures cold lookups
+        drive.path_cache.clear()
+        return lambda: drive.resolve_paths(paths, folder_id)
+    return prepare
+
+
+def _resolve_path(backend, size, workdir):
+    folder_id = _folder(backend)
+    parent_id = backend.drive.add_folder('parent', folder_id)['id']
+    backend.drive.add_file('file', b'x', parent_id)
+
+    def prepare():
+        drive.path_cache.clear()
+        return lambda: drive.resolve_path('parent/file', folder_id)
+    return prepare
+
+
+def _make_dirs(backend, size, workdir):
+    folder_id = _folder(backend)
+    return lambda: lambda: drive.make_dirs(f"{_name('a')}/b/c", folder_id)
+
+
+def _upload_to_path(backend, size, workdir):
+    folder_id = _folder(backend)
+    path = _local_file(workdir, 1024)
+    return lambda: lambda: drive.upload_to_path(
+        str(path), f"{_name('a')}/b/file", folder_id)
+
+
+def _sync(unchanged: bool):
+    def setup(backend, size, workdir):
+        local = workdir / _name('local')
+        for i in range(size):
+            folder = local / f'folder_{i % 10}'
+            folder.mkdir(parents=True, exist_ok=True)
+            (folder / f'file_{i}').write_text(str(i))
+        folder_id = _folder(backend)
+        if unchanged:
+            drive.sync(str(local), folder_id)
+
+        def prepare():
+            target = folder_id if unchanged else _folder(backend)
+            return lambda: drive.sync(str(local), target)
+        return prepare
+    return setup
+
+
+def _drive_index(backend, size, workdir):
+    _folder(backend, size)
+
+    def prepare():
+        index = DriveIndex(str(workdir / f"{_name('index')}.db"),
+                           max_age=None)
+        return index.sync
+    return prepare
+
+
+def _get_labels(backend, size, workdir):
+    for _ in range(size):
+        mail.create_label(_name('label'))
+    return lambda: mail.get_labels
+
+
+def _create_label(backend, size, workdir):
+    return lambda: lambda: mail.create_label(_name('label'))
+
+
+def _delete_label(backend, size, workdir):
+    def prepare():
+        label_id = mail.create_label(_name('label'))['id']
+        return lambda: mail.delete_label(label_id)
+    return prepare
+
+
+def _label_lookup(function):
+    def setup(backend, size, workdir):
+        label = mail.create_label(_name('label'))
+
+        def prepare():
+            # Measures cold lookups
+            mail.label_cache.clear()
+            return lambda: function(label['name'] if function is mail.label_id
+                                    else label['id'])
+        return prepare
+    return setup
+
+
+def _label_ids(backend, size, workdir):
+    names = [mail.create_label(_name('label'))['name'] for _ in range(size)]
+
+    def prepare():
+        mail.label_cache.clear()
+        return lambda: mail.label_ids(names)
+    return prepare
+
+
+def _create_mail(backend, size, workdir):
+    path = _local_file(workdir, size)
+
+    def create():
+        message = mail.create_mail('me@example.com', 'to@example.com',
+                                   'subject', '<b>html</b>', 'plain',
+                                   [str(path)])
+        Path(message['file']).unlink()
+    return lambda: create
+
+
+def _send(backend, size, workdir):
+    message = mail.create_mail('me@example.com', 'to@example.com', 'subject',
+                               '<b>html</b>', 'plain')
+    return lambda: lambda: mail.send('me', message)
+
+
+def _send_mail(backend, size, workdir):
+    path = _local_file(workdir, size)
+    return lambda: lambda: mail.send_mail(
+        'me@example.com', 'to@example.com', 'subject', '<b>html</b>',
+        'plain', [str(path)])
+
+
+def _send_file(backend, size, workdir):
+    return lambda: lambda: mail.send_file('to@example.com', 'subject',
+                                          'file_id')
+
+
+def _send_bulk(backend, size, workdir):
+    recipients = [{'to': f'user_{i}@example.com', 'name': str(i)}
+                  for i in range(size)]
+    return lambda: lambda: mail.send_bulk(
+        recipients, 'me@example.com', 'Hello $name', '<b>$name</b>',
+        '$name', str(workdir / f"{_name('journal')}.jsonl"))
+
+
+def _iter_messages(**kwargs):
+    def setup(backend, size, workdir):
+        label = mail.create_label(_name('label'))
+        mail.modify_messages(_messages(backend, size),
+                             add_label_ids=[label['id']])
+        query = f"label:{label['name']}"
+        return lambda: lambda: list(mail.iter_messages(query, **kwargs))
+    return setup
+
+
+def _get_messages(backend, size, workdir):
+    label = mail.create_label(_name('label'))
+    mail.modify_messages(_messages(backend, size),
+                         add_label_ids=[label['id']])
+    return lambda: lambda: mail.get_messages(f"label:{label['name']}")
+
+
+def _modify_message(function):
+    def setup(backend, size, workdir):
+        def prepare():
+            message_id = _messages(backend, 1)[0]
+            return lambda: function(message_id)
+        return prepare
+    return setup
+
+
+def _modify_messages(function):
+    def setup(backend, size, workdir):
+        def prepare():
+            message_ids = _messages(backend, size)
+            return lambda: function(message_ids)
+        return prepare
+    return setup
+
+
+def _mail_sync(backend, size, workdir):
+    _messages(backend, size)
+
+    def prepare():
+        # Measures full synchronizations
+        return lambda: mail.sync(str(workdir / f"{_name('history')}.json"))
+    return prepare
+
+
+SCENARIOS = [
+    ('drive.get_files', 'files', _listing(drive.get_files)),
+    ('drive.iter_files', 'files', _listing(drive.iter_files, page_size=100)),
+    ('drive.iter_files, prefetch', 'files',
+     _listing(drive.iter_files, page_size=100, prefetch=True)),
+    ('drive.create_folder', None, _create_folder),
+    ('drive.create_folders', 'folders', _create_folders),
+    ('drive.copy_file', None, _copy_file),
+    ('drive.copy_files', 'files', _copy_files),
+    ('drive.create_file', 'bytes', _create_file),
+    ('drive.update_file', 'bytes', _update_file),
+    ('drive.download_file', 'bytes',
+     _download(lambda file_id, destination: drive.download_file(file_id))),
+    ('drive.iter_download', 'bytes',
+     _download(lambda file_id, destination: sum(
+         map(len, drive.iter_download(file_id))))),
+    ('drive.download_file_to', 'bytes', _download(drive.download_file_to)),
+    ('drive.download_file_to, 4 workers', 'bytes',
+     _download(drive.download_file_to, chunk_size=256 * 1024, workers=4)),
+    ('drive.delete_file', None, _delete_file),
+    ('drive.delete_files', 'files', _delete_files),
+    ('drive.resolve_paths', 'paths', _resolve_paths),
+    ('drive.resolve_path', None, _resolve_path),
+    ('drive.make_dirs', None, _make_dirs),
+    ('drive.upload_to_path', None, _upload_to_path),
+    ('drive.sync', 'files', _sync(unchanged=False)),
+    ('drive.sync, unchanged', 'files', _sync(unchanged=True)),
+    ('drive_index.DriveIndex.sync', 'files', _drive_index),
+    ('mail.get_labels', 'labels', _get_labels),
+    ('mail.create_label', None, _create_label),
+    ('mail.delete_label', None, _delete_label),
+    ('mail.label_id', None, _label_lookup(mail.label_id)),
+    ('mail.label_name', None, _label_lookup(mail.label_name)),
+    ('mail.label_ids', 'labels', _label_ids),
+    ('mail.create_mail', 'bytes', _create_mail),
+    ('mail.send', None, _send),
+    ('mail.send_mail', 'bytes', _send_mail),
+    ('mail.send_file', None, _send_file),
+    ('mail.send_bulk', 'messages', _send_bulk),
+    ('mail.iter_messages', 'messages', _iter_messages()),
+    ('mail.iter_messages, hydrate', 'messages', _iter_messages(hydrate=True)),
+    ('mail.get_messages', 'messages', _get_messages),
+    ('mail.archive_message', None, _modify_message(mail.archive_message)),
+    ('mail.move_to_trash', None, _modify_message(mail.move_to_trash)),
+    ('mail.modify_messages', 'messages', _modify_messages(
+        lambda message_ids: mail.modify_messages(
+            message_ids, add_label_ids=['STARRED']))),
+    ('mail.archive_messages', 'messages',
+     _modify_messages(mail.archive_messages)),
+    ('mail.trash_messages', 'messages',
+     _modify_messages(mail.trash_messages)),
+    ('mail.delete_messages', 'messages',
+     _modify_messages(mail.delete_messages)),
+    ('mail.sync', 'messages', _mail_sync),
+]
+
+
+def percentile(values: list, fraction: float)->float:
+    """Nearest-rank percentile of `values`"""
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def measure(prepare: callable, runs: int)->tuple:
+    """Durations, in seconds, of `runs` calls, and peak memory of a call,
+    in bytes"""
+    durations = []
+    for _ in range(runs):
+        call = prepare()
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    call = prepare()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return durations, peak
+
+
+def main(runs: int=10, sizes: tuple=(10, 100, 1000), latency: float=0.,
+         error_rate: float=0., name_filter: str='', transport: str=None):
+    workdir = Path(tempfile.mkdtemp(prefix='google_services_benchmark_'))
+    config.default.upload_checkpoint_path = str(workdir / 'uploads')
+    config.default.sync_hash_cache_path = str(workdir / 'hashes.json')
+    config.default.quota_enabled = False
+    backend = FakeBackend(latency=latency, error_rate=error_rate, seed=0)
+    print(f"{'function':<36}{'size':>12}{'throughput':>16}{'p50':>11}"
+          f"{'p99':>11}{'peak memory':>13}")
+    with backend.install(transport):
+        for name, unit, setup in SCENARIOS:
+            if name_filter not in name:
+                continue
+            for size in (sizes if unit is not None else [1]):
+                if unit == 'bytes':
+                    size *= BYTES_PER_ITEM
+                    label = f'{size / 2 ** 20:.2f} MiB'
+                else:
+                    label = f'{size} {unit or "call"}'
+                try:
+                    durations, peak = measure(
+                        setup(backend, size, workdir), runs)
+                except Exception as error:
+                    print(f'{name:<36}{label:>12}  failed: {error!r}')
+                    continue
+                rate = size * runs / sum(durations)
+                throughput = (f'{rate / 2 ** 20:.1f} MiB/s' if unit == 'bytes'
+                              else f'{rate:.1f} /s')
+                print(f'{name:<36}{label:>12}{throughput:>16}'
+                      f'{percentile(durations, .5) * 1000:>9.1f}ms'
+                      f'{percentile(durations, .99) * 1000:>9.1f}ms'
+                      f'{peak / 2 ** 20:>10.2f}MiB')
+    backend.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0])
+    parser.add_argument('name_filter', nargs='?', default='',
+                        help='only run the functions whose name contains it')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated sizes')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='latency of the fake apis, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='fraction of the requests failing')
+    parser.add_argument('--transport', choices=['httplib2', 'httpx'],
+                        help='default: the one of the package config')
+    arguments = parser.parse_args()
+    main(arguments.runs, tuple(map(int, arguments.sizes.split(','))),
+         arguments.latency, arguments.error_rate, arguments.name_filter,
+         arguments.transport)
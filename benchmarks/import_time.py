@@ -0,0 +1,46 @@
+"""Measure the cold-start import cost of each submodule of the package
+
+Each submodule is imported in fresh python processes, with
+`python -X importtime`. The reported time is the cumulative import time of
+the submodule, including the third-party modules it loads.
+
+Usage: python benchmarks/import_time.py [number of runs]
+"""
+
+import subprocess
+import sys
+import statistics
+
+SUBMODULES = ['google_services', 'google_services.config',
+              'google_services.credentials', 'google_services.discovery',
+              'google_services.pool', 'google_services.drive',
+              'google_services.drive_index', 'google_services.mail',
+              'google_services.aio']
+
+
+def import_time(module: str)->float:
+    """Cumulative import time of `module`, in seconds, in a new process"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True).stderr
+    for line in reversed(stderr.splitlines()):
+        _, cumulative, name = line.split('|')
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise ValueError(f'{module} not found in the -X importtime output')
+
+
+def main(runs: int=5):
+    for module in SUBMODULES:
+        try:
+            durations = [import_time(module) for _ in range(runs)]
+        except subprocess.CalledProcessError:
+            print(f'{module:>28}: import failed')
+            continue
+        print(f'{module:>28}: median {statistics.median(durations) * 1000:7.1f}'
+              f' ms over {runs} runs')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""Measure the time needed to build the google-api services
+
+Compares, in fresh python processes, building the drive and gmail services
+with `googleapiclient.discovery.build` (discovery documents fetched over the
+network) and with `discovery.build_service` (discovery documents read from
+the local cache).
+
+Usage: python benchmarks/startup.py [number of runs]
+"""
+
+import subprocess
+import sys
+import statistics
+
+BUILD = '''
+import time
+from httplib2 import Http
+from googleapiclient.discovery import build
+start = time.perf_counter()
+build('drive', 'v3', http=Http())
+build('gmail', 'v1', http=Http())
+print(time.perf_counter() - start)
+'''
+
+CACHED_BUILD = '''
+import time
+from httplib2 import Http
+from google_services.discovery import build_service
+start = time.perf_counter()
+build_service('drive', 'v3', http=Http())
+build_service('gmail', 'v1', http=Http())
+print(time.perf_counter() - start)
+'''
+
+
+def measure(code: str, runs: int)->list:
+    """Durations, in seconds, of `runs` executions of `code` in new
+    processes"""
+    return [float(subprocess.run([sys.executable, '-c', code],
+                                 check=True, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True).stdout)
+            for _ in range(runs)]
+
+
+def main(runs: int=5):
+    # Makes sure the cache is populated
+    measure(CACHED_BUILD, 1)
+    for name, code in [('discovery.build', BUILD),
+                       ('cached build_service', CACHED_BUILD)]:
+        try:
+            durations = measure(code, runs)
+        except subprocess.CalledProcessError:
+            print(f'{name:>22}: failed')
+            continue
+        print(f'{name:>22}: median {statistics.median(durations) * 1000:.1f}'
+              f' ms, max {max(durations) * 1000:.1f} ms over {runs} runs')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,84 @@
+"""Count the TLS handshakes of a drive + gmail workload
+
+Runs `drive.get_files` followed by `mail.send_file`, a number of times, with:
+- one `httplib2.Http` per service, as the package used to do,
+- the services of a `pool.ServicePool` over an `HttplibTransport`,
+- the services of a `pool.ServicePool` over an `Http2Transport`, if `httpx`
+  and `h2` are installed.
+
+Handshakes are counted as calls to `ssl.SSLContext.wrap_socket`. Requires
+valid credentials (see `credentials.get_creds`), and sends the mails to
+the given address.
+
+Usage: python benchmarks/tls_handshakes.py mail_address [number of runs]
+"""
+
+import ssl
+import sys
+import time
+
+from google_services import drive, mail
+from google_services.credentials import get_creds
+from google_services.discovery import build_service
+from google_services.pool import ServicePool
+from google_services.transport import (
+    HttplibTransport, Http2Transport, http2_available)
+
+handshakes = 0
+_wrap_socket = ssl.SSLContext.wrap_socket
+
+
+def _counting_wrap_socket(*args, **kwargs):
+    global handshakes
+    handshakes += 1
+    return _wrap_socket(*args, **kwargs)
+
+
+ssl.SSLContext.wrap_socket = _counting_wrap_socket
+
+
+def separate_services()->tuple:
+    """Drive and gmail services, each with its own http object"""
+    from httplib2 import Http
+
+    credentials = get_creds()
+    return (build_service('drive', 'v3', http=credentials.authorize(Http())),
+            build_service('gmail', 'v1', http=credentials.authorize(Http())))
+
+
+def pooled_services(transport)->tuple:
+    """Drive and gmail services sharing the connections of `transport`"""
+    pool = ServicePool(transport=transport)
+    return pool.get('drive', 'v3'), pool.get('gmail', 'v1')
+
+
+def measure(services: tuple, mail_address: str, runs: int)->tuple:
+    """Number of handshakes and duration, in seconds, of `runs` workloads"""
+    global handshakes
+    drive_service, gmail_service = services
+    handshakes = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        files = drive.get_files("trashed = false", service=drive_service)
+        mail.send_file(mail_address, 'tls handshakes benchmark',
+                       files[0]['id'] if files else '', service=gmail_service)
+    return handshakes, time.perf_counter() - start
+
+
+def main(mail_address: str, runs: int=5):
+    # Loads the credentials and discovery documents before measuring
+    get_creds()
+    scenarios = [('separate Http()', separate_services),
+                 ('HttplibTransport',
+                  lambda: pooled_services(HttplibTransport()))]
+    if http2_available():
+        scenarios.append(('Http2Transport',
+                          lambda: pooled_services(Http2Transport())))
+    for name, services in scenarios:
+        count, duration = measure(services(), mail_address, runs)
+        print(f'{name:>16}: {count} handshakes, '
+              f'{duration / runs * 1000:.0f} ms per workload over {runs} runs')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], *map(int, sys.argv[2:]))
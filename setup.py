@@ -25,6 +25,15 @@ setup_params = dict(
         "google-api-python-client==1.7.*",
         "httplib2==0.12.*"
     ],
+    extras_require={
+        # asyncio interface: google_services.aio
+        "aio": ["aiohttp==3.*"],
+        # Shared connection pool, with HTTP/2 multiplexing
+        "http2": ["httpx[http2]"],
+        # Metrics and traces adapters: google_services.metrics
+        "prometheus": ["prometheus-client"],
+        "opentelemetry": ["opentelemetry-api"],
+    },
 
     # Tell where the source code for the package is located
     package_dir={"": "src"},
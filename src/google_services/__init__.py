@@ -1,2 +1,22 @@
-import google_services.drive as drive
-import google_services.mail as mail
+"""High-level wrappers around the google drive and gmail apis
+
+The submodules are imported on first access (ex: `google_services.mail`),
+so that importing the package stays cheap.
+
+"""
+
+import importlib
+
+_SUBMODULES = {'drive', 'mail', 'config', 'credentials', 'discovery',
+               'drive_index', 'pool', 'aio', 'transport', 'retry',
+               'quota', 'fake', 'metrics', 'cache'}
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -3,17 +3,34 @@
 """
 
 from functools import wraps
-import pickle
+import inspect
 import logging
+import json
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from google_services import metrics
+from google_services.cache import cached
 
 FORMAT = '%(asctime)s - %(levelname)s - %(message)s - %(filename)s:%(lineno)d'
-logging.basicConfig(format=FORMAT, datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger('default')
 logger.setLevel(logging.INFO)
 
 
-# https://stackoverflow.com/questions/4669391/
-# python-anyone-have-a-memoizing-decorator-that-can-handle-unhashable-arguments
+def configure_logging():
+    """Print the logs of the package, with timestamps and locations
+
+    Not done at import: configuring the logging is left to the application.
+    """
+    logging.basicConfig(format=FORMAT, datefmt='%d/%m/%Y %H:%M:%S')
+
+
 def memoize(f: callable)->callable:
     """Memoization decorator
 
@@ -21,26 +38,73 @@ def memoize(f: callable)->callable:
     has already been called with will just return the results from the first
     call, without actually re-running the function.
 
-    Caching is done with regard to the recursive dump of the representation
-    of the arguments in memory: any change to in-memory components of the
-    arguments will be detected. Changes to remote (ex: on cloud) or hard-drive
-    files will not.
+    Kept for compatibility, see `cache.cached` for bounded caches.
 
     Args:
         f (callable): the function that should use memoization
     Returns:
         callable: a version of f using memoization
     """
-    memo = {}
+    return cached(max_size=None)(f)
+
+
+class FileLock:
+    """Lock shared by the threads of the process and by the other processes
+
+    The processes are synchronized through an advisory lock on `path`, the
+    threads of the process through a regular lock. Implements the
+    `acquire`/`release` interface of `threading.Lock`, and can be used as a
+    context manager.
+
+    Attributes:
+        path (Path): the file locked, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, 'a')
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK only retries for 10 seconds
+                        pass
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+        finally:
+            self._file = None
+            self._thread_lock.release()
 
-    @wraps(f)
-    def helper(*args, **kwargs):
-        key = pickle.dumps(args, 1) + pickle.dumps(kwargs, 1)
-        if key not in memo.keys():
-            memo[key] = f(*args, **kwargs)
+    def __enter__(self):
+        self.acquire()
+        return self
 
-        return memo[key]
-    return helper
+    def __exit__(self, *exc_info):
+        self.release()
 
 
 def apply_defaults(**default_args_getter)->callable:
@@ -52,6 +116,9 @@ def apply_defaults(**default_args_getter)->callable:
     This is useful to create the google-api services. Indeed, we only know
     which credentials to use at run-time, not at import time.
 
+    The calls of the decorated function are reported to the metrics hooks,
+    see `metrics.measure_call`. Coroutine functions are not.
+
     Args:
         **default_args_getter (dict of {arg_name: callable} pairs): a dictionary
             specifying a function to call (with no arguments) to get the
@@ -68,6 +135,11 @@ def apply_defaults(**default_args_getter)->callable:
         Returns:
             helper (callable): the wrapper, behaving as f
         """
+        # Reported as "<module>.<function>", ex: "drive.get_files"
+        name = f"{f.__module__.rsplit('.', 1)[-1]}.{f.__name__}"
+        generator = inspect.isgeneratorfunction(f)
+        measured = not (inspect.iscoroutinefunction(f)
+                        or inspect.isasyncgenfunction(f))
 
         @wraps(f)
         def helper(*args, **kwargs):
@@ -92,6 +164,170 @@ def apply_defaults(**default_args_getter)->callable:
                    if arg not in kwargs.keys()
                    or kwargs[arg] is None}
             }
+            if measured and metrics.hooks.enabled:
+                return metrics.measure_call(
+                    name, lambda: f(*args, **kwargs), generator)
             return f(*args, **kwargs)
         return helper
     return decorator
+
+
+# Status codes for which a failed request is worth re-sending. Other status
+# codes are only retried for the reasons of RETRYABLE_REASONS, and no status
+# code is for the reasons of PERMANENT_REASONS. See `is_retryable`
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded',
+                     'backendError', 'internalError'}
+# Rate limitations: the request was refused before being processed
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+# Quotas exhausted until the next day
+PERMANENT_REASONS = {'dailyLimitExceeded', 'quotaExceeded'}
+
+
+def error_reasons(error)->set:
+    """Reason codes of an api error, ex: {"rateLimitExceeded"}
+
+    Args:
+        error (googleapiclient.errors.HttpError): the error returned by the
+            api
+
+    Returns:
+        set of str, empty if the error content can not be parsed
+    """
+    try:
+        content = error.content
+        if isinstance(content, bytes):
+            content = content.decode()
+        return {e.get('reason')
+                for e in json.loads(content)['error'].get('errors', [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def is_retryable(error, idempotent: bool=True)->bool:
+    """Tell if an api error is transient and the request worth re-sending
+
+    Args:
+        error (googleapiclient.errors.HttpError): the error returned by the
+            api
+        idempotent (bool): whether the request can be repeated safely. If
+            False, only the errors of requests certainly not processed, the
+            rate limitations, are retryable: a server error can happen
+            after the request was processed, ex: after a file was created.
+
+    Returns:
+        bool, True for server errors and rate limitations
+    """
+    reasons = error_reasons(error)
+    if reasons & PERMANENT_REASONS:
+        return False
+    if not idempotent:
+        return (int(error.resp.status) == 429
+                or bool(reasons & RATE_LIMIT_REASONS))
+    return (int(error.resp.status) in RETRYABLE_STATUSES
+            or bool(reasons & RETRYABLE_REASONS))
+
+
+def parse_response(request, parse: bool=True):
+    """Choose whether a google-api request parses its json response
+
+    Skipping the parsing saves its time for the calls whose result is not
+    used ("fire-and-forget"). Error responses are still raised as
+    `googleapiclient.errors.HttpError`.
+
+    Args:
+        request (HttpRequest): the request, not executed yet
+        parse (bool): if False, the request returns the raw bytes of the
+            response instead of the parsed json
+
+    Returns:
+        the request
+    """
+    if not parse:
+        from googleapiclient.model import MediaModel
+
+        request.postproc = MediaModel().response
+    return request
+
+
+def execute_batch(service, requests: list, batch_size: int=100,
+                  retries: int=None, policy=None)->list:
+    """Execute api requests grouped into batch http requests
+
+    Requests are sent by groups of `batch_size` in a single http round trip.
+    Sub-requests failing with a transient error (see `is_retryable`) are
+    re-sent in new batches, after the delays of the retry policy, unless the
+    circuit breaker of the api opens (see `retry.py`). The ones that
+    succeeded are not re-sent. A batch failing as a whole with a transient
+    error is retried like a single request (see `retry.call`). The requests
+    that can not be repeated safely, ex: creating files, are only re-sent
+    after errors showing that they were not processed. The functions calling
+    it should not be retried as a whole, which would re-send the requests
+    that succeeded.
+
+    Documentation link:
+    https://developers.google.com/drive/api/v3/batch
+
+    Args:
+        service (google-api-service): the service the requests were built
+            from
+        requests (list of HttpRequest): the requests to execute. They should
+            not be executed yet.
+        batch_size (int): maximum number of sub-requests per batch. The api
+            accepts at most 100.
+        retries (int): how many times failed sub-requests can be re-sent.
+            Default: one less than the attempts of `policy`
+        policy (retry.RetryPolicy): Default: `retry.default_policy`
+
+    Returns:
+        list of (result, error) tuples, in the order of `requests`. `error` is
+        None if the request succeeded, and the api error
+        (googleapiclient.errors.HttpError) otherwise.
+    """
+    from google_services import quota, retry
+
+    policy = policy or retry.default_policy
+    if retries is None:
+        retries = policy.max_attempts - 1
+    results = [(None, None)] * len(requests)
+    pending = list(range(len(requests)))
+    idempotent = [retry.is_idempotent(request) for request in requests]
+    for attempt in range(retries + 1):
+        failed = []
+
+        def callback(request_id, response, error):
+            index = int(request_id)
+            results[index] = (response, error)
+            if error is not None and is_retryable(error, idempotent[index]):
+                failed.append(index)
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            indexes = pending[start:start + batch_size]
+            for index in indexes:
+                # Each sub-request counts in the quotas
+                quota.acquire(requests[index])
+                batch.add(requests[index], request_id=str(index))
+            # The whole batch can also fail with a transient error
+            retry.call(
+                lambda: metrics.measure_batch(
+                    [requests[index] for index in indexes],
+                    lambda http: batch.execute(http=http),
+                    lambda: [results[index] for index in indexes]),
+                requests[indexes[0]].methodId.split('.')[0], policy,
+                idempotent=all(idempotent[index] for index in indexes))
+
+        if not failed or attempt == retries:
+            break
+        logger.debug(f'retrying {len(failed)} failed batch requests')
+        delay = max(policy.delay(attempt, results[index][1])
+                    for index in failed)
+        for index in failed:
+            api = requests[index].methodId.split('.')[0]
+            # Each failed sub-request counts, so that the breaker opens when
+            # most of a batch fails
+            retry.get_breaker(api).record_failure()
+            metrics.hooks.retry(api, attempt, delay, results[index][1])
+        time.sleep(delay)
+        pending = sorted(failed)
+    return results
@@ -0,0 +1,17 @@
+"""asyncio interface to the drive and gmail apis
+
+The functions of `google_services.aio.drive` and `google_services.aio.mail`
+mirror the ones of `google_services.drive` and `google_services.mail` as
+coroutines. They send their requests through an aiohttp session keeping its
+connections alive, instead of blocking the event loop.
+
+Their default session (see `default_session`) is closed with the event loop
+when it is run by `asyncio.run`. Otherwise, `await aio.close()` closes it.
+
+Needs the `aiohttp` package: `pip install .[aio]`
+
+"""
+
+import google_services.aio.drive as drive
+import google_services.aio.mail as mail
+from google_services.aio._session import Session, default_session, close
@@ -0,0 +1,197 @@
+"""Asynchronous http session authorized for the google-api
+
+"""
+
+import asyncio
+import json
+import weakref
+
+from google_services.credentials import get_creds, refresh, expires_soon
+from google_services._utilities import logger
+
+# The different components of the python google-api-wrapper
+from googleapiclient.errors import HttpError
+from httplib2 import Http, Response
+
+import aiohttp
+
+
+class Session:
+    """aiohttp session adding the oauth2 token to the requests
+
+    Connections are kept alive and reused by the following requests. The
+    token is refreshed shortly before it expires, by one coroutine while the
+    others wait for it (see `credentials.refresh`).
+
+    The connections are closed by `close`, or when leaving the session used
+    as an async context manager:
+
+        async with Session() as session:
+            await drive.get_files(query, session=session)
+
+    Attributes:
+        credentials_getter (callable): called with no arguments to get the
+            credentials to authorize the requests with
+        limit (int): maximum number of simultaneous connections
+    """
+
+    def __init__(self, credentials_getter: callable=get_creds,
+                 limit: int=100):
+        self.credentials_getter = credentials_getter
+        self.limit = limit
+        self._session = None
+        self._refresh_lock = None
+
+    def _client(self)->aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit))
+            self._refresh_lock = asyncio.Lock()
+        return self._session
+
+    async def _token(self, force_refresh: bool=False)->str:
+        credentials = self.credentials_getter()
+        if not force_refresh and not expires_soon(credentials):
+            return credentials.access_token
+        token = credentials.access_token
+        async with self._refresh_lock:
+            # Another coroutine may have refreshed it in the meantime
+            if credentials.access_token == token:
+                loop = asyncio.get_running_loop()
+                if force_refresh:
+                    logger.info('refreshing token')
+                    await loop.run_in_executor(
+                        None, credentials.refresh, Http())
+                else:
+                    await loop.run_in_executor(None, refresh, credentials)
+        return credentials.access_token
+
+    async def _send(self, method: str, url: str, params: dict=None,
+                    headers: dict=None, **kwargs):
+        params = {key: str(value).lower() if isinstance(value, bool)
+                  else value
+                  for key, value in (params or {}).items()
+                  if value is not None}
+        session = self._client()
+        for attempt in range(2):
+            token = await self._token(force_refresh=attempt > 0)
+            response = await session.request(
+                method, url, params=params,
+                headers={**(headers or {}),
+                         'authorization': f'Bearer {token}'},
+                **kwargs)
+            if response.status != 401:
+                break
+            response.release()
+        if response.status >= 300:
+            content = await response.read()
+            raise HttpError(Response({'status': response.status,
+                                      **response.headers}),
+                            content, uri=url)
+        return response
+
+    async def request(self, method: str, url: str, params: dict=None,
+                      headers: dict=None, parse: bool=True, **kwargs):
+        """Send a request to the api
+
+        Args:
+            method (str): http method
+            url (str): url of the api method
+            params (dict): query parameters. None values are left out, and
+                booleans sent as "true"/"false"
+            headers (dict): extra headers
+            parse (bool): parse the json response. If False, the raw bytes
+                are returned.
+            **kwargs: passed to `aiohttp.ClientSession.request`, ex: `json`
+                or `data`
+        Returns:
+            the parsed json response, an empty string if the response is
+            empty
+        Raises:
+            googleapiclient.errors.HttpError if the request failed
+        """
+        response = await self._send(method, url, params, headers, **kwargs)
+        async with response:
+            content = await response.read()
+        if not parse:
+            return content
+        return json.loads(content) if content else ''
+
+    async def stream(self, method: str, url: str, params: dict=None,
+                     headers: dict=None, chunk_size: int=1024 * 1024):
+        """Send a request to the api and stream the response's content
+
+        Args: see `request`
+            chunk_size (int): maximum size of the yielded chunks
+        Yields:
+            bytes, successive chunks of the response's content
+        """
+        response = await self._send(method, url, params, headers)
+        async with response:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def close(self):
+        """Close the connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_sessions = weakref.WeakKeyDictionary()
+# Tasks closing the default sessions, by loop
+_closers = weakref.WeakKeyDictionary()
+
+
+async def _close_on_shutdown(session: Session):
+    """Wait until cancelled, then close `session`
+
+    `asyncio.run` cancels the remaining tasks of its loop before closing it.
+    The loop is then forgotten: the task would keep it alive otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.create_future()
+    finally:
+        if _sessions.get(loop) is session:
+            del _sessions[loop]
+            _closers.pop(loop, None)
+        await session.close()
+
+
+def default_session()->Session:
+    """Lazy getter for the default session to use
+
+    aiohttp sessions are bound to an event loop: each loop gets its own,
+    closed when the loop shuts down through `asyncio.run`, or by `close`.
+    Must be called from a coroutine, the functions of `aio.drive` and
+    `aio.mail` call it when they run, not when they are called.
+
+    Raises:
+        RuntimeError if no event loop is running
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _sessions:
+        _sessions[loop] = Session()
+        # Referenced here, since the loop only keeps weak references to its
+        # tasks
+        _closers[loop] = loop.create_task(_close_on_shutdown(_sessions[loop]))
+    return _sessions[loop]
+
+
+async def close():
+    """Close the default session of the running loop, see `default_session`
+    """
+    loop = asyncio.get_running_loop()
+    closer = _closers.pop(loop, None)
+    if closer is not None:
+        closer.cancel()
+    session = _sessions.pop(loop, None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,226 @@
+"""asyncio wrapper around the google-drive api
+
+See `google_services.drive` for the synchronous version.
+
+"""
+
+from pathlib import Path
+
+from google_services._utilities import logger
+from google_services.aio._session import default_session
+from google_services.drive import FOLDER_MIME_TYPE
+
+import aiohttp
+
+API_URL = 'https://www.googleapis.com/drive/v3/files'
+UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+
+
+async def iter_files(query: str, fields: str='id, name', page_size: int=1000,
+                     corpora: str=None, order_by: str=None, session=None):
+    """Lazily query google drive for files matching `query`
+
+    Args:
+        query (str): a drive-file-search-query. Documentation link:
+            https://developers.google.com/drive/api/v3/search-parameters
+        fields (str): the file fields to fetch, ex: "id, name, parents"
+        page_size (int): number of files requested per page, at most 1000
+        corpora (str): bodies of items to query, ex: "user" or "allDrives"
+        order_by (str): sort keys, ex: "modifiedTime desc, name"
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Yields:
+        dict, file information records of the files in the drive matching
+        the query
+    """
+    logger.info('iterating over files')
+    session = session or default_session()
+    logger.debug(f'query = {query}')
+    page_token = None
+    while True:
+        page = await session.request('GET', API_URL, params=dict(
+            q=query,
+            fields=f"nextPageToken, files({fields})",
+            pageSize=page_size,
+            corpora=corpora,
+            orderBy=order_by,
+            pageToken=page_token))
+        for file in page.get('files', []):
+            yield file
+
+        page_token = page.get('nextPageToken', None)
+        if page_token is None:
+            break
+
+
+async def get_files(query: str, fields: str='id, name',
+                    session=None)->list:
+    """Query google drive for files matching `query`, see `iter_files`
+
+    Returns:
+        list of dict, file information records
+    """
+    logger.info('getting files')
+    session = session or default_session()
+    return [file async for file in iter_files(query, fields=fields,
+                                              session=session)]
+
+
+async def create_folder(folder_name: str, parent_folder_id: str=None,
+                        session=None)->dict:
+    """Create a new folder in the user's drive
+
+    Args:
+        folder_name (str): name of the folder to create
+        parent_folder_id (str): Id of a folder to put the new folder into
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+
+    Returns:
+        dict, id and name of the folder
+    """
+    logger.info('creating folder')
+    session = session or default_session()
+    file_metadata = {
+        'name': folder_name,
+        'mimeType': FOLDER_MIME_TYPE
+    }
+    if parent_folder_id is not None:
+        file_metadata["parents"] = [parent_folder_id]
+    return await session.request('POST', API_URL, params={'fields': 'id, name'},
+                                 json=file_metadata)
+
+
+async def copy_file(source_file_id: str, new_file_name: str,
+                    parent_folder_id: str=None, session=None)->dict:
+    """Duplicate a file inside the user's drive
+
+    Args:
+        source_file_id (str): Id of the file to copy
+        new_file_name (str): Name to give to the copy
+        parent_folder_id (str): Id of a folder to put the copy into
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        dict containing the id and name of the created file
+    """
+    logger.info('copying file')
+    session = session or default_session()
+    request_body = {
+        "name": new_file_name,
+    }
+    if parent_folder_id is not None:
+        request_body["parents"] = [parent_folder_id]
+    return await session.request('POST', f'{API_URL}/{source_file_id}/copy',
+                                 json=request_body)
+
+
+async def _upload(session, method: str, url: str, source_file_path: str,
+                  file_name: str, parent_folder_id: str)->dict:
+    """Send a file and its metadata in one multipart request
+
+    The content of the file is streamed from the disk.
+    """
+    source_file_path = Path(source_file_path).expanduser()
+    request_body = {
+        'name': file_name or source_file_path.name,
+        'mimeType': '*/*'
+    }
+    if parent_folder_id is not None:
+        request_body["parents"] = [parent_folder_id]
+    with source_file_path.open('rb') as content, \
+            aiohttp.MultipartWriter('related') as body:
+        body.append_json(request_body)
+        body.append(content, {'Content-Type': '*/*'})
+        return await session.request(method, url,
+                                     params={'uploadType': 'multipart'},
+                                     data=body)
+
+
+async def create_file(source_file_path: str, file_name: str=None,
+                      parent_folder_id: str=None, session=None)->dict:
+    """Upload a file from the local machine into a new file on the drive
+
+    Args:
+        source_file_path (str): Path to the file to upload
+        file_name (str): If None, the name of the file will be used
+        parent_folder_id (str): Id of a folder to put the file into
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        dict containing the id and name of the created file
+    """
+    logger.info('creating file')
+    session = session or default_session()
+    return await _upload(session, 'POST', UPLOAD_URL, source_file_path,
+                         file_name, parent_folder_id)
+
+
+async def update_file(source_file_path: str, file_id: str,
+                      file_name: str=None, session=None)->dict:
+    """Upload a file from the local machine into an existing file on the drive
+
+    Args:
+        source_file_path (str): Path to the file to upload
+        file_id (str): Id of the file to update
+        file_name (str): If None, the name of the file will be used
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        dict containing the id and name of the updated file
+    """
+    logger.info('updating file')
+    session = session or default_session()
+    return await _upload(session, 'PATCH', f'{UPLOAD_URL}/{file_id}',
+                         source_file_path, file_name, None)
+
+
+async def download_file(file_id: str, session=None)->bytes:
+    """Download a file and return it in a variable
+
+    Args:
+        file_id (str): Id of the file to download
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        the content of the file
+    """
+    logger.info('downloading file')
+    session = session or default_session()
+    return await session.request('GET', f'{API_URL}/{file_id}',
+                                 params={'alt': 'media'}, parse=False)
+
+
+async def iter_download(file_id: str, chunk_size: int=1024 * 1024,
+                        session=None):
+    """Download a file chunk by chunk
+
+    Args:
+        file_id (str): Id of the file to download
+        chunk_size (int): maximum size in bytes of the chunks
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Yields:
+        bytes, the successive chunks of the content of the file
+    """
+    logger.info('streaming file')
+    session = session or default_session()
+    async for chunk in session.stream('GET', f'{API_URL}/{file_id}',
+                                      params={'alt': 'media'},
+                                      chunk_size=chunk_size):
+        yield chunk
+
+
+async def delete_file(file_id: str, session=None):
+    """Delete a file in the user's drive
+
+    Args:
+        file_id (str): Id of the file to delete
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        an empty string if successful
+    """
+    logger.info("deleting file")
+    session = session or default_session()
+    return await session.request('DELETE', f'{API_URL}/{file_id}')
@@ -0,0 +1,194 @@
+"""asyncio wrapper around the gmail api
+
+See `google_services.mail` for the synchronous version.
+
+"""
+
+from pathlib import Path
+
+from google_services._utilities import logger
+from google_services.aio._session import default_session
+from google_services.mail import create_mail
+
+import aiohttp
+
+API_URL = 'https://gmail.googleapis.com/gmail/v1/users'
+UPLOAD_URL = 'https://gmail.googleapis.com/upload/gmail/v1/users'
+
+
+async def get_labels(session=None)->list:
+    """Fetches all existing labels in the user's inbox
+
+    Args:
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        list of dict, label information records
+    """
+    logger.info('fetching labels')
+    session = session or default_session()
+    return (await session.request('GET', f'{API_URL}/me/labels')).get(
+        'labels', [])
+
+
+async def create_label(label_name: str, session=None)->dict:
+    """Create a label with the specified name in the user's inbox
+
+    Args:
+        label_name(str): Name of the label to create
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        dict containing the id and name of the created label
+    """
+    logger.info('creating label')
+    session = session or default_session()
+    return await session.request('POST', f'{API_URL}/me/labels', json={
+        'messageListVisibility': 'show',
+        'name': label_name,
+        'labelListVisibility': 'labelShow'})
+
+
+async def delete_label(label_id: str, session=None):
+    """Delete the label with the specified id
+
+    Args:
+        label_id(str): Id of the label to delete
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    """
+    logger.info('deleting label')
+    session = session or default_session()
+    await session.request('DELETE', f'{API_URL}/me/labels/{label_id}')
+
+
+async def send(user_id: str, mime_msg: dict, session=None)->dict:
+    """Send an email message.
+
+    Args:
+        user_id (str): User's email address. The special value
+            "me" can be used to indicate the authenticated user.
+        mime_msg (dict): Message to be sent, see `mail.create_mail`.
+            Messages created with attachments are uploaded from their file.
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        dict containing information about the message sent, including it's id
+    """
+    logger.info('sending mail')
+    session = session or default_session()
+    if 'file' not in mime_msg:
+        return await session.request(
+            'POST', f'{API_URL}/{user_id}/messages/send', json=mime_msg)
+    body = {key: value for key, value in mime_msg.items() if key != 'file'}
+    url = f'{UPLOAD_URL}/{user_id}/messages/send'
+    with Path(mime_msg['file']).open('rb') as content:
+        if not body:
+            return await session.request(
+                'POST', url, params={'uploadType': 'media'},
+                headers={'Content-Type': 'message/rfc822'}, data=content)
+        with aiohttp.MultipartWriter('related') as multipart:
+            multipart.append_json(body)
+            multipart.append(content, {'Content-Type': 'message/rfc822'})
+            return await session.request(
+                'POST', url, params={'uploadType': 'multipart'},
+                data=multipart)
+
+
+async def send_file(mail_address: str, mail_subject: str, file_id: str,
+                    session=None, sender: str='send.file@google.api')->dict:
+    """Send a mail with a link to a google doc, see `mail.send_file`
+
+    Returns:
+        dict, information about the message used to send the file, including
+        it's id
+    """
+    logger.info('sending file')
+    session = session or default_session()
+    message = create_mail(
+        sender,
+        mail_address,
+        mail_subject,
+        f"<a href=https://docs.google.com/document/d/{file_id}>"
+        f"Project description</a>",
+        f"https://docs.google.com/document/d/{file_id}")
+    return await send('me', message, session=session)
+
+
+async def iter_messages(query: str, max_results: int=500, session=None):
+    """Lazily list messages matching the specified query
+
+    Args:
+        query (str): a gmail-message-search-query. Documentation link:
+            https://support.google.com/mail/answer/7190?hl=en
+        max_results (int): number of messages requested per page, at most
+            500
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Yields:
+        dict, the ids (and thread ids) of the messages matching the query
+    """
+    logger.info('iterating over mails')
+    session = session or default_session()
+    page_token = None
+    while True:
+        response = await session.request(
+            'GET', f'{API_URL}/me/messages',
+            params=dict(q=query, maxResults=max_results,
+                        pageToken=page_token))
+        for message in response.get('messages', []):
+            yield message
+
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            break
+
+
+async def get_messages(query: str, session=None)->list:
+    """List messages matching the specified query, see `iter_messages`
+
+    Returns:
+        List of Messages that match the criteria of the query
+    """
+    logger.info('getting mails')
+    session = session or default_session()
+    return [message async for message in iter_messages(query,
+                                                       session=session)]
+
+
+async def archive_message(message_id: str, extra_labels: str=None,
+                          session=None):
+    """Mark a message with a label, as read and archive it
+
+    Args:
+        message_id (str): Id of the message to archive
+        extra_labels (str): Id of a label to add to the message
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        the api request's result
+    """
+    logger.info('archiving mail')
+    session = session or default_session()
+    body = {"removeLabelIds": ['UNREAD', 'INBOX']}
+    if extra_labels is not None:
+        body["addLabelIds"] = [extra_labels]
+    return await session.request(
+        'POST', f'{API_URL}/me/messages/{message_id}/modify', json=body)
+
+
+async def move_to_trash(message_id: str, session=None):
+    """Move a message to the trash
+
+    Args:
+        message_id (str): Id of the message to trash
+        session (optional, aio._session.Session): the session to use.
+            Default: the result of `default_session()`
+    Returns:
+        the api request's result
+    """
+    logger.info('moving mail to trash')
+    session = session or default_session()
+    return await session.request(
+        'POST', f'{API_URL}/me/messages/{message_id}/modify',
+        json={"addLabelIds": ['TRASH']})
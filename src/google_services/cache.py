@@ -0,0 +1,214 @@
+"""Bounded, thread-safe in-memory caches
+
+`Cache` is an LRU cache with an optional time-to-live. When several threads
+ask for the same missing key, only one computes the value while the others
+wait for it. Each cache keeps hit, miss, eviction and fill time statistics.
+
+`cached` turns a function into one caching its results, ex: the loaded
+credentials in `credentials.get_creds`.
+
+The lookups in named caches are reported to the metrics hooks (see
+`metrics.py`).
+
+"""
+
+from functools import wraps
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from google_services import metrics
+
+
+def make_key(args: tuple, kwargs: dict):
+    """Cache key for a function call
+
+    The arguments themselves are used when they are hashable. Otherwise,
+    the key is their pickled representation: any change to the in-memory
+    content of the arguments will then give a different key.
+
+    Args:
+        args (tuple): positional arguments of the call
+        kwargs (dict): keyword arguments of the call
+
+    Returns:
+        hashable key
+    """
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return pickle.dumps(key, 1)
+    return key
+
+
+class Cache:
+    """LRU cache with an optional time-to-live, safe to use from threads
+
+    Attributes:
+        max_size (int): maximum number of entries. If None, the cache is
+            unbounded.
+        ttl (float): time in seconds after which an entry expires. If None,
+            entries never expire.
+        name (str): name under which the lookups are reported to the
+            metrics hooks, ex: "drive.path_cache". If None, they are not.
+    """
+
+    def __init__(self, max_size: int=128, ttl: float=None, name: str=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._filling = {}
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, evictions=0, fills=0,
+                           fill_time=0., max_fill_time=0.)
+
+    def _lookup(self, key):
+        """Value of `key`, or `_MISSING`. To call with the lock held"""
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        value, stored_at = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """Value stored for `key`, or `default` if there is none"""
+        with self._lock:
+            value = self._lookup(key)
+            hit = value is not _MISSING
+            self._stats['hits' if hit else 'misses'] += 1
+        self._report(hit)
+        return value if hit else default
+
+    def _report(self, hit: bool):
+        if self.name is not None and metrics.hooks.enabled:
+            metrics.hooks.cache(self.name, hit)
+
+    def set(self, key, value):
+        """Store `value` for `key`, evicting the least recently used
+        entries if the cache is full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while (self.max_size is not None
+                   and len(self._entries) > self.max_size):
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_or_fill(self, key, fill: callable):
+        """Value stored for `key`, computed with `fill()` if there is none
+
+        If another thread is already computing the value of `key`, waits for
+        its result instead of computing it again.
+
+        Args:
+            key: the key of the value
+            fill (callable): called with no arguments to compute the value
+
+        Returns:
+            the value
+        """
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self._stats['hits'] += 1
+                    break
+                event = self._filling.get(key)
+                if event is None:
+                    self._stats['misses'] += 1
+                    event = self._filling[key] = threading.Event()
+                    break
+            # If the other thread fails, this one tries to fill
+            event.wait()
+        self._report(value is not _MISSING)
+        if value is not _MISSING:
+            return value
+
+        start = time.perf_counter()
+        try:
+            value = fill()
+            self.set(key, value)
+            return value
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                del self._filling[key]
+                self._stats['fills'] += 1
+                self._stats['fill_time'] += duration
+                self._stats['max_fill_time'] = max(
+                    self._stats['max_fill_time'], duration)
+            event.set()
+
+    def invalidate(self, key):
+        """Drop the entry of `key`, if any"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: callable):
+        """Drop the entries for which `predicate(key, value)` is True"""
+        with self._lock:
+            for key in [key for key, (value, _) in self._entries.items()
+                        if predicate(key, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all the entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self)->dict:
+        """Usage statistics of the cache
+
+        Returns:
+            dict with the number of "hits", "misses", "evictions", "fills"
+            (values computed by `get_or_fill`), the total and maximum
+            "fill_time" and "max_fill_time" in seconds, the "hit_rate" and
+            the current "size"
+        """
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+
+_MISSING = object()
+
+
+def cached(max_size: int=128, ttl: float=None)->callable:
+    """Caching decorator
+
+    Calling the decorated function with arguments it has already been called
+    with returns the stored result, without running the function again.
+    Results are stored in a `Cache`, available as the `cache` attribute of
+    the decorated function, ex: `get_creds.cache.clear()`. The cache is
+    named after the function, ex: "credentials.get_creds".
+
+    Args:
+        max_size (int): see `Cache`
+        ttl (float): see `Cache`
+
+    Returns:
+        decorator
+    """
+    def decorator(f: callable):
+        module = f.__module__.rsplit('.', 1)[-1]
+        cache = Cache(max_size, ttl, name=f'{module}.{f.__name__}')
+
+        @wraps(f)
+        def helper(*args, **kwargs):
+            return cache.get_or_fill(make_key(args, kwargs),
+                                     lambda: f(*args, **kwargs))
+        helper.cache = cache
+        return helper
+    return decorator
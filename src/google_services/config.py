@@ -17,6 +17,109 @@ class Config:
             or a `token.json` file. The `client_id.json` corresponds to what
             you can download from
             https://console.developers.google.com/apis/credentials
+
+        token_refresh_margin (float): time in seconds before the expiry of
+            the token from which it is refreshed.
+
+        http_timeout (float): timeout of the requests, in seconds.
+
+        http2 (bool): send the requests through an `httpx` client shared
+            by all the threads, multiplexing them over HTTP/2, when the
+            `httpx` and `h2` packages are installed (see `transport.py`).
+            Off by default.
+
+        http_max_connections (int): maximum number of simultaneous
+            connections of the `httpx` client.
+
+        http_keepalive_expiry (float): time in seconds after which the idle
+            connections of the `httpx` client are closed.
+
+        retry_max_attempts (int): maximum number of attempts of an api call
+            failing with transient errors (see `retry.py`).
+
+        retry_base_delay (float): delay in seconds before retrying a failed
+            api call, doubled at each following retry.
+
+        retry_max_delay (float): maximum delay in seconds between two
+            attempts of an api call.
+
+        circuit_failure_threshold (int): number of transient errors in a row
+            after which the calls to an api are suspended.
+
+        circuit_reset_timeout (float): time in seconds during which the
+            calls to an api are suspended.
+
+        quota_enabled (bool): throttle the requests to stay under the
+            quotas of the apis (see `quota.py`).
+
+        gmail_user_quota, gmail_project_quota (float): gmail quota units
+            allowed per second, per user and per project.
+
+        drive_user_quota, drive_project_quota (float): drive queries
+            allowed per second, per user and per project.
+
+        quota_headroom (float): fraction of the quotas the requests are
+            throttled at.
+
+        quota_burst (float): time in seconds of quota that can be spent in
+            a burst, after a pause.
+
+        upload_checkpoint_path (str): path to the folder in which the
+            sessions of the resumable uploads in progress are stored, so that
+            they can be resumed after a crash.
+
+        upload_chunk_size (int): size in bytes of the chunks sent by
+            resumable uploads. Must be a multiple of 256 KiB.
+
+        resumable_upload_threshold (int): files bigger than this (in bytes)
+            are sent through resumable uploads by default, smaller ones in a
+            single request.
+
+        download_chunk_size (int): size in bytes of the chunks in which files
+            are downloaded by the streaming and parallel downloads.
+
+        drive_index_path (str): path to the sqlite file holding the local
+            index of the drive's files metadata (see `drive_index.py`).
+
+        sync_hash_cache_path (str): path to the file in which `drive.sync`
+            stores the md5 checksums of the local files, so that unchanged
+            files are not hashed again.
+
+        mail_history_path (str): path to the file in which `mail.sync`
+            stores the gmail history id it reached, from which the next
+            synchronization starts.
+
+        label_cache_ttl (float): time in seconds after which the index of
+            the gmail labels is loaded again, to see the labels changed by
+            other clients (see `mail.label_id`).
+
+        path_cache_size (int): maximum number of (parent id, name) pairs
+            kept by the cache of the drive path resolution.
+
+        path_cache_ttl (float): time in seconds after which the entries of
+            the cache of the drive path resolution expire.
+
+        discovery_cache_path (str): path to the folder in which the
+            google-api discovery documents are stored, so that services are
+            built without fetching them (see `discovery.py`).
+
+        discovery_cache_max_age (float): time in seconds after which the
+            stored discovery documents are fetched again. If None, they are
+            only refreshed by `discovery.refresh_document`.
+
+        drive_file_fields (str): fields of the file records returned by the
+            functions creating or changing drive files, when they are not
+            given a `fields` projection, ex: "id, name, parents". See
+            https://developers.google.com/drive/api/v3/fields-parameter
+
+        gmail_message_fields (str): fields of the message records returned
+            by the functions sending or changing mails, when they are not
+            given a `fields` projection.
+
+        gmail_label_fields (str): fields of the label records returned by
+            `mail.get_labels` and `mail.create_label`, when they are not
+            given a `fields` projection. The id and name are always
+            fetched, to index the labels.
     """
     # Oauth2 token:
     # lets the script use your google account identity with the following
@@ -32,6 +135,52 @@ class Config:
         'https://www.googleapis.com/auth/gmail.modify']
 
     credential_path = '~/.google_services_wrapper/'
+    token_refresh_margin = 300
+
+    http_timeout = 60
+    http2 = False
+    http_max_connections = 10
+    http_keepalive_expiry = 60
+
+    retry_max_attempts = 5
+    retry_base_delay = 1
+    retry_max_delay = 64
+    circuit_failure_threshold = 10
+    circuit_reset_timeout = 30
+
+    quota_enabled = True
+    # 250 units per user per second, 1,200,000 per project per minute
+    gmail_user_quota = 250
+    gmail_project_quota = 20000
+    # 12,000 queries per user, and per project, per minute
+    drive_user_quota = 200
+    drive_project_quota = 200
+    quota_headroom = 0.9
+    quota_burst = 1
+
+    upload_checkpoint_path = '~/.google_services_wrapper/uploads/'
+    upload_chunk_size = 40 * 256 * 1024
+    resumable_upload_threshold = 5 * 1024 * 1024
+
+    download_chunk_size = 10 * 1024 * 1024
+
+    drive_index_path = '~/.google_services_wrapper/drive_index.sqlite'
+
+    sync_hash_cache_path = '~/.google_services_wrapper/sync_hashes.json'
+
+    mail_history_path = '~/.google_services_wrapper/mail_history.json'
+    label_cache_ttl = 300
+
+    path_cache_size = 4096
+    path_cache_ttl = 300
+
+    discovery_cache_path = '~/.google_services_wrapper/discovery/'
+    discovery_cache_max_age = 30 * 24 * 3600
+
+    # Partial responses: only what the callers usually need
+    drive_file_fields = 'id, name'
+    gmail_message_fields = 'id, threadId, labelIds'
+    gmail_label_fields = 'id, name, type'
 
 
 default = Config()
@@ -1,17 +1,22 @@
 """Manage integration with the google-api SSO
 
+The token is stored in `token.json`, shared by all the threads and processes
+using the same `credential_path`. Its refreshes are serialized by a lock on
+`token.json.lock`: the first worker to take the lock refreshes the token and
+writes it to `token.json`, the others then read it from there instead of
+refreshing it again.
+
 """
 
 import sys
+from datetime import datetime, timedelta
 from pathlib import Path
-from google_services._utilities import memoize, logger
+from google_services._utilities import logger, FileLock
+from google_services.cache import cached
 from google_services.config import default, Config
 
-# The different components of the python google-api-wrapper
-from oauth2client import file, client, tools
-
 
-@memoize
+@cached(max_size=16)
 def get_creds(
         config: Config=default):
     """Check that the SSO token is valid. If not, asks for a new one.
@@ -29,12 +34,21 @@ def get_creds(
     Note: `oauth2client.tools` bugs if `sys.argv` are specified. This
     function fixes that.
 
+    The credentials are loaded once per config. After rotating the token,
+    call `get_creds.cache.clear()` to load the new one: the services of
+    `pool.default_pool` are then rebuilt with it. Refreshes of the token do
+    not need that: they are shared through `token.json` (see `refresh`).
+
     Args:
         config: a config element as defined in the `config.py` package
 
     Returns:
         credentials that the api can work with
     """
+    # The different components of the python google-api-wrapper. Imported
+    # here since they are slow to load.
+    from oauth2client import file, client, tools
+
     config_path = config.credential_path
     scopes = config.scopes
 
@@ -42,6 +56,9 @@ def get_creds(
     logger.debug(f'config_path: {config_path}')
     config_path = Path(config_path).expanduser()
     store = file.Storage(config_path/'token.json')
+    # Replaces the thread-only lock of the storage, taken by oauth2client
+    # around the refreshes
+    store._lock = FileLock(config_path/'token.json.lock')
     creds = store.get()
 
     if not creds or creds.invalid:
@@ -59,3 +76,87 @@ def get_creds(
         sys.argv = arguments
 
     return creds
+
+
+def expires_soon(creds, margin: float=None, config: Config=default)->bool:
+    """Whether the token is missing or expires in less than `margin` seconds
+
+    Args:
+        creds: credentials, as returned by `get_creds`
+        margin (float): Default: `config.token_refresh_margin`
+        config: a config element as defined in the `config.py` package
+    """
+    if margin is None:
+        margin = config.token_refresh_margin
+    if creds.access_token is None:
+        return True
+    if creds.token_expiry is None:
+        return False
+    return creds.token_expiry - datetime.utcnow() < timedelta(seconds=margin)
+
+
+def refresh(creds, margin: float=None, config: Config=default):
+    """Refresh the token if it expires in less than `margin` seconds
+
+    The refresh is done under the lock of the token storage: if another
+    thread or process refreshed the token in the meantime, its token is
+    loaded from `token.json` instead of asking a new one.
+
+    Args:
+        creds: credentials, as returned by `get_creds`
+        margin (float): time in seconds before the expiry of the token from
+            which it is refreshed. Default: `config.token_refresh_margin`
+        config: a config element as defined in the `config.py` package
+    """
+    if margin is None:
+        margin = config.token_refresh_margin
+    if not expires_soon(creds, margin):
+        return
+    from google_services.transport import default_transport
+
+    http = default_transport(config).http()
+    store = creds.store
+    if store is None:
+        logger.info('refreshing token')
+        creds.refresh(http)
+        return
+    store.acquire_lock()
+    try:
+        stored = store.locked_get()
+        if stored is not None and not stored.invalid \
+                and not expires_soon(stored, margin):
+            logger.info('loading refreshed token')
+            creds._updateFromCredential(stored)
+        elif expires_soon(creds, margin):
+            logger.info('refreshing token')
+            # Writes the new token to the store
+            creds._do_refresh_request(http.request)
+    finally:
+        store.release_lock()
+
+
+def authorize(creds, http, config: Config=default):
+    """Authorize an http object to send requests with the credentials
+
+    Unlike `creds.authorize`, the token is refreshed shortly before it
+    expires (see `refresh`) rather than after a request is rejected.
+
+    Args:
+        creds: credentials, as returned by `get_creds`
+        http (httplib2.Http): the http object to authorize
+        config: a config element as defined in the `config.py` package
+
+    Returns:
+        httplib2.Http, the authorized http object
+    """
+    http = creds.authorize(http)
+    authorized_request = http.request
+
+    def request(*args, **kwargs):
+        refresh(creds, config=config)
+        return authorized_request(*args, **kwargs)
+
+    # Read by googleapiclient to authorize the batch requests
+    request.credentials = creds
+    http.request = request
+    return http
@@ -0,0 +1,128 @@
+"""Local cache of the google-api discovery documents
+
+`googleapiclient.discovery.build` downloads and parses the discovery
+document of an api each time a service is built. Here, the documents are
+stored on disk the first time they are fetched, and services are built from
+the stored copies, without network round trip.
+
+Stored documents are fetched again when they are older than
+`config.default.discovery_cache_max_age`, when they were stored by a
+different `CACHE_VERSION` of the package, or explicitly with
+`refresh_document`.
+
+"""
+
+import json
+import threading
+import time
+from pathlib import Path
+
+from google_services._utilities import logger
+from google_services.config import default as default_config
+
+DISCOVERY_URL = ('https://www.googleapis.com/discovery/v1/apis/'
+                 '{api}/{version}/rest')
+
+# Bump to make the installed packages fetch the documents again, for
+# instance when the package starts using new api methods
+CACHE_VERSION = 1
+
+# Parsed documents, shared by the services built in this process
+_documents = {}
+_lock = threading.Lock()
+
+
+def _document_path(api: str, version: str)->Path:
+    return (Path(default_config.discovery_cache_path).expanduser()
+            / f'{api}.{version}.json')
+
+
+def refresh_document(api: str, version: str)->dict:
+    """Fetch the discovery document of an api and store it
+
+    Args:
+        api (str): name of the api, ex: "drive"
+        version (str): version of the api, ex: "v3"
+
+    Returns:
+        dict, the discovery document
+    """
+    from httplib2 import Http
+
+    logger.info(f'fetching {api} {version} discovery document')
+    url = DISCOVERY_URL.format(api=api, version=version)
+    response, content = Http(timeout=30).request(url)
+    if response.status >= 300:
+        raise IOError(f'could not fetch {url}: {response.status}')
+    document = json.loads(content.decode())
+
+    path = _document_path(api, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix('.tmp')
+    temporary_path.write_text(json.dumps({
+        'cache_version': CACHE_VERSION,
+        'fetched_at': time.time(),
+        'document': document}))
+    # Other processes only ever see complete files
+    temporary_path.replace(path)
+    with _lock:
+        _documents[(api, version)] = document
+    return document
+
+
+def get_document(api: str, version: str)->dict:
+    """Discovery document of an api, from the cache when possible
+
+    If a stored document is outdated but can not be fetched again, the
+    outdated one is used.
+
+    Args:
+        api (str): name of the api, ex: "drive"
+        version (str): version of the api, ex: "v3"
+
+    Returns:
+        dict, the discovery document
+    """
+    with _lock:
+        if (api, version) in _documents:
+            return _documents[(api, version)]
+
+    path = _document_path(api, version)
+    if not path.exists():
+        return refresh_document(api, version)
+    stored = json.loads(path.read_text())
+    max_age = default_config.discovery_cache_max_age
+    if stored.get('cache_version') != CACHE_VERSION or (
+            max_age is not None
+            and time.time() - stored['fetched_at'] > max_age):
+        try:
+            return refresh_document(api, version)
+        except Exception as error:
+            logger.warning(f'using outdated {api} {version} discovery '
+                           f'document: {error}')
+    with _lock:
+        _documents[(api, version)] = stored['document']
+    return stored['document']
+
+
+def build_service(api: str, version: str, http):
+    """Build a google-api service from the cached discovery document
+
+    Equivalent to `googleapiclient.discovery.build(api, version, http=http)`,
+    except that the requests of the service wait for the quotas of the api
+    (see `quota.py`), and are reported to the metrics hooks (see
+    `metrics.py`).
+
+    Args:
+        api (str): name of the api, ex: "drive"
+        version (str): version of the api, ex: "v3"
+        http (httplib2.Http): the (authorized) http object to use
+
+    Returns:
+        The official python wrapper around the api
+    """
+    from googleapiclient.discovery import build_from_document
+    from google_services.quota import request_builder
+
+    return build_from_document(get_document(api, version), http=http,
+                               requestBuilder=request_builder())
@@ -2,83 +2,231 @@
 
 """
 
-from google_services.credentials import get_creds
-from google_services._utilities import memoize, apply_defaults, logger
+from google_services.config import default as default_config
+from google_services.pool import default_pool, pool_like
+from google_services.cache import Cache
+from google_services._utilities import apply_defaults, logger, execute_batch, \
+    parse_response
+from google_services.retry import retrying, execute, call
+from google_services import metrics, quota
 
-# The different components of the python google-api-wrapper
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.discovery import build
-from httplib2 import Http
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import io
+import mmap
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+# Ids of the drive files by (parent id, name), see `resolve_paths`. The
+# functions of this module invalidate the entries related to the changes
+# they make.
+path_cache = Cache(default_config.path_cache_size,
+                   default_config.path_cache_ttl, name='drive.path_cache')
+
+
+def _forget_path(parent_id: str=None, name: str=None, file_id: str=None):
+    """Invalidate the entries of `path_cache` related to a change
+
+    Drops the entry of (parent_id, name), and the ones related to file_id:
+    the entries resolving to it and the ones of its children.
+    """
+    path_cache.invalidate((parent_id or path_cache.get('root'), name))
+    if file_id is not None:
+        path_cache.invalidate_where(
+            lambda key, value: value == file_id or key[0] == file_id)
 
 
-@memoize
 def default_service():
     """Lazy getter for the default drive-api-service to use
 
+    Each thread gets its own service, see `pool.ServicePool`.
+
     Returns:
         The official python wrapper around the drive api
     """
-    logger.info("instantiating google drive service")
-    return build('drive', 'v3', http=get_creds().authorize(Http()))
+    return default_pool.get('drive', 'v3')
+
+
+@apply_defaults(service=default_service)
+def iter_files(query: str, fields: str='id, name', page_size: int=1000,
+               corpora: str=None, order_by: str=None, prefetch: bool=False,
+               service=None):
+    """Lazily query google drive for files matching `query`
+
+    Pages of results are fetched on demand: the first files are available
+    as soon as the first page arrives, and only one page (two with
+    `prefetch`) is held in memory at a time.
+
+    Args:
+        query (str): a drive-file-search-query. Documentation link:
+            https://developers.google.com/drive/api/v3/search-parameters
+        fields (str): the file fields to fetch, ex: "id, name, parents".
+            Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        page_size (int): number of files requested per page, at most 1000
+        corpora (str): bodies of items to query, ex: "user" or "allDrives"
+        order_by (str): sort keys, ex: "modifiedTime desc, name"
+        prefetch (bool): fetch the next page in a background thread while
+            the current one is consumed. The service, and the other default
+            services of the thread, should then not be used by the caller
+            while iterating.
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Yields:
+        dict, file information records of the files in the drive matching
+        the query and accessible within the oauth permissions of the script
+    """
+    logger.info('iterating over files')
+    logger.debug(f'query = {query}')
+    parameters = dict(q=query,
+                      fields=f"nextPageToken, files({fields})",
+                      pageSize=page_size)
+    if corpora is not None:
+        parameters["corpora"] = corpora
+    if order_by is not None:
+        parameters["orderBy"] = order_by
+
+    def get_page(page_token):
+        # Retried alone: a failure does not restart the listing
+        page = execute(service.files().list(
+            pageToken=page_token, **parameters))
+        metrics.hooks.page('drive.files.list', len(page.get('files', [])))
+        return page
+
+    # The worker thread is only started on the first prefetch
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = get_page(None)
+        # We have to cycle on all the pages of the drive,
+        while True:
+            page_token = page.get('nextPageToken', None)
+            next_page = None
+            if prefetch and page_token is not None:
+                next_page = executor.submit(get_page, page_token)
+            yield from page.get('files', [])
+
+            if page_token is None:
+                break
+            page = (next_page.result() if next_page is not None
+                    else get_page(page_token))
 
 
 @apply_defaults(service=default_service)
-def get_files(query: str, service=None)->list:
+def get_files(query: str, fields: str='id, name', service=None)->list:
     """Query google drive for files matching `query`
 
-    If no accessible file matches the query, returns an empty list.
+    If no accessible file matches the query, returns an empty list. Use
+    `iter_files` to process the files while they are being fetched.
     Args:
         query (str): a drive-file-search-query. Documentation link:
             https://developers.google.com/drive/api/v3/search-parameters
+        fields (str): the file fields to fetch, see `iter_files`
         service (optional, drive-api-service): the service to use. Default:
             the result of `default_service()`
     Returns:
         list of dict, file information records. Contains the name & id
-        of the first file in the drive matching the query
+        of the files in the drive matching the query
         and accessible within the oauth permissions of the script
     """
     logger.info('getting files')
-    logger.debug(f'query = {query}')
-    page_token = None
-    files = []
-    # We have to cycle on all the pages of the drive,
-    while True:
-        file_candidates = service.files().list(
-            q=query,
-            fields="nextPageToken, files(id, name)",
-            pageToken=page_token).execute()
-        files += file_candidates.get('files', [])
+    return list(iter_files(query, fields=fields, service=service))
 
-        page_token = file_candidates.get('nextPageToken', None)
-        if page_token is None:
-            break
-    return files
 
+def _create_folder_request(service, folder_name: str,
+                           parent_folder_id: str=None, fields: str=None,
+                           parse: bool=True):
+    """Build the request creating a folder, without executing it"""
+    file_metadata = {
+        'name': folder_name,
+        'mimeType': FOLDER_MIME_TYPE
+    }
+    if parent_folder_id is not None:
+        file_metadata["parents"] = [parent_folder_id]
+    return parse_response(service.files().create(
+        body=file_metadata,
+        fields=fields or default_config.drive_file_fields), parse)
 
+
+@retrying('drive', idempotent=False)
 @apply_defaults(service=default_service)
-def create_folder(folder_name: str, service=None)->dict:
+def create_folder(folder_name: str, parent_folder_id: str=None,
+                  service=None, fields: str=None, parse: bool=True)->dict:
     """Create a new folder in the user's drive
     Args:
         folder_name (str): name of the folder to create
+        parent_folder_id (str): Id of a folder to put the new folder into. If
+            none is specified, the folder will be at the root of the drive.
         service (optional, drive-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): the fields of the folder to return, ex: "id, parents".
+            Default: `config.default.drive_file_fields`. Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
 
     Returns:
-        dict, id and name of the folder
+        dict, the `fields` of the folder, by default its id and name
     """
     logger.info('creating folder')
-    file_metadata = {
-        'name': folder_name,
-        'mimeType': 'application/vnd.google-apps.folder'
+    _forget_path(parent_folder_id, folder_name)
+    return _create_folder_request(
+        service, folder_name, parent_folder_id, fields, parse).execute()
+
+
+@apply_defaults(service=default_service)
+def create_folders(folders: list, service=None, fields: str=None,
+                   parse: bool=True)->list:
+    """Create several folders, through batch requests
+
+    Args:
+        folders (list): names of the folders to create. An item can also be a
+            (folder_name, parent_folder_id) tuple to create the folder inside
+            another one.
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+        fields (str): the fields of the folders to return, ex: "id, parents".
+            Default: `config.default.drive_file_fields`. Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
+
+    Returns:
+        list of (result, error) tuples, in the order of `folders`. `result`
+        is a dict with the `fields` of the folder, `error` is None unless the
+        folder could not be created.
+    """
+    logger.info('creating folders')
+    folders = [(folder, None) if isinstance(folder, str) else folder
+               for folder in folders]
+    for folder_name, parent_folder_id in folders:
+        _forget_path(parent_folder_id, folder_name)
+    return execute_batch(service, [
+        _create_folder_request(service, *folder, fields=fields, parse=parse)
+        for folder in folders])
+
+
+def _copy_file_request(service, source_file_id: str, new_file_name: str,
+                       parent_folder_id: str=None, fields: str=None,
+                       parse: bool=True):
+    """Build the request copying a file, without executing it"""
+    request_body = {
+        "name": new_file_name,
     }
-    return service.files().create(body=file_metadata,
-                                  fields='id, name').execute()
+    if parent_folder_id is not None:
+        request_body["parents"] = [parent_folder_id]
+    return parse_response(service.files().copy(
+        fileId=source_file_id,
+        body=request_body,
+        fields=fields or default_config.drive_file_fields), parse)
 
 
+@retrying('drive', idempotent=False)
 @apply_defaults(service=default_service)
 def copy_file(source_file_id: str, new_file_name: str,
-              parent_folder_id: str=None, service=None)->dict:
+              parent_folder_id: str=None, service=None, fields: str=None,
+              parse: bool=True)->dict:
     """Duplicate a file inside the user's drive
 
     Args:
@@ -88,33 +236,195 @@ def copy_file(source_file_id: str, new_file_name: str,
             is specified, the copy will be at the root of the drive.
         service (optional, drive-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): the fields of the copy to return, ex: "id, parents".
+            Default: `config.default.drive_file_fields`. Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
     Returns:
-        dict containing the id and name of the created file
+        dict containing the `fields` of the created file, by default its id
+        and name
     """
     logger.info('copying file')
-    request_body = {
-        "name": new_file_name,
-    }
-    if parent_folder_id is not None:
-        request_body["parents"] = [parent_folder_id]
-    return service.files().copy(fileId=source_file_id,
-                                body=request_body).execute()
+    _forget_path(parent_folder_id, new_file_name)
+    return _copy_file_request(
+        service, source_file_id, new_file_name, parent_folder_id, fields,
+        parse).execute()
+
+
+@apply_defaults(service=default_service)
+def copy_files(copies: list, service=None, fields: str=None,
+               parse: bool=True)->list:
+    """Duplicate several files, through batch requests
+
+    Args:
+        copies (list of tuples): (source_file_id, new_file_name) or
+            (source_file_id, new_file_name, parent_folder_id) tuples, see
+            `copy_file`
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+        fields (str): the fields of the copies to return, ex: "id, parents".
+            Default: `config.default.drive_file_fields`. Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
+
+    Returns:
+        list of (result, error) tuples, in the order of `copies`. `result`
+        is a dict with the `fields` of the created file, `error` is None
+        unless the copy failed.
+    """
+    logger.info('copying files')
+    for copy in copies:
+        _forget_path(copy[2] if len(copy) > 2 else None, copy[1])
+    return execute_batch(service, [
+        _copy_file_request(service, *copy, fields=fields, parse=parse)
+        for copy in copies])
+
+
+def _media_body(source_file_path: Path, resumable: bool=None,
+                chunk_size: int=None):
+    """Wrap a local file for upload
+
+    Args:
+        source_file_path (Path): the file to upload
+        resumable (bool): If None, files bigger than
+            `config.default.resumable_upload_threshold` are uploaded in
+            chunks through a resumable session, smaller ones in one request.
+        chunk_size (int): size in bytes of the chunks. Default:
+            `config.default.upload_chunk_size`
+
+    Returns:
+        MediaFileUpload
+    """
+    from googleapiclient.http import MediaFileUpload
+
+    if resumable is None:
+        resumable = (source_file_path.stat().st_size
+                     > default_config.resumable_upload_threshold)
+    if chunk_size is None:
+        chunk_size = default_config.upload_chunk_size
+    return MediaFileUpload(
+        str(source_file_path),
+        mimetype='*/*',
+        chunksize=chunk_size,
+        resumable=resumable,)
+
+
+def _upload_checkpoint(source_file_path: Path, *target)->Path:
+    """Path of the file storing the session of a resumable upload
+
+    The session is tied to the content of the local file (through its size
+    and modification time) and to the uploading target.
+
+    Args:
+        source_file_path (Path): the file being uploaded
+        *target (str): description of the drive file being written
+
+    Returns:
+        Path
+    """
+    stat = source_file_path.stat()
+    key = json.dumps([str(source_file_path.resolve()), stat.st_size,
+                      stat.st_mtime_ns, *target])
+    return (Path(default_config.upload_checkpoint_path).expanduser()
+            / hashlib.sha1(key.encode()).hexdigest())
+
+
+def _execute_upload(request, checkpoint: Path,
+                    progress_callback: callable=None)->dict:
+    """Execute a request uploading a file
 
+    Resumable uploads are sent chunk by chunk. The upload session is stored
+    in `checkpoint` until the upload completes: if a previous upload of the
+    same file was interrupted, it is resumed where it stopped.
 
+    Args:
+        request (HttpRequest): the request, with a media body
+        checkpoint (Path): see `_upload_checkpoint`
+        progress_callback (callable): called with the number of bytes sent
+            and the total size after each chunk
+
+    Returns:
+        the api request's result
+    """
+    from googleapiclient.errors import HttpError
+
+    if request.resumable is None:
+        return request.execute()
+
+    if checkpoint.exists():
+        logger.info('resuming upload')
+        request.resumable_uri = json.loads(
+            checkpoint.read_text())['resumable_uri']
+        # Makes the next chunk ask the server where the upload stopped
+        request._in_error_state = True
+
+    response = None
+    while response is None:
+        try:
+            # Retried alone: a failure does not restart the upload
+            status, response = call(request.next_chunk, 'drive')
+        except HttpError as error:
+            if (checkpoint.exists() and request.resumable_progress == 0
+                    and error.resp.status in (404, 410)):
+                # The stored session expired, start a new one
+                logger.info('upload session expired, restarting upload')
+                checkpoint.unlink()
+                request.resumable_uri = None
+                request._in_error_state = False
+                continue
+            raise
+        if not checkpoint.exists() and request.resumable_uri is not None:
+            checkpoint.parent.mkdir(parents=True, exist_ok=True)
+            checkpoint.write_text(json.dumps(
+                {'resumable_uri': request.resumable_uri}))
+        if status is not None and progress_callback is not None:
+            progress_callback(status.resumable_progress, status.total_size)
+
+    if checkpoint.exists():
+        checkpoint.unlink()
+    if progress_callback is not None:
+        size = request.resumable.size()
+        progress_callback(size, size)
+    return response
+
+
+@retrying('drive', idempotent=False)
 @apply_defaults(service=default_service)
 def create_file(source_file_path: str, file_name: str=None,
-                parent_folder_id: str=None, service=None)->dict:
+                parent_folder_id: str=None, resumable: bool=None,
+                chunk_size: int=None, progress_callback: callable=None,
+                service=None, fields: str=None, parse: bool=True)->dict:
     """Upload a file from the local machine into a new file on the drive
 
+    Big files are uploaded in chunks through a resumable session. If the
+    upload is interrupted, calling the function again with the same
+    arguments resumes it.
+
     Args:
         source_file_path (str): Path to the file to upload
         file_name (str): If None, the name of the file will be used
         parent_folder_id (str): Id of a folder to put the copy into. if none
             is specified, the copy will be at the root of the drive.
+        resumable (bool): Force or prevent the usage of a resumable upload.
+            If None, only files bigger than
+            `config.default.resumable_upload_threshold` use it.
+        chunk_size (int): size in bytes of the chunks of a resumable upload.
+            Must be a multiple of 256 KiB. Default:
+            `config.default.upload_chunk_size`
+        progress_callback (callable): called with the number of bytes sent
+            and the total size, after each chunk of a resumable upload
         service (optional, drive-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): the fields of the file to return, ex: "id, parents".
+            Default: `config.default.drive_file_fields`. Documentation link:
+            https://developers.google.com/drive/api/v3/fields-parameter
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
     Returns:
-        dict containing the id and name of the created file
+        dict containing the `fields` of the created file, by default its id
+        and name
     """
     logger.info('creating file')
     source_file_path = Path(source_file_path).expanduser()
@@ -124,23 +434,34 @@ def create_file(source_file_path: str, file_name: str=None,
         'name': file_name,
         'mimeType': '*/*'
     }
-    media_body = MediaFileUpload(
-        str(source_file_path),
-        mimetype='*/*',
-        resumable=False,)
+    media_body = _media_body(source_file_path, resumable, chunk_size)
     if parent_folder_id is not None:
         request_body["parents"] = [parent_folder_id]
-    return service.files().create(
+    _forget_path(parent_folder_id, file_name)
+    request = service.files().create(
         body=request_body,
         media_body=media_body,
-    ).execute()
+        fields=fields or default_config.drive_file_fields,
+    )
+    return _execute_upload(
+        parse_response(request, parse),
+        _upload_checkpoint(source_file_path, 'create', file_name,
+                           parent_folder_id),
+        progress_callback)
 
 
+@retrying('drive')
 @apply_defaults(service=default_service)
 def update_file(source_file_path: str, file_id: str, file_name: str=None,
-                parent_folder_id: str=None, service=None)->dict:
+                parent_folder_id: str=None, resumable: bool=None,
+                chunk_size: int=None, progress_callback: callable=None,
+                service=None, fields: str=None, parse: bool=True)->dict:
     """Upload a file from the local machine into an existing file on the drive
 
+    Big files are uploaded in chunks through a resumable session. If the
+    upload is interrupted, calling the function again with the same
+    arguments resumes it.
+
     Args:
         source_file_path (str): Path to the file to upload
         file_id (str): Id of the file to update
@@ -148,10 +469,16 @@ def update_file(source_file_path: str, file_id: str, file_name: str=None,
         parent_folder_id (str): If None, sets the file's folder to root. If
             you want to keep an existing folder, you will have to include
             it's id.
+        resumable (bool): see `create_file`
+        chunk_size (int): see `create_file`
+        progress_callback (callable): see `create_file`
         service (optional, drive-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): see `create_file`
+        parse (bool): see `create_file`
     Returns:
-        dict containing the id and name of the created file
+        dict containing the `fields` of the updated file, by default its id
+        and name
     """
     logger.info('updating file')
     source_file_path = Path(source_file_path).expanduser()
@@ -161,19 +488,24 @@ def update_file(source_file_path: str, file_id: str, file_name: str=None,
         'name': file_name,
         'mimeType': '*/*'
     }
-    media_body = MediaFileUpload(
-        str(source_file_path),
-        mimetype='*/*',
-        resumable=False,)
+    media_body = _media_body(source_file_path, resumable, chunk_size)
     if parent_folder_id is not None:
         request_body["parents"] = [parent_folder_id]
-    return service.files().update(
+    _forget_path(parent_folder_id, file_name, file_id)
+    request = service.files().update(
         fileId=file_id,
         body=request_body,
         media_body=media_body,
-    ).execute()
+        fields=fields or default_config.drive_file_fields,
+    )
+    return _execute_upload(
+        parse_response(request, parse),
+        _upload_checkpoint(source_file_path, 'update', file_id, file_name,
+                           parent_folder_id),
+        progress_callback)
 
 
+@retrying('drive')
 @apply_defaults(service=default_service)
 def download_file(file_id: str, service=None):
     """Download a file and return it in a variable
@@ -191,6 +523,143 @@ def download_file(file_id: str, service=None):
         fileId=file_id).execute()
 
 
+@apply_defaults(service=default_service)
+def iter_download(file_id: str, chunk_size: int=None, service=None):
+    """Download a file chunk by chunk
+
+    Only one chunk is held in memory at a time.
+
+    Args:
+        file_id (str): Id of the file to download
+        chunk_size (int): size in bytes of the chunks. Default:
+            `config.default.download_chunk_size`
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Yields:
+        bytes, the successive chunks of the content of the file
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    logger.info('streaming file')
+    if chunk_size is None:
+        chunk_size = default_config.download_chunk_size
+    buffer = io.BytesIO()
+    request = service.files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(buffer, request, chunksize=chunk_size)
+    done = False
+    while not done:
+        # Each chunk is a request
+        quota.acquire(request)
+        _, done = call(lambda: metrics.measure_request(
+            request.methodId, downloader.next_chunk,
+            response=lambda result: (206, buffer.tell())), 'drive')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _download_ranges(file_id: str, destination: Path, size: int,
+                     chunk_size: int, workers: int, service):
+    """Download byte ranges of a file concurrently into a memory-mapped file
+
+    Each worker thread uses its own service, with the credentials of
+    `service`, since `httplib2.Http` is not thread-safe.
+
+    Args:
+        file_id (str): Id of the file to download
+        destination (Path): the output file, created with size `size`
+        size (int): size of the file in bytes
+        chunk_size (int): size in bytes of the downloaded ranges
+        workers (int): number of concurrent downloads
+        service (drive-api-service): the service of the caller
+    """
+    pool = pool_like(service)
+
+    def download_range(output, start):
+        request = pool.get('drive', 'v3').files().get_media(fileId=file_id)
+        end = min(start + chunk_size, size) - 1
+        request.headers['range'] = f'bytes={start}-{end}'
+        output[start:end + 1] = execute(request)
+
+    with destination.open('wb') as fd:
+        fd.truncate(size)
+    with destination.open('r+b') as fd, \
+            mmap.mmap(fd.fileno(), size) as output, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        # Consume the results to raise the download errors
+        list(executor.map(lambda start: download_range(output, start),
+                          range(0, size, chunk_size)))
+
+
+@retrying('drive')
+@apply_defaults(service=default_service)
+def download_file_to(file_id: str, destination, chunk_size: int=None,
+                     workers: int=1, service=None)->dict:
+    """Download a file to a local path or a file object, chunk by chunk
+
+    With several `workers`, byte ranges of the file are fetched concurrently
+    and written into a memory-mapped output file. In both cases, the
+    downloaded content is checked against the md5 checksum of the file
+    computed by the drive.
+
+    Args:
+        file_id (str): Id of the file to download
+        destination (str, Path or binary file object): where to write the
+            content of the file. Must be a path for parallel downloads.
+        chunk_size (int): size in bytes of the chunks (or ranges). Default:
+            `config.default.download_chunk_size`
+        workers (int): number of ranges downloaded concurrently. Each worker
+            uses its own service, with the credentials of `service`. Ignored
+            for the files without a size, ex: Google Docs.
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        dict containing the size and md5Checksum of the file
+    Raises:
+        IOError if the checksum of the downloaded content does not match
+    """
+    logger.info('downloading file')
+    if chunk_size is None:
+        chunk_size = default_config.download_chunk_size
+    metadata = service.files().get(
+        fileId=file_id, fields='size, md5Checksum').execute()
+    md5 = hashlib.md5()
+
+    # Google Docs have no size: they are not split in ranges, and their
+    # download fails as without `workers`
+    if workers > 1 and 'size' in metadata:
+        if not isinstance(destination, (str, Path)):
+            raise ValueError('parallel downloads need a destination path')
+        destination = Path(destination).expanduser()
+        size = int(metadata['size'])
+        if size > 0:
+            _download_ranges(file_id, destination, size, chunk_size, workers,
+                             service)
+        else:
+            destination.write_bytes(b'')
+        with destination.open('rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                md5.update(chunk)
+    else:
+        if isinstance(destination, (str, Path)):
+            fd = Path(destination).expanduser().open('wb')
+        else:
+            fd = destination
+        try:
+            for chunk in iter_download(file_id, chunk_size, service=service):
+                fd.write(chunk)
+                md5.update(chunk)
+        finally:
+            if fd is not destination:
+                fd.close()
+
+    if ('md5Checksum' in metadata
+            and md5.hexdigest() != metadata['md5Checksum']):
+        raise IOError(f'md5 checksum mismatch for the download of {file_id}')
+    return metadata
+
+
+@retrying('drive')
 @apply_defaults(service=default_service)
 def delete_file(file_id: str, service=None):
     """copy a file in the user's drive
@@ -203,5 +672,333 @@ def delete_file(file_id: str, service=None):
         an empty string if successful
     """
     logger.info("deleting file")
+    _forget_path(file_id=file_id)
     return service.files().delete(fileId=file_id).execute()
 
+
+@apply_defaults(service=default_service)
+def delete_files(file_ids: list, service=None)->list:
+    """Delete several files, through batch requests
+
+    Args:
+        file_ids (list of str): Ids of the files to delete
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        list of (result, error) tuples, in the order of `file_ids`. `error`
+        is None if the file was deleted.
+    """
+    logger.info("deleting files")
+    for file_id in file_ids:
+        _forget_path(file_id=file_id)
+    return execute_batch(service, [
+        service.files().delete(fileId=file_id) for file_id in file_ids])
+
+
+def quote(value: str)->str:
+    """Quote a string for usage in a drive-file-search-query
+
+    Args:
+        value (str): the string to quote
+
+    Returns:
+        str, the quoted string
+    """
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def _path_parts(path: str)->list:
+    """Names of the successive folders (and file) of a drive path"""
+    return [name for name in str(path).split('/') if name]
+
+
+def _resolve_root(root_id: str, service)->str:
+    """Replace the "root" alias by the id of the root folder of the drive
+
+    The api lists the real id in the `parents` of the files.
+    """
+    if root_id != 'root':
+        return root_id
+    return path_cache.get_or_fill('root', lambda: execute(service.files().get(
+        fileId='root', fields='id'))['id'])
+
+
+@apply_defaults(service=default_service)
+def resolve_paths(paths: list, root_id: str='root', service=None)->list:
+    """Ids of the drive files at `paths`
+
+    Paths are resolved level by level. Each (parent id, name) pair is only
+    looked up once, even if shared by several paths, and the lookups of a
+    level are grouped into a few queries. Resolved pairs are kept in
+    `path_cache`.
+
+    Args:
+        paths (list of str): "/"-separated paths, ex: "reports/2026/q3"
+        root_id (str): Id of the folder the paths are relative to
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        list of str, the ids of the files, in the order of `paths`. None
+        for the paths that do not exist.
+    """
+    logger.info('resolving paths')
+    parts = [_path_parts(path) for path in paths]
+    ids = [_resolve_root(root_id, service)] * len(paths)
+    for depth in range(max(map(len, parts), default=0)):
+        pending = {(ids[i], parts[i][depth]) for i in range(len(paths))
+                   if ids[i] is not None and depth < len(parts[i])
+                   and path_cache.get((ids[i], parts[i][depth])) is None}
+        pending = sorted(pending)
+        for start in range(0, len(pending), 30):
+            query = ' or '.join(
+                f'({quote(parent_id)} in parents and name = {quote(name)})'
+                for parent_id, name in pending[start:start + 30])
+            for file in iter_files(f'({query}) and trashed = false',
+                                   fields='id, name, parents',
+                                   service=service):
+                for parent_id in file.get('parents', []):
+                    if (parent_id, file['name']) in pending:
+                        path_cache.set((parent_id, file['name']), file['id'])
+        for i in range(len(paths)):
+            if ids[i] is not None and depth < len(parts[i]):
+                ids[i] = path_cache.get((ids[i], parts[i][depth]))
+    return ids
+
+
+@apply_defaults(service=default_service)
+def resolve_path(path: str, root_id: str='root', service=None)->str:
+    """Id of the drive file at `path`
+
+    Args:
+        path (str): "/"-separated path, ex: "reports/2026/q3"
+        root_id (str): Id of the folder the path is relative to
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        str, the id of the file
+    Raises:
+        FileNotFoundError if no file exists at `path`
+    """
+    file_id = resolve_paths([path], root_id, service=service)[0]
+    if file_id is None:
+        raise FileNotFoundError(path)
+    return file_id
+
+
+@apply_defaults(service=default_service)
+def make_dirs(path: str, root_id: str='root', service=None)->str:
+    """Create the folders of `path` that do not exist yet, like `mkdir -p`
+
+    Args:
+        path (str): "/"-separated path, ex: "reports/2026/q3"
+        root_id (str): Id of the folder the path is relative to
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        str, the id of the last folder of the path
+    """
+    logger.info('making folders')
+    parts = _path_parts(path)
+    existing = resolve_paths(['/'.join(parts[:depth + 1])
+                              for depth in range(len(parts))],
+                             root_id, service=service)
+    folder_id = _resolve_root(root_id, service)
+    for name, existing_id in zip(parts, existing):
+        if existing_id is None:
+            existing_id = create_folder(name, folder_id, service=service,
+                                        fields='id')['id']
+            path_cache.set((folder_id, name), existing_id)
+        folder_id = existing_id
+    return folder_id
+
+
+@apply_defaults(service=default_service)
+def upload_to_path(source_file_path: str, path: str, root_id: str='root',
+                   service=None, **kwargs)->dict:
+    """Upload a local file to a drive path
+
+    The missing folders of `path` are created. If a file already exists at
+    `path`, it is updated, otherwise a new one is created.
+
+    Args:
+        source_file_path (str): Path to the file to upload
+        path (str): "/"-separated drive path of the file, ex:
+            "reports/2026/q3/summary.csv"
+        root_id (str): Id of the folder the path is relative to
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `default_service()`
+        **kwargs: passed to `create_file` or `update_file`, ex: `chunk_size`
+            or `fields`
+    Returns:
+        dict containing the `fields` of the uploaded file, by default its id
+        and name
+    """
+    logger.info('uploading file to path')
+    parts = _path_parts(path)
+    folder_id = make_dirs('/'.join(parts[:-1]), root_id, service=service)
+    file_id = resolve_paths([path], root_id, service=service)[0]
+    if file_id is not None:
+        return update_file(source_file_path, file_id, parts[-1],
+                           service=service, **kwargs)
+    return create_file(source_file_path, parts[-1], folder_id,
+                       service=service, **kwargs)
+
+
+def _remote_tree(folder_id: str, service)->dict:
+    """List everything below a drive folder
+
+    The tree is walked level by level, listing the content of up to 50
+    folders per query.
+
+    Args:
+        folder_id (str): Id of the folder
+        service (drive-api-service): the service to use
+
+    Returns:
+        dict of {relative path: file information record}. Paths use "/" as
+        separator.
+    """
+    tree = {}
+    level = {folder_id: ''}
+    while level:
+        next_level = {}
+        folder_ids = list(level)
+        for start in range(0, len(folder_ids), 50):
+            query = ' or '.join(f"'{folder_id}' in parents"
+                                for folder_id in folder_ids[start:start + 50])
+            for file in iter_files(
+                    f'({query}) and trashed = false',
+                    fields='id, name, mimeType, md5Checksum, size, parents',
+                    service=service):
+                parent = next(parent for parent in file['parents']
+                              if parent in level)
+                path = level[parent] + file['name']
+                if path in tree:
+                    logger.warning(f'several drive files at {path}')
+                    continue
+                tree[path] = file
+                if file['mimeType'] == FOLDER_MIME_TYPE:
+                    next_level[file['id']] = path + '/'
+        level = next_level
+    return tree
+
+
+def _local_md5(path: Path, hash_cache: dict)->str:
+    """md5 checksum of a local file, cached by size and modification time"""
+    stat = path.stat()
+    key = str(path.resolve())
+    cached = hash_cache.get(key)
+    if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached[2]
+    md5 = hashlib.md5()
+    with path.open('rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            md5.update(chunk)
+    hash_cache[key] = [stat.st_size, stat.st_mtime_ns, md5.hexdigest()]
+    return md5.hexdigest()
+
+
+@apply_defaults(service=default_service)
+def sync(local_dir: str, folder_id: str, delete: bool=False, workers: int=4,
+         service=None)->dict:
+    """Mirror a local directory into a drive folder
+
+    Only the files whose size or md5 checksum differ from the drive's are
+    uploaded. The checksums of the local files are cached (see
+    `config.default.sync_hash_cache_path`) so that unchanged files are not
+    read again. Missing folders are created, and extra drive files deleted,
+    through batch requests.
+
+    Args:
+        local_dir (str): Path to the directory to upload
+        folder_id (str): Id of the drive folder to mirror it into
+        delete (bool): delete the drive files that do not exist locally
+        workers (int): number of concurrent uploads. Each worker uses its own
+            service, with the credentials of `service`.
+        service (optional, drive-api-service): the service to use for the
+            listings and batch requests. Default: the result of
+            `default_service()`
+    Returns:
+        dict of lists of relative paths: "created", "updated", "unchanged",
+        "deleted" (files), "folders" (created folders)
+    """
+    logger.info('synchronizing folder')
+    local_dir = Path(local_dir).expanduser()
+    hash_cache_path = Path(default_config.sync_hash_cache_path).expanduser()
+    hash_cache = (json.loads(hash_cache_path.read_text())
+                  if hash_cache_path.exists() else {})
+    remote = _remote_tree(folder_id, service)
+    report = {'created': [], 'updated': [], 'unchanged': [], 'deleted': [],
+              'folders': []}
+
+    local = {path.relative_to(local_dir).as_posix(): path
+             for path in sorted(local_dir.rglob('*'))}
+    for path in list(remote):
+        if path in local and (local[path].is_dir()
+                              != (remote[path]['mimeType']
+                                  == FOLDER_MIME_TYPE)):
+            raise ValueError(f'{path} is a file on one side and a folder on '
+                             f'the other')
+
+    # Folders are created level by level, one batch per level
+    folder_ids = {'': folder_id}
+    folder_ids.update({path: file['id'] for path, file in remote.items()
+                       if file['mimeType'] == FOLDER_MIME_TYPE})
+    missing = [path for path in local
+               if local[path].is_dir() and path not in folder_ids]
+    for depth in sorted({path.count('/') for path in missing}):
+        paths = [path for path in missing if path.count('/') == depth]
+        results = create_folders(
+            [(local[path].name, folder_ids[path.rpartition('/')[0]])
+             for path in paths], service=service, fields='id')
+        for path, (result, error) in zip(paths, results):
+            if error is not None:
+                raise error
+            folder_ids[path] = result['id']
+        report['folders'] += paths
+
+    transfers = []
+    for path, local_path in local.items():
+        if local_path.is_dir():
+            continue
+        file = remote.get(path)
+        if file is None:
+            transfers.append((path, None))
+        elif (int(file.get('size', -1)) != local_path.stat().st_size
+                or file.get('md5Checksum')
+                != _local_md5(local_path, hash_cache)):
+            transfers.append((path, file['id']))
+        else:
+            report['unchanged'].append(path)
+
+    pool = pool_like(service)
+
+    def transfer(path, file_id):
+        transfer_service = pool.get('drive', 'v3') if workers > 1 else service
+        if file_id is None:
+            create_file(local[path],
+                        parent_folder_id=folder_ids[path.rpartition('/')[0]],
+                        service=transfer_service, fields='id', parse=False)
+            report['created'].append(path)
+        else:
+            update_file(local[path], file_id, service=transfer_service,
+                        fields='id', parse=False)
+            report['updated'].append(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda args: transfer(*args), transfers))
+
+    if delete:
+        # Deleting a folder deletes its content
+        local_folders = {path for path in local if local[path].is_dir()}
+        extra = [path for path in remote if path not in local
+                 and path.rpartition('/')[0] in local_folders | {''}]
+        for path, (_, error) in zip(extra, delete_files(
+                [remote[path]['id'] for path in extra], service=service)):
+            if error is not None:
+                raise error
+            report['deleted'].append(path)
+
+    hash_cache_path.parent.mkdir(parents=True, exist_ok=True)
+    hash_cache_path.write_text(json.dumps(hash_cache))
+    return report
@@ -0,0 +1,227 @@
+"""Local index of the metadata of the files of the drive
+
+Repeated lookups (by name, parent, mimeType or id) are answered from a sqlite
+file instead of listing the drive every time. The index is seeded by one
+full listing of the drive, then updated incrementally from the drive's
+changes feed:
+https://developers.google.com/drive/api/v3/manage-changes
+
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from google_services import drive
+from google_services._utilities import logger
+from google_services import metrics, retry
+from google_services.config import default as default_config
+
+# Metadata stored for each file
+FIELDS = 'id, name, mimeType, parents, md5Checksum, size, modifiedTime'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    mime_type TEXT,
+    data TEXT);
+CREATE TABLE IF NOT EXISTS parents (
+    file_id TEXT,
+    parent_id TEXT,
+    PRIMARY KEY (file_id, parent_id));
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_mime_type ON files (mime_type);
+CREATE INDEX IF NOT EXISTS parents_parent_id ON parents (parent_id);
+'''
+
+
+class DriveIndex:
+    """On-disk index of the metadata of the files of the drive
+
+    Lookups are answered locally. Before answering, the index is brought up
+    to date with the changes feed if it was last synchronized more than
+    `max_age` seconds ago. Lookups with `consistent=True` bypass the index
+    and query the drive directly.
+
+    Attributes:
+        path (Path): the sqlite file holding the index
+        max_age (float): maximum age, in seconds, of the index data used to
+            answer lookups. If None, the index is only synchronized by
+            explicit calls to `sync`.
+        service (optional, drive-api-service): the service to use. Default:
+            the result of `drive.default_service()`
+    """
+
+    def __init__(self, path: str=None, max_age: float=60, service=None):
+        if path is None:
+            path = default_config.drive_index_path
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self.service = service
+        self._synced_at = None
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def _get_service(self):
+        return self.service or drive.default_service()
+
+    def _state(self, key: str)->str:
+        row = self._db.execute(
+            'SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _store(self, file: dict):
+        self._db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+            (file['id'], file.get('name'), file.get('mimeType'),
+             json.dumps(file)))
+        self._db.execute('DELETE FROM parents WHERE file_id = ?',
+                         (file['id'],))
+        self._db.executemany(
+            'INSERT INTO parents VALUES (?, ?)',
+            [(file['id'], parent) for parent in file.get('parents', [])])
+
+    def _remove(self, file_id: str):
+        self._db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        self._db.execute('DELETE FROM parents WHERE file_id = ?', (file_id,))
+
+    def sync(self):
+        """Bring the index up to date with the drive
+
+        The first synchronization lists the whole drive. The following ones
+        only fetch the changes since the previous one.
+        """
+        with self._lock, self._db:
+            service = self._get_service()
+            page_token = self._state('page_token')
+            if page_token is None:
+                logger.info('seeding drive index')
+                # Taken before the listing so that no change is missed
+                page_token = retry.execute(
+                    service.changes().getStartPageToken())['startPageToken']
+                self._db.execute('DELETE FROM files')
+                self._db.execute('DELETE FROM parents')
+                for file in drive.iter_files('trashed = false', fields=FIELDS,
+                                             service=service):
+                    self._store(file)
+            else:
+                logger.info('updating drive index')
+                while True:
+                    # Retried alone: a failure does not restart the update
+                    changes = retry.execute(service.changes().list(
+                        pageToken=page_token,
+                        pageSize=1000,
+                        fields=f'nextPageToken, newStartPageToken, '
+                               f'changes(fileId, removed, file({FIELDS}, '
+                               f'trashed))'))
+                    metrics.hooks.page('drive.changes.list',
+                                       len(changes.get('changes', [])))
+                    for change in changes.get('changes', []):
+                        file = change.get('file')
+                        if change.get('removed') or file is None \
+                                or file.pop('trashed', False):
+                            self._remove(change['fileId'])
+                        else:
+                            self._store(file)
+                    if 'newStartPageToken' in changes:
+                        page_token = changes['newStartPageToken']
+                        break
+                    page_token = changes['nextPageToken']
+            self._db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                             ('page_token', page_token))
+            self._synced_at = time.monotonic()
+
+    def clear(self):
+        """Empty the index. The next synchronization will list the drive"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files')
+            self._db.execute('DELETE FROM parents')
+            self._db.execute('DELETE FROM state')
+            self._synced_at = None
+
+    def _query(self, sql: str, parameters: tuple)->list:
+        with self._lock:
+            if self.max_age is not None and (
+                    self._synced_at is None
+                    or time.monotonic() - self._synced_at > self.max_age):
+                self.sync()
+            return [json.loads(data) for data, in
+                    self._db.execute(sql, parameters).fetchall()]
+
+    def _remote(self, query: str)->list:
+        return drive.get_files(f'{query} and trashed = false', fields=FIELDS,
+                               service=self._get_service())
+
+    def get(self, file_id: str, consistent: bool=False)->dict:
+        """Metadata of a file
+
+        Args:
+            file_id (str): Id of the file
+            consistent (bool): bypass the index and ask the drive
+        Returns:
+            dict, file information record, or None if the file is not in the
+            drive
+        """
+        if consistent:
+            from googleapiclient.errors import HttpError
+
+            try:
+                return retry.execute(self._get_service().files().get(
+                    fileId=file_id, fields=FIELDS))
+            except HttpError as error:
+                if error.resp.status == 404:
+                    return None
+                raise
+        files = self._query('SELECT data FROM files WHERE id = ?',
+                            (file_id,))
+        return files[0] if files else None
+
+    def by_name(self, name: str, consistent: bool=False)->list:
+        """Files with the given name
+
+        Args:
+            name (str): name of the files
+            consistent (bool): bypass the index and ask the drive
+        Returns:
+            list of dict, file information records
+        """
+        if consistent:
+            return self._remote(f'name = {drive.quote(name)}')
+        return self._query('SELECT data FROM files WHERE name = ?', (name,))
+
+    def by_parent(self, parent_id: str, consistent: bool=False)->list:
+        """Files inside a folder
+
+        Args:
+            parent_id (str): Id of the folder
+            consistent (bool): bypass the index and ask the drive
+        Returns:
+            list of dict, file information records
+        """
+        if consistent:
+            return self._remote(f'{drive.quote(parent_id)} in parents')
+        return self._query(
+            'SELECT data FROM files JOIN parents ON files.id = file_id '
+            'WHERE parent_id = ?', (parent_id,))
+
+    def by_mime_type(self, mime_type: str, consistent: bool=False)->list:
+        """Files of a given type
+
+        Args:
+            mime_type (str): ex: "application/vnd.google-apps.folder"
+            consistent (bool): bypass the index and ask the drive
+        Returns:
+            list of dict, file information records
+        """
+        if consistent:
+            return self._remote(f'mimeType = {drive.quote(mime_type)}')
+        return self._query('SELECT data FROM files WHERE mime_type = ?',
+                           (mime_type,))
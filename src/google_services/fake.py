@@ -0,0 +1,1554 @@
+"""Local stand-in for the drive v3 and gmail v1 apis
+
+`FakeBackend` answers the requests of the google-api services in memory,
+without network nor google account, so that the package can be tested and
+benchmarked offline. It implements the api methods used by the package,
+with:
+- pagination, `fields` projections and batch requests,
+- simple, multipart and resumable media uploads, and ranged downloads,
+- the drive search queries, and a subset of the gmail ones,
+- the drive changes feed and the gmail history.
+
+Latency and errors can be injected: each request waits `latency` seconds
+before being answered, a fraction `error_rate` of the requests fail with a
+transient error, and `fail` queues errors for the next requests.
+`lose_responses` makes requests time out after they were processed.
+
+Example:
+    backend = FakeBackend(latency=0.02)
+    backend.drive.add_file('report.csv', b'a,b')
+    with backend.install():
+        drive.get_files("name = 'report.csv'")
+
+`install` makes the default services of the package (see `pool.py`) use the
+backend, through the real transport of the package with only its
+connections replaced. `service` builds a service for explicit use. The
+asyncio interface (`aio`), which sends its requests through aiohttp, is not
+covered.
+
+The contents of the files and messages are stored in a temporary
+directory, so that the memory used by the backend stays small.
+
+"""
+
+import base64
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import hashlib
+from http.client import responses
+import itertools
+import json
+from pathlib import Path
+import random
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from google_services._utilities import logger
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+ROOT_ID = '0AFakeRootFolder'
+
+# Implemented methods, by api: root url, service path, batch path, and
+# (http method, path, query parameters, options) by method id. Query
+# parameters are strings unless typed with ":integer", ":boolean" or
+# ":repeated". Options: "body" takes a request body, "upload" accepts
+# media, "download" accepts alt=media, "empty" answers without body.
+APIS = {
+    ('drive', 'v3'): ('https://www.googleapis.com/', 'drive/v3/',
+                      'batch/drive/v3', {
+        'drive.files.list': (
+            'GET', 'files', ['q', 'pageSize:integer', 'pageToken', 'orderBy',
+                             'corpora', 'spaces', 'driveId',
+                             'includeItemsFromAllDrives:boolean',
+                             'supportsAllDrives:boolean'], ''),
+        'drive.files.get': (
+            'GET', 'files/{fileId}', ['acknowledgeAbuse:boolean',
+                                      'supportsAllDrives:boolean'],
+            'download'),
+        'drive.files.create': (
+            'POST', 'files', ['supportsAllDrives:boolean'], 'body upload'),
+        'drive.files.update': (
+            'PATCH', 'files/{fileId}', ['addParents', 'removeParents',
+                                        'supportsAllDrives:boolean'],
+            'body upload'),
+        'drive.files.copy': (
+            'POST', 'files/{fileId}/copy', ['supportsAllDrives:boolean'],
+            'body'),
+        'drive.files.delete': (
+            'DELETE', 'files/{fileId}', ['supportsAllDrives:boolean'],
+            'empty'),
+        'drive.changes.getStartPageToken': (
+            'GET', 'changes/startPageToken', ['driveId',
+                                              'supportsAllDrives:boolean'],
+            ''),
+        'drive.changes.list': (
+            'GET', 'changes', ['pageToken', 'pageSize:integer',
+                               'includeRemoved:boolean', 'spaces',
+                               'restrictToMyDrive:boolean',
+                               'supportsAllDrives:boolean'], ''),
+    }),
+    ('gmail', 'v1'): ('https://gmail.googleapis.com/', '', 'batch', {
+        'gmail.users.getProfile': (
+            'GET', 'gmail/v1/users/{userId}/profile', [], ''),
+        'gmail.users.labels.list': (
+            'GET', 'gmail/v1/users/{userId}/labels', [], ''),
+        'gmail.users.labels.create': (
+            'POST', 'gmail/v1/users/{userId}/labels', [], 'body'),
+        'gmail.users.labels.delete': (
+            'DELETE', 'gmail/v1/users/{userId}/labels/{id}', [], 'empty'),
+        'gmail.users.messages.list': (
+            'GET', 'gmail/v1/users/{userId}/messages',
+            ['q', 'maxResults:integer', 'pageToken', 'labelIds:repeated',
+             'includeSpamTrash:boolean'], ''),
+        'gmail.users.messages.get': (
+            'GET', 'gmail/v1/users/{userId}/messages/{id}',
+            ['format', 'metadataHeaders:repeated'], ''),
+        'gmail.users.messages.send': (
+            'POST', 'gmail/v1/users/{userId}/messages/send', [],
+            'body upload'),
+        'gmail.users.messages.modify': (
+            'POST', 'gmail/v1/users/{userId}/messages/{id}/modify', [],
+            'body'),
+        'gmail.users.messages.batchModify': (
+            'POST', 'gmail/v1/users/{userId}/messages/batchModify', [],
+            'body empty'),
+        'gmail.users.messages.batchDelete': (
+            'POST', 'gmail/v1/users/{userId}/messages/batchDelete', [],
+            'body empty'),
+        'gmail.users.history.list': (
+            'GET', 'gmail/v1/users/{userId}/history',
+            ['startHistoryId', 'maxResults:integer', 'pageToken', 'labelId',
+             'historyTypes:repeated'], ''),
+    }),
+}
+
+# Accepted mime types and maximum size of the media uploads, by api
+UPLOADS = {'drive': (['*/*'], 5497558138880),
+           'gmail': (['message/*'], 36700160)}
+
+# Fields returned when a request does not ask for specific ones. The drive
+# only returns a few fields by default, gmail returns whole resources.
+DEFAULT_FIELDS = {
+    'drive.files.list': 'kind, nextPageToken, incompleteSearch, '
+                        'files(kind, id, name, mimeType)',
+    'drive.files.get': 'kind, id, name, mimeType',
+    'drive.files.create': 'kind, id, name, mimeType',
+    'drive.files.update': 'kind, id, name, mimeType',
+    'drive.files.copy': 'kind, id, name, mimeType',
+    'drive.changes.list': 'kind, nextPageToken, newStartPageToken, '
+                          'changes(kind, changeType, time, removed, fileId, '
+                          'file(kind, id, name, mimeType))',
+}
+
+# Maximum number of requests in a batch request
+BATCH_MAX_SIZE = 100
+
+
+def _parameter(spec: str, location: str)->tuple:
+    name, _, kind = spec.partition(':')
+    parameter = {'location': location, 'type': 'string'}
+    if kind == 'repeated':
+        parameter['repeated'] = True
+    elif kind:
+        parameter['type'] = kind
+    return name, parameter
+
+
+def discovery_document(api: str, version: str)->dict:
+    """Discovery document of the methods of an api implemented here
+
+    Args:
+        api (str): name of the api, "drive" or "gmail"
+        version (str): version of the api, "v3" or "v1"
+
+    Returns:
+        dict, a discovery document `googleapiclient` can build services from
+    """
+    root_url, service_path, batch_path, methods = APIS[(api, version)]
+    accept, max_size = UPLOADS[api]
+    document = {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': f'{api}:{version}',
+        'name': api,
+        'version': version,
+        'protocol': 'rest',
+        'rootUrl': root_url,
+        'servicePath': service_path,
+        'baseUrl': root_url + service_path,
+        'basePath': '/' + service_path,
+        'batchPath': batch_path,
+        'parameters': dict(_parameter(spec, 'query') for spec in [
+            'alt', 'fields', 'prettyPrint:boolean', 'quotaUser']),
+        'schemas': {'Resource': {'id': 'Resource', 'type': 'object'}},
+    }
+    for method_id, (http_method, path, query, options) in methods.items():
+        *resources, name = method_id.split('.')[1:]
+        node = document
+        for resource in resources:
+            node = node.setdefault('resources', {}).setdefault(resource, {})
+        path_parameters = re.findall(r'{(\w+)}', path)
+        parameters = {parameter: {'location': 'path', 'type': 'string',
+                                  'required': True}
+                      for parameter in path_parameters}
+        parameters.update(_parameter(spec, 'query') for spec in query)
+        method = {'id': method_id, 'httpMethod': http_method, 'path': path,
+                  'flatPath': path, 'parameterOrder': path_parameters,
+                  'parameters': parameters}
+        if 'body' in options:
+            method['request'] = {'$ref': 'Resource'}
+        if 'empty' not in options:
+            method['response'] = {'$ref': 'Resource'}
+        if 'upload' in options:
+            method['supportsMediaUpload'] = True
+            method['mediaUpload'] = {
+                'accept': accept,
+                'maxSize': str(max_size),
+                'protocols': {
+                    'simple': {'multipart': True,
+                               'path': f'/upload/{service_path}{path}'},
+                    'resumable': {'multipart': True,
+                                  'path': f'/resumable/upload/'
+                                          f'{service_path}{path}'}}}
+        if 'download' in options:
+            method['supportsMediaDownload'] = True
+        node.setdefault('methods', {})[name] = method
+    return document
+
+
+def _parse_fields(fields: str)->dict:
+    """Tree of the fields selected by a `fields` parameter
+
+    Ex: "nextPageToken, files(id, name)" gives
+    {'nextPageToken': {}, 'files': {'id': {}, 'name': {}}}. An empty tree
+    selects a whole value.
+    """
+    root = {}
+    trees = [root]
+    name = ''
+
+    def add(tree: dict, path: str)->dict:
+        for part in path.split('/'):
+            tree = tree.setdefault(part, {})
+        return tree
+
+    for char in fields + ',':
+        if char not in ',()':
+            name += char
+            continue
+        name = name.strip()
+        if char == '(':
+            trees.append(add(trees[-1], name))
+        else:
+            if name:
+                add(trees[-1], name)
+            if char == ')':
+                trees.pop()
+        name = ''
+    return root
+
+
+def _project(value, tree: dict):
+    """Keep the fields of `tree` (see `_parse_fields`) in a resource"""
+    if not tree or '*' in tree:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _project(value[key], subtree)
+                for key, subtree in tree.items() if key in value}
+    return value
+
+
+class ApiError(Exception):
+    """Error answered by the backend
+
+    Attributes:
+        status (int): http status of the answer
+        reason (str): reason code of the error, ex: "notFound"
+        message (str): description of the error
+        headers (dict): extra headers of the answer, ex: retry-after
+    """
+
+    def __init__(self, status: int, reason: str, message: str='',
+                 headers: dict=None):
+        super().__init__(message or reason)
+        self.status = status
+        self.reason = reason
+        self.message = message or reason
+        self.headers = headers or {}
+
+    def content(self)->bytes:
+        return json.dumps({'error': {
+            'code': self.status,
+            'message': self.message,
+            'errors': [{'domain': 'global', 'reason': self.reason,
+                        'message': self.message}]}}).encode()
+
+
+class _Call:
+    """An api method call, as seen by the handlers
+
+    Attributes:
+        method_id (str): ex: "drive.files.list"
+        path (dict): the path parameters
+        query (dict): the query parameters, as lists of values
+        body (dict): the parsed request body, or the upload metadata
+        media (Path): the uploaded content, for uploads
+        headers (dict): the request headers, with lower case names
+    """
+
+    def __init__(self, method_id: str, path: dict, query: dict,
+                 body: dict=None, media: Path=None, headers: dict=None):
+        self.method_id = method_id
+        self.path = path
+        self.query = query
+        self.body = body
+        self.media = media
+        self.headers = headers or {}
+
+    def get(self, name: str, default=None):
+        """First value of a path or query parameter"""
+        if name in self.path:
+            return self.path[name]
+        return self.query.get(name, [default])[0]
+
+    def get_list(self, name: str)->list:
+        """Values of a repeated query parameter"""
+        return self.query.get(name, [])
+
+
+class _Raw:
+    """Answer of a handler which is not a json resource"""
+
+    def __init__(self, status: int, content: bytes, headers: dict=None):
+        self.status = status
+        self.content = content
+        self.headers = headers or {}
+
+
+def _text(value)->str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _timestamp()->str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[
+        :-3] + 'Z'
+
+
+def _md5(path: Path)->str:
+    md5 = hashlib.md5()
+    with path.open('rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+_QUERY_TOKEN = re.compile(
+    r"\s*(?:'((?:[^'\\]|\\.)*)'|(!=|<=|>=|=|<|>|\(|\))|([\w.-]+))")
+
+_DRIVE_QUERY_FIELDS = {'name', 'mimeType', 'trashed', 'starred',
+                       'modifiedTime', 'createdTime', 'fullText'}
+
+
+class _DriveQuery:
+    """Parser of the drive search queries, into predicates on files
+
+    Supports the `and`, `or` and `not` operators, parentheses, comparisons
+    of the name, mimeType, trashed, starred, modifiedTime, createdTime and
+    fullText fields, and `'id' in parents`.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = []
+        query = query.strip()
+        position = 0
+        while position < len(query):
+            match = _QUERY_TOKEN.match(query, position)
+            if match is None:
+                raise ApiError(400, 'invalid', f'Invalid Value: {query}')
+            string, symbol, word = match.groups()
+            if string is not None:
+                self.tokens.append(('string', re.sub(r'\\(.)', r'\1',
+                                                     string)))
+            elif symbol is not None:
+                self.tokens.append(('symbol', symbol))
+            else:
+                self.tokens.append(('word', word))
+            position = match.end()
+        self.position = 0
+
+    def parse(self)->callable:
+        if not self.tokens:
+            return lambda file: True
+        predicate = self._or()
+        if self.position != len(self.tokens):
+            self._invalid()
+        return predicate
+
+    def _invalid(self):
+        raise ApiError(400, 'invalid', 'Invalid Value')
+
+    def _peek(self)->tuple:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def _take(self)->tuple:
+        token = self._peek()
+        if token[0] is None:
+            self._invalid()
+        self.position += 1
+        return token
+
+    def _keyword(self, keyword: str)->bool:
+        kind, value = self._peek()
+        if kind == 'word' and value.lower() == keyword:
+            self.position += 1
+            return True
+        return False
+
+    def _or(self)->callable:
+        predicates = [self._and()]
+        while self._keyword('or'):
+            predicates.append(self._and())
+        return lambda file: any(predicate(file) for predicate in predicates)
+
+    def _and(self)->callable:
+        predicates = [self._not()]
+        while self._keyword('and'):
+            predicates.append(self._not())
+        return lambda file: all(predicate(file) for predicate in predicates)
+
+    def _not(self)->callable:
+        if self._keyword('not'):
+            predicate = self._not()
+            return lambda file: not predicate(file)
+        if self._peek() == ('symbol', '('):
+            self._take()
+            predicate = self._or()
+            if self._take() != ('symbol', ')'):
+                self._invalid()
+            return predicate
+        return self._comparison()
+
+    def _value(self):
+        kind, value = self._take()
+        if kind == 'string':
+            return value
+        if kind == 'word' and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        self._invalid()
+
+    def _comparison(self)->callable:
+        kind, value = self._peek()
+        if kind == 'string':
+            value = self._value()
+            if not self._keyword('in') or self._take() != ('word', 'parents'):
+                self._invalid()
+            parent_id = ROOT_ID if value == 'root' else value
+            return lambda file: parent_id in file.get('parents', [])
+        kind, field = self._take()
+        if kind != 'word' or field not in _DRIVE_QUERY_FIELDS:
+            self._invalid()
+        if self._keyword('contains'):
+            operator = 'contains'
+        else:
+            kind, operator = self._take()
+            if kind != 'symbol' or operator in '()':
+                self._invalid()
+        value = self._value()
+
+        def predicate(file):
+            if field == 'fullText':
+                actual = file['name']
+            else:
+                actual = file.get(field, False if field in (
+                    'trashed', 'starred') else '')
+            if operator == 'contains':
+                return str(value).lower() in str(actual).lower()
+            return {'=': actual == value, '!=': actual != value,
+                    '<': actual < value, '<=': actual <= value,
+                    '>': actual > value, '>=': actual >= value}[operator]
+        return predicate
+
+
+class FakeDrive:
+    """State and handlers of the fake drive api
+
+    Attributes:
+        files (dict): file records by id, with the contents stored in
+            `_blob`
+        changes (list): ids of the changed files, in order. The page tokens
+            of the changes feed are positions in this list.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        now = _timestamp()
+        self.files = {ROOT_ID: {
+            'kind': 'drive#file', 'id': ROOT_ID, 'name': 'My Drive',
+            'mimeType': FOLDER_MIME_TYPE, 'parents': [], 'trashed': False,
+            'starred': False, 'createdTime': now, 'modifiedTime': now,
+            'version': '1'}}
+        self.changes = []
+
+    def add_file(self, name: str, content: bytes=b'', parent_id: str=None,
+                 mime_type: str='application/octet-stream')->dict:
+        """Store a file, as if it was created by another client
+
+        Args:
+            name (str): name of the file
+            content (bytes): content of the file
+            parent_id (str): Id of the folder of the file. Default: the root
+                folder.
+            mime_type (str): use `FOLDER_MIME_TYPE` for folders
+
+        Returns:
+            dict, the file record
+        """
+        media = None
+        if mime_type != FOLDER_MIME_TYPE:
+            media = self.backend.new_blob()
+            media.write_bytes(content)
+        metadata = {'name': name, 'mimeType': mime_type,
+                    'parents': [parent_id or ROOT_ID]}
+        with self.backend.lock:
+            return self._resource(self._new_file(metadata, media))
+
+    def add_folder(self, name: str, parent_id: str=None)->dict:
+        """Store a folder, see `add_file`"""
+        return self.add_file(name, parent_id=parent_id,
+                             mime_type=FOLDER_MIME_TYPE)
+
+    def content(self, file_id: str)->bytes:
+        """Content of a file"""
+        return self.files[file_id]['_blob'].read_bytes()
+
+    def _resource(self, file: dict)->dict:
+        return {key: (list(value) if isinstance(value, list) else value)
+                for key, value in file.items() if not key.startswith('_')}
+
+    def _file(self, file_id: str)->dict:
+        file = self.files.get(ROOT_ID if file_id == 'root' else file_id)
+        if file is None:
+            raise ApiError(404, 'notFound', f'File not found: {file_id}.')
+        return file
+
+    def _check_parents(self, parents: list)->list:
+        parents = [ROOT_ID if parent == 'root' else parent
+                   for parent in parents]
+        for parent in parents:
+            if self._file(parent)['mimeType'] != FOLDER_MIME_TYPE:
+                raise ApiError(400, 'invalidParent',
+                               f'Parent {parent} is not a folder')
+        return parents
+
+    def _set_media(self, file: dict, media: Path):
+        file['_blob'] = media
+        file['size'] = str(media.stat().st_size)
+        file['md5Checksum'] = _md5(media)
+
+    def _changed(self, file: dict):
+        file['modifiedTime'] = _timestamp()
+        file['version'] = str(int(file.get('version', 0)) + 1)
+        self.changes.append(file['id'])
+
+    def _new_file(self, metadata: dict, media: Path=None)->dict:
+        now = _timestamp()
+        file = {'kind': 'drive#file', 'id': self.backend.new_id(),
+                'name': 'Untitled', 'mimeType': 'application/octet-stream',
+                'trashed': False, 'starred': False, 'createdTime': now}
+        file.update({key: value for key, value in metadata.items()
+                     if key not in ('id', 'kind', 'size', 'md5Checksum')})
+        file['parents'] = self._check_parents(
+            metadata.get('parents') or [ROOT_ID])
+        if file['mimeType'] != FOLDER_MIME_TYPE:
+            if media is None:
+                media = self.backend.new_blob()
+                media.touch()
+            self._set_media(file, media)
+        self.files[file['id']] = file
+        self._changed(file)
+        return file
+
+    def files_list(self, call: _Call)->dict:
+        predicate = _DriveQuery(call.get('q') or '').parse()
+        files = [file for file in self.files.values()
+                 if file['id'] != ROOT_ID and predicate(file)]
+        for key in reversed((call.get('orderBy') or '').split(',')):
+            key, _, direction = key.strip().partition(' ')
+            if key == 'folder':
+                files.sort(key=lambda file: file['mimeType']
+                           != FOLDER_MIME_TYPE,
+                           reverse=direction == 'desc')
+            elif key:
+                files.sort(key=lambda file: file.get(key, ''),
+                           reverse=direction == 'desc')
+        page_size = min(int(call.get('pageSize') or 100), 1000)
+        start = int(call.get('pageToken') or 0)
+        response = {'kind': 'drive#fileList', 'incompleteSearch': False,
+                    'files': [self._resource(file) for file
+                              in files[start:start + page_size]]}
+        if start + page_size < len(files):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+    def files_get(self, call: _Call):
+        file = self._file(call.get('fileId'))
+        if call.get('alt') != 'media':
+            return self._resource(file)
+        if '_blob' not in file:
+            raise ApiError(403, 'fileNotDownloadable',
+                           'Only files with binary content can be '
+                           'downloaded.')
+        size = int(file['size'])
+        match = re.match(r'bytes=(\d+)-(\d*)', call.headers.get('range', ''))
+        if match is None:
+            return _Raw(200, file['_blob'].read_bytes())
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else size - 1, size - 1)
+        if start >= size:
+            raise ApiError(416, 'requestedRangeNotSatisfiable',
+                           'Request range not satisfiable')
+        with file['_blob'].open('rb') as fd:
+            fd.seek(start)
+            content = fd.read(end - start + 1)
+        return _Raw(206, content,
+                    {'content-range': f'bytes {start}-{end}/{size}'})
+
+    def files_create(self, call: _Call)->dict:
+        return self._resource(self._new_file(call.body or {}, call.media))
+
+    def files_update(self, call: _Call)->dict:
+        file = self._file(call.get('fileId'))
+        metadata = call.body or {}
+        if 'parents' in metadata:
+            raise ApiError(403, 'fieldNotWritable',
+                           'The parents field is not directly writable in '
+                           'update requests. Use the addParents and '
+                           'removeParents parameters instead.')
+        file.update({key: value for key, value in metadata.items()
+                     if key not in ('id', 'kind', 'size', 'md5Checksum')})
+        removed = (call.get('removeParents') or '').split(',')
+        added = self._check_parents(
+            [parent for parent in (call.get('addParents') or '').split(',')
+             if parent])
+        file['parents'] = [parent for parent in file['parents']
+                           if parent not in removed] + added
+        if call.media is not None:
+            self._set_media(file, call.media)
+        self._changed(file)
+        return self._resource(file)
+
+    def files_copy(self, call: _Call)->dict:
+        source = self._file(call.get('fileId'))
+        if '_blob' not in source:
+            raise ApiError(403, 'cannotCopyFile',
+                           'This file cannot be copied by the user.')
+        media = self.backend.new_blob()
+        shutil.copyfile(str(source['_blob']), str(media))
+        metadata = {'name': f"Copy of {source['name']}",
+                    'mimeType': source['mimeType'],
+                    'parents': source['parents']}
+        metadata.update(call.body or {})
+        return self._resource(self._new_file(metadata, media))
+
+    def files_delete(self, call: _Call):
+        file = self._file(call.get('fileId'))
+        if file['id'] == ROOT_ID:
+            raise ApiError(403, 'insufficientFilePermissions',
+                           'The user does not have sufficient permissions '
+                           'for this file.')
+        deleted = {file['id']}
+        # The content of a folder is deleted with it
+        pending = [file['id']]
+        while pending:
+            parent = pending.pop()
+            for child in self.files.values():
+                if parent in child['parents'] and child['id'] not in deleted:
+                    deleted.add(child['id'])
+                    pending.append(child['id'])
+        for file_id in deleted:
+            del self.files[file_id]
+            self.changes.append(file_id)
+
+    def changes_get_start_page_token(self, call: _Call)->dict:
+        return {'kind': 'drive#startPageToken',
+                'startPageToken': str(len(self.changes) + 1)}
+
+    def changes_list(self, call: _Call)->dict:
+        start = int(call.get('pageToken')) - 1
+        if not 0 <= start <= len(self.changes):
+            raise ApiError(400, 'invalid', 'Invalid Value')
+        page_size = min(int(call.get('pageSize') or 100), 1000)
+        changes = []
+        for file_id in self.changes[start:start + page_size]:
+            change = {'kind': 'drive#change', 'changeType': 'file',
+                      'time': _timestamp(), 'fileId': file_id,
+                      'removed': file_id not in self.files}
+            if not change['removed']:
+                change['file'] = self._resource(self.files[file_id])
+            changes.append(change)
+        response = {'kind': 'drive#changeList', 'changes': changes}
+        if start + page_size < len(self.changes):
+            response['nextPageToken'] = str(start + page_size + 1)
+        else:
+            response['newStartPageToken'] = str(len(self.changes) + 1)
+        return response
+
+
+_GMAIL_TERM = re.compile(r'(-?)(?:(\w+):)?("[^"]*"|\S+)')
+
+SYSTEM_LABELS = ['INBOX', 'SENT', 'TRASH', 'SPAM', 'DRAFT', 'UNREAD',
+                 'STARRED', 'IMPORTANT']
+
+
+class FakeGmail:
+    """State and handlers of the fake gmail api
+
+    Attributes:
+        email_address (str): address of the user
+        labels (dict): label records by id
+        messages (dict): message records by id, with the raw messages
+            stored in `_blob`
+        history (list): history records, in order
+    """
+
+    def __init__(self, backend, email_address: str='me@example.com'):
+        self.backend = backend
+        self.email_address = email_address
+        self.labels = {label: {'id': label, 'name': label, 'type': 'system'}
+                       for label in SYSTEM_LABELS}
+        self.messages = {}
+        self.history = []
+        self.history_id = 1000
+        # History ids older than this one have expired
+        self.first_history_id = self.history_id
+
+    def add_message(self, subject: str='', text: str='',
+                    sender: str='sender@example.com', to: str=None,
+                    label_ids: list=('INBOX', 'UNREAD'))->dict:
+        """Store a message, as if it was received
+
+        Args:
+            subject (str): subject of the message
+            text (str): plain text content of the message
+            sender (str): address of the sender
+            to (str): address of the recipient. Default: `email_address`
+            label_ids (list of str): labels of the message
+
+        Returns:
+            dict, the message record, in the "minimal" format
+        """
+        from email.mime.text import MIMEText
+
+        message = MIMEText(text)
+        message['Subject'] = subject
+        message['From'] = sender
+        message['To'] = to or self.email_address
+        media = self.backend.new_blob()
+        media.write_bytes(message.as_bytes())
+        with self.backend.lock:
+            return self._resource(self._new_message(media, label_ids),
+                                  'minimal')
+
+    def expire_history(self):
+        """Forget the history, as gmail does after about a week"""
+        with self.backend.lock:
+            self.history = []
+            self.first_history_id = self.history_id + 1
+
+    def _record(self, **changes)->str:
+        self.history_id += 1
+        record = {'id': str(self.history_id), **changes}
+        record['messages'] = [change['message'] for entries
+                              in changes.values() for change in entries]
+        self.history.append(record)
+        return record['id']
+
+    def _new_message(self, media: Path, label_ids: list)->dict:
+        from email.parser import BytesParser
+
+        with media.open('rb') as fd:
+            head = fd.read(64 * 1024)
+        size = media.stat().st_size
+        parsed = BytesParser().parsebytes(head, headersonly=size > len(head))
+        snippet = ''
+        if size <= len(head):
+            for part in parsed.walk():
+                if part.get_content_type() == 'text/plain':
+                    snippet = (part.get_payload(decode=True) or b'').decode(
+                        errors='replace')[:200].strip()
+                    break
+        message_id = self.backend.new_id()
+        message = {'id': message_id, 'threadId': message_id,
+                   'labelIds': list(label_ids), 'snippet': snippet,
+                   'sizeEstimate': size,
+                   'internalDate': str(int(time.time() * 1000)),
+                   '_headers': [(name, str(value))
+                                for name, value in parsed.items()],
+                   '_blob': media}
+        self.messages[message_id] = message
+        message['historyId'] = self._record(messagesAdded=[{
+            'message': self._resource(message, 'minimal', history=True)}])
+        return message
+
+    def _resource(self, message: dict, message_format: str='full',
+                  metadata_headers: list=None, history: bool=False)->dict:
+        if history:
+            return {'id': message['id'], 'threadId': message['threadId'],
+                    'labelIds': list(message['labelIds'])}
+        resource = {key: (list(value) if isinstance(value, list) else value)
+                    for key, value in message.items()
+                    if not key.startswith('_')}
+        if message_format in ('metadata', 'full'):
+            headers = [{'name': name, 'value': value}
+                       for name, value in message['_headers']
+                       if message_format == 'full' or not metadata_headers
+                       or name.lower() in {header.lower() for header
+                                           in metadata_headers}]
+            resource['payload'] = {'mimeType': dict(message['_headers']).get(
+                'Content-Type', 'text/plain').split(';')[0],
+                'headers': headers}
+            if message_format == 'full':
+                data = message['snippet'].encode()
+                resource['payload'].update(
+                    partId='', filename='',
+                    body={'size': len(data),
+                          'data': base64.urlsafe_b64encode(data).decode()})
+        elif message_format == 'raw':
+            resource['raw'] = base64.urlsafe_b64encode(
+                message['_blob'].read_bytes()).decode()
+        return resource
+
+    def _message(self, message_id: str)->dict:
+        message = self.messages.get(message_id)
+        if message is None:
+            raise ApiError(404, 'notFound', 'Requested entity was not found.')
+        return message
+
+    def _label_ids(self, label_ids: list)->list:
+        for label_id in label_ids:
+            if label_id not in self.labels:
+                raise ApiError(400, 'invalidArgument',
+                               f'Invalid label: {label_id}')
+        return label_ids
+
+    def _modify(self, message: dict, add: list, remove: list):
+        added = [label for label in add if label not in message['labelIds']]
+        removed = [label for label in remove
+                   if label in message['labelIds'] and label not in add]
+        message['labelIds'] = [label for label in message['labelIds']
+                               if label not in removed] + added
+        changes = {}
+        if added:
+            changes['labelsAdded'] = [{
+                'message': self._resource(message, history=True),
+                'labelIds': added}]
+        if removed:
+            changes['labelsRemoved'] = [{
+                'message': self._resource(message, history=True),
+                'labelIds': removed}]
+        if changes:
+            message['historyId'] = self._record(**changes)
+
+    def _query(self, query: str)->callable:
+        """Predicate on the messages matching a gmail search query
+
+        Supports the in:, label:, is:, from:, to: and subject: operators,
+        negations and words searched in the headers and snippet.
+        """
+        labels = {label['name'].lower().replace(' ', '-').replace('/', '-'):
+                  label['id'] for label in self.labels.values()}
+        predicates = []
+        anywhere = False
+        for negated, operator, value in _GMAIL_TERM.findall(query or ''):
+            value = value.strip('"').lower()
+            operator = operator.lower()
+            if operator == 'in' and value == 'anywhere':
+                anywhere = True
+                continue
+            if operator in ('in', 'label'):
+                label_id = labels.get(value, value.upper())
+                anywhere |= label_id in ('TRASH', 'SPAM') and not negated
+
+                def predicate(message, label_id=label_id):
+                    return label_id in message['labelIds']
+            elif operator == 'is':
+                label_id = {'read': 'UNREAD'}.get(value, value.upper())
+
+                def predicate(message, label_id=label_id, value=value):
+                    return (label_id in message['labelIds']) \
+                        != (value == 'read')
+            elif operator in ('from', 'to', 'subject'):
+                def predicate(message, operator=operator, value=value):
+                    return any(name.lower() == operator
+                               and value in str(header).lower()
+                               for name, header in message['_headers'])
+            else:
+                def predicate(message, value=value):
+                    return any(value in str(header).lower()
+                               for _, header in message['_headers']) \
+                        or value in message['snippet'].lower()
+            predicates.append(
+                (lambda message, predicate=predicate: not predicate(message))
+                if negated else predicate)
+        if not anywhere:
+            predicates.append(lambda message: not {'TRASH', 'SPAM'} & set(
+                message['labelIds']))
+        return lambda message: all(predicate(message)
+                                   for predicate in predicates)
+
+    def users_get_profile(self, call: _Call)->dict:
+        return {'emailAddress': self.email_address,
+                'messagesTotal': len(self.messages),
+                'threadsTotal': len(self.messages),
+                'historyId': str(self.history_id)}
+
+    def users_labels_list(self, call: _Call)->dict:
+        return {'labels': [dict(label) for label in self.labels.values()]}
+
+    def users_labels_create(self, call: _Call)->dict:
+        name = (call.body or {}).get('name', '')
+        if not name or any(label['name'].lower() == name.lower()
+                           for label in self.labels.values()):
+            raise ApiError(409, 'alreadyExists',
+                           'Label name exists or conflicts')
+        label = {**call.body, 'id': f'Label_{self.backend.new_id()}',
+                 'name': name, 'type': 'user'}
+        self.labels[label['id']] = label
+        return dict(label)
+
+    def users_labels_delete(self, call: _Call):
+        label = self.labels.get(call.get('id'))
+        if label is None:
+            raise ApiError(404, 'notFound', 'Not Found')
+        if label['type'] == 'system':
+            raise ApiError(400, 'invalidArgument',
+                           'Invalid delete request')
+        del self.labels[label['id']]
+        for message in self.messages.values():
+            if label['id'] in message['labelIds']:
+                message['labelIds'].remove(label['id'])
+
+    def users_messages_list(self, call: _Call)->dict:
+        predicate = self._query(call.get('q'))
+        label_ids = call.get_list('labelIds')
+        messages = [message for message in reversed(list(
+                        self.messages.values()))
+                    if predicate(message)
+                    and all(label in message['labelIds']
+                            for label in label_ids)]
+        page_size = min(int(call.get('maxResults') or 100), 500)
+        start = int(call.get('pageToken') or 0)
+        response = {'resultSizeEstimate': len(messages)}
+        if messages[start:start + page_size]:
+            response['messages'] = [
+                {'id': message['id'], 'threadId': message['threadId']}
+                for message in messages[start:start + page_size]]
+        if start + page_size < len(messages):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+    def users_messages_get(self, call: _Call)->dict:
+        message_format = call.get('format') or 'full'
+        if message_format not in ('minimal', 'metadata', 'full', 'raw'):
+            raise ApiError(400, 'invalidArgument',
+                           f'Invalid format: {message_format}')
+        return self._resource(self._message(call.get('id')), message_format,
+                              call.get_list('metadataHeaders'))
+
+    def users_messages_send(self, call: _Call)->dict:
+        media = call.media
+        if media is None:
+            raw = (call.body or {}).get('raw')
+            if raw is None:
+                raise ApiError(400, 'invalidArgument',
+                               "'raw' RFC822 payload message string or "
+                               "uploading message via /upload/* URL "
+                               "required")
+            media = self.backend.new_blob()
+            media.write_bytes(base64.urlsafe_b64decode(
+                raw + '=' * (-len(raw) % 4)))
+        message = self._new_message(media, ['SENT'])
+        return self._resource(message, history=True)
+
+    def users_messages_modify(self, call: _Call)->dict:
+        message = self._message(call.get('id'))
+        body = call.body or {}
+        self._modify(message,
+                     self._label_ids(body.get('addLabelIds', [])),
+                     self._label_ids(body.get('removeLabelIds', [])))
+        return self._resource(message, history=True)
+
+    def users_messages_batch_modify(self, call: _Call):
+        body = call.body or {}
+        if len(body.get('ids', [])) > 1000:
+            raise ApiError(400, 'invalidArgument',
+                           'Too many messages in the request')
+        add = self._label_ids(body.get('addLabelIds', []))
+        remove = self._label_ids(body.get('removeLabelIds', []))
+        for message_id in body.get('ids', []):
+            if message_id in self.messages:
+                self._modify(self.messages[message_id], add, remove)
+
+    def users_messages_batch_delete(self, call: _Call):
+        body = call.body or {}
+        if len(body.get('ids', [])) > 1000:
+            raise ApiError(400, 'invalidArgument',
+                           'Too many messages in the request')
+        for message_id in body.get('ids', []):
+            message = self.messages.pop(message_id, None)
+            if message is not None:
+                self._record(messagesDeleted=[{
+                    'message': self._resource(message, history=True)}])
+
+    def users_history_list(self, call: _Call)->dict:
+        start_history_id = int(call.get('startHistoryId') or 0)
+        if start_history_id < self.first_history_id:
+            raise ApiError(404, 'notFound', 'Requested entity was not found.')
+        records = [record for record in self.history
+                   if int(record['id']) > start_history_id]
+        page_size = min(int(call.get('maxResults') or 100), 500)
+        start = int(call.get('pageToken') or 0)
+        response = {'historyId': str(self.history_id)}
+        if records[start:start + page_size]:
+            response['history'] = records[start:start + page_size]
+        if start + page_size < len(records):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+
+class _FakeHttp:
+    """`httplib2.Http` interface over a `FakeBackend`"""
+
+    timeout = None
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri: str, method: str='GET', body=None,
+                headers: dict=None, redirections: int=5,
+                connection_type=None):
+        return self.backend.request(uri, method, body, headers)
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+    """`http.client.HTTPConnection` interface over a `FakeBackend`
+
+    Subclassed with the backend as `backend`: httplib2 instantiates its
+    connections from their class.
+    """
+
+    backend = None
+
+    def __init__(self, host: str, port: int=None, timeout: float=None,
+                 **kwargs):
+        self.host = host
+        self.timeout = timeout
+        self.sock = None
+        self._request = None
+
+    def set_debuglevel(self, level: int):
+        pass
+
+    def connect(self):
+        self.sock = object()
+
+    def request(self, method: str, url: str, body=None, headers: dict=None):
+        self._request = (f'https://{self.host}{url}', method, body, headers)
+
+    def getresponse(self):
+        # Answered when read, so that lost responses time out there
+        response, content = self.backend.request(*self._request)
+        self._request = None
+        return _FakeResponse(response, content)
+
+    def close(self):
+        self.sock = None
+
+
+class _FakeResponse(dict):
+    """Response of a `_FakeConnection`, read by `httplib2.Response`"""
+
+    def __init__(self, response, content: bytes):
+        super().__init__(response)
+        self.content = content
+
+    def read(self)->bytes:
+        return self.content
+
+
+class FakeBackend:
+    """In-memory drive and gmail apis, see the module documentation
+
+    `transport` returns a transport of the package (see `transport.py`)
+    whose connections send their requests to the backend. The backend can
+    also be used as a transport itself: its `http` method returns http
+    objects sending their requests to it directly.
+
+    Attributes:
+        drive (FakeDrive): the drive api, ex: to seed files
+        gmail (FakeGmail): the gmail api, ex: to seed messages
+        latency (float or callable): time in seconds waited before answering
+            each request, or function returning it
+        error_rate (float): fraction of the requests failing with a 503
+            backendError
+        calls (Counter): number of requests answered, by method id. Batch
+            requests count as "batch".
+        bytes_received, bytes_sent (int): size of the request and response
+            bodies
+        credentials: credentials the services of the backend are
+            authorized with
+    """
+
+    def __init__(self, latency=0., error_rate: float=0., seed: int=None,
+                 email_address: str='me@example.com'):
+        from oauth2client.client import AccessTokenCredentials
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.credentials = AccessTokenCredentials(
+            'fake-token', 'google_services fake backend')
+        self._random = random.Random(seed)
+        self._failures = deque()
+        self._lost = deque()
+        self._ids = itertools.count(1)
+        self._sessions = {}
+        self._directory = tempfile.TemporaryDirectory(
+            prefix='google_services_fake_')
+        self._routes = []
+        for root_url, service_path, batch_path, methods in APIS.values():
+            self._routes.append(('POST', re.compile(f'/{batch_path}'),
+                                 'batch', root_url))
+            for method_id, (http_method, path, _, options) \
+                    in methods.items():
+                pattern = re.sub(r'{(\w+)}', r'(?P<\1>[^/]+)',
+                                 re.escape(service_path + path).replace(
+                                     r'\{', '{').replace(r'\}', '}'))
+                prefixes = ['/', '/upload/'] if 'upload' in options \
+                    else ['/']
+                for prefix in prefixes:
+                    self._routes.append((http_method,
+                                         re.compile(prefix + pattern),
+                                         method_id, root_url))
+        self.drive = FakeDrive(self)
+        self.gmail = FakeGmail(self, email_address)
+
+    def new_id(self)->str:
+        """Unique id for a new resource"""
+        return f'{next(self._ids):012x}'
+
+    def new_blob(self)->Path:
+        """Path of a new file to store a content in"""
+        return Path(self._directory.name) / self.new_id()
+
+    def fail(self, status: int=503, reason: str='backendError',
+             count: int=1, method_id: str=None, retry_after: float=None):
+        """Make the next requests fail
+
+        Args:
+            status (int): http status of the errors
+            reason (str): reason code of the errors
+            count (int): number of requests to fail
+            method_id (str): only fail the requests to this method, ex:
+                "drive.files.list"
+            retry_after (float): value of the retry-after header of the
+                errors, in seconds
+        """
+        headers = {} if retry_after is None else {
+            'retry-after': str(retry_after)}
+        with self.lock:
+            for _ in range(count):
+                self._failures.append(
+                    (method_id, ApiError(status, reason, headers=headers)))
+
+    def lose_responses(self, count: int=1, method_id: str=None):
+        """Process the next requests, but time out instead of answering them
+
+        Like responses lost on the network: the client can not tell whether
+        the requests were processed.
+
+        Args:
+            count (int): number of responses to lose
+            method_id (str): only lose the responses to this method, ex:
+                "gmail.users.messages.send"
+        """
+        with self.lock:
+            self._lost.extend([method_id] * count)
+
+    def _lose_response(self, method_id: str)->bool:
+        for lost in self._lost:
+            if lost in (None, method_id):
+                self._lost.remove(lost)
+                return True
+        return False
+
+    def _inject_error(self, method_id: str):
+        for failure in self._failures:
+            if failure[0] in (None, method_id):
+                self._failures.remove(failure)
+                raise failure[1]
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise ApiError(503, 'backendError', 'Backend Error')
+
+    def http(self)->_FakeHttp:
+        """Http object sending its requests to the backend"""
+        return _FakeHttp(self)
+
+    def transport(self, kind: str=None):
+        """Transport of the package sending its requests to the backend
+
+        The requests go through the real transport, which only has its
+        connections replaced: see `transport.py`.
+
+        Args:
+            kind (str): "httplib2" or "httpx". Default: the kind picked by
+                `transport.default_transport`
+
+        Returns:
+            HttplibTransport or Http2Transport
+        """
+        from google_services import transport
+        from google_services.config import default as default_config
+
+        if kind is None:
+            kind = 'httpx' if (default_config.http2
+                               and transport.http2_available()) \
+                else 'httplib2'
+        if kind == 'httplib2':
+            return transport.HttplibTransport(
+                timeout=default_config.http_timeout,
+                connection_type=type('Connection', (_FakeConnection,),
+                                     {'backend': self}))
+        if kind == 'httpx':
+            import httpx
+
+            return transport.Http2Transport(
+                max_connections=default_config.http_max_connections,
+                keepalive_expiry=default_config.http_keepalive_expiry,
+                timeout=default_config.http_timeout, http2=False,
+                transport=httpx.MockTransport(self._answer_httpx))
+        raise ValueError(f'unknown transport kind: {kind}')
+
+    def _answer_httpx(self, request):
+        """Answer a request of an `httpx.Client`"""
+        import httpx
+
+        response, content = self.request(str(request.url), request.method,
+                                         request.content,
+                                         dict(request.headers))
+        return httpx.Response(
+            response.status, content=content,
+            headers={name: value for name, value in response.items()
+                     if name != 'status'})
+
+    def close(self):
+        """Delete the stored contents"""
+        self._directory.cleanup()
+
+    def service(self, api: str, version: str):
+        """Service of an api, sending its requests to the backend
+
+        Args:
+            api (str): name of the api, "drive" or "gmail"
+            version (str): version of the api, "v3" or "v1"
+
+        Returns:
+            The official python wrapper around the api
+        """
+        from googleapiclient.discovery import build_from_document
+        from google_services.credentials import authorize
+        from google_services.quota import request_builder
+
+        return build_from_document(
+            discovery_document(api, version),
+            http=authorize(self.credentials, self.http()),
+            requestBuilder=request_builder())
+
+    @contextmanager
+    def install(self, transport: str=None):
+        """Make the default services of the package use the backend
+
+        The caches of ids of the package are emptied when entering and
+        leaving the context, since they hold ids of the other backend.
+
+        Args:
+            transport (str): kind of the transport sending the requests to
+                the backend, see `transport`
+
+        Yields:
+            the backend
+        """
+        from google_services import discovery, drive, mail, pool
+
+        documents = {key: discovery_document(*key) for key in APIS}
+        with discovery._lock:
+            saved_documents = {key: discovery._documents.get(key)
+                               for key in documents}
+            discovery._documents.update(documents)
+        saved_pool = (pool.default_pool.credentials_getter,
+                      pool.default_pool.transport)
+        # The services of the pool are built again for new credentials
+        pool.default_pool.credentials_getter = lambda: self.credentials
+        pool.default_pool.transport = self.transport(transport)
+        drive.path_cache.clear()
+        mail.label_cache.clear()
+        try:
+            yield self
+        finally:
+            pool.default_pool.transport.close()
+            (pool.default_pool.credentials_getter,
+             pool.default_pool.transport) = saved_pool
+            with discovery._lock:
+                for key, document in saved_documents.items():
+                    if document is None:
+                        discovery._documents.pop(key, None)
+                    else:
+                        discovery._documents[key] = document
+            drive.path_cache.clear()
+            mail.label_cache.clear()
+
+    def request(self, uri: str, method: str='GET', body=None,
+                headers: dict=None)->tuple:
+        """Answer an http request, like `httplib2.Http.request`
+
+        Returns:
+            (httplib2.Response, bytes) tuple
+        """
+        from httplib2 import Response
+
+        # oauth2client passes the headers as bytes
+        headers = {_text(name).lower(): _text(value)
+                   for name, value in (headers or {}).items()}
+        if hasattr(body, 'read'):
+            # Chunk of a resumable upload from a stream
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+        body = body or b''
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+
+        split = urlsplit(uri)
+        status, response_headers, content = self._answer(
+            method, split.path, split.query, headers, body)
+        with self.lock:
+            self.bytes_received += len(body)
+            self.bytes_sent += len(content)
+        response = Response({**response_headers, 'status': str(status),
+                             'content-length': str(len(content))})
+        response.reason = responses.get(status, '')
+        return response, content
+
+    def _route(self, method: str, path: str)->tuple:
+        for http_method, pattern, method_id, root_url in self._routes:
+            match = pattern.fullmatch(path)
+            if match is not None and http_method == method:
+                return method_id, root_url, match.groupdict()
+        raise ApiError(404, 'notFound', f'Not Found: {method} {path}')
+
+    def _answer(self, method: str, path: str, query: str, headers: dict,
+                body: bytes)->tuple:
+        """Status, headers and content of the answer to a request"""
+        if headers.get('x-http-method-override') == 'GET':
+            # googleapiclient sends the GETs with long urls as POSTs, with
+            # their parameters in a form-encoded body
+            method, query, body = 'GET', body.decode(), b''
+        query = parse_qs(query, keep_blank_values=True)
+        method_id = None
+        try:
+            with self.lock:
+                if 'upload_id' in query:
+                    session = self._sessions.get(query['upload_id'][0])
+                    if session is None:
+                        raise ApiError(404, 'notFound', 'Upload not found')
+                    method_id = session['call'].method_id
+                else:
+                    method_id, root_url, path_parameters = self._route(
+                        method, path)
+                self.calls[method_id] += 1
+                self._inject_error(method_id)
+                lost = self._lose_response(method_id)
+                try:
+                    if method_id == 'batch':
+                        return self._batch(headers, body)
+                    if 'upload_id' in query:
+                        return self._upload_chunk(query['upload_id'][0],
+                                                  headers, body)
+                    call = _Call(method_id, path_parameters, query,
+                                 headers=headers)
+                    upload_type = call.get('uploadType')
+                    if path.startswith('/upload/') and upload_type is None:
+                        raise ApiError(400, 'badRequest',
+                                       'Upload requests must include an '
+                                       'uploadType URL parameter')
+                    if upload_type == 'resumable':
+                        return self._start_upload(call, root_url + path[1:],
+                                                  body)
+                    if upload_type == 'media':
+                        call.media = self.new_blob()
+                        call.media.write_bytes(body)
+                    elif upload_type == 'multipart':
+                        call.body, call.media = self._split_multipart(
+                            headers.get('content-type', ''), body)
+                    elif body:
+                        call.body = json.loads(body.decode())
+                    return self._handle(call)
+                finally:
+                    if lost:
+                        # Processed, but the answer never arrives
+                        raise socket.timeout('timed out')
+        except ApiError as error:
+            if error.status >= 500 or error.status == 429:
+                logger.debug(f'fake backend failing {method_id}: '
+                             f'{error.status} {error.reason}')
+            return (error.status,
+                    {**error.headers,
+                     'content-type': 'application/json; charset=UTF-8'},
+                    error.content())
+
+    def _handle(self, call: _Call)->tuple:
+        api, name = call.method_id.split('.', 1)
+        if api == 'gmail' and call.get('userId') not in (
+                'me', self.gmail.email_address):
+            raise ApiError(403, 'forbidden',
+                           'Delegation denied for ' + call.get('userId'))
+        handler = getattr(getattr(self, api), re.sub(
+            r'[A-Z]', lambda match: '_' + match[0].lower(),
+            name.replace('.', '_')))
+        result = handler(call)
+        if isinstance(result, _Raw):
+            return result.status, result.headers, result.content
+        if result is None:
+            return 204, {}, b''
+        fields = call.get('fields') or DEFAULT_FIELDS.get(call.method_id)
+        if fields:
+            result = _project(result, _parse_fields(fields))
+        return (200, {'content-type': 'application/json; charset=UTF-8'},
+                json.dumps(result).encode())
+
+    def _split_multipart(self, content_type: str, body: bytes)->tuple:
+        """Metadata and content of a multipart upload"""
+        match = re.search(r'boundary="?([^";]+)"?', content_type)
+        if match is None:
+            raise ApiError(400, 'badContent', 'Missing multipart boundary')
+        delimiter = b'--' + match[1].encode()
+        parts = []
+        position = body.find(delimiter)
+        while 0 <= position and body[position + len(delimiter):
+                                     position + len(delimiter) + 2] != b'--':
+            # The content of a part starts after its headers
+            start = body.find(b'\n\n', position)
+            crlf_start = body.find(b'\r\n\r\n', position)
+            if crlf_start >= 0 and (start < 0 or crlf_start < start):
+                start = crlf_start + 4
+            elif start >= 0:
+                start += 2
+            else:
+                break
+            position = body.find(b'\n' + delimiter, start)
+            if position < 0:
+                break
+            end = position - 1 if body[position - 1:position] == b'\r' \
+                else position
+            parts.append((start, end))
+            position += 1
+        if len(parts) != 2:
+            raise ApiError(400, 'badContent', 'Invalid multipart request')
+        (metadata_start, metadata_end), (media_start, media_end) = parts
+        media = self.new_blob()
+        with media.open('wb') as fd:
+            fd.write(memoryview(body)[media_start:media_end])
+        metadata = body[metadata_start:metadata_end].strip()
+        return (json.loads(metadata.decode()) if metadata else None), media
+
+    def _start_upload(self, call: _Call, uri: str, body: bytes)->tuple:
+        """Open a resumable upload session, answered at `uri`"""
+        if body:
+            call.body = json.loads(body.decode())
+        call.media = self.new_blob()
+        call.media.touch()
+        upload_id = self.new_id()
+        self._sessions[upload_id] = {'call': call, 'received': 0}
+        return 200, {'location': f'{uri}?uploadType=resumable&'
+                                 f'upload_id={upload_id}'}, b''
+
+    def _upload_chunk(self, upload_id: str, headers: dict,
+                      body: bytes)->tuple:
+        """Receive a chunk of a resumable upload"""
+        session = self._sessions[upload_id]
+        match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)',
+                         headers.get('content-range', ''))
+        if match is None:
+            raise ApiError(400, 'badRequest', 'Invalid Content-Range')
+        if match[1] is not None:
+            start = int(match[1])
+            if start > session['received']:
+                raise ApiError(400, 'badRequest',
+                               'Content-Range does not match the received '
+                               'content')
+            with session['call'].media.open('r+b') as fd:
+                fd.seek(start)
+                fd.write(body)
+                fd.truncate()
+            session['received'] = start + len(body)
+        if match[3] != '*' and session['received'] == int(match[3]):
+            del self._sessions[upload_id]
+            return self._handle(session['call'])
+        range_header = {} if session['received'] == 0 else {
+            'range': f"bytes=0-{session['received'] - 1}"}
+        return 308, range_header, b''
+
+    def _batch(self, headers: dict, body: bytes)->tuple:
+        """Answer the requests of a batch request"""
+        import email
+        import uuid
+
+        message = email.message_from_bytes(
+            b'Content-Type: ' + headers.get('content-type', '').encode()
+            + b'\r\n\r\n' + body)
+        parts = message.get_payload()
+        if not isinstance(parts, list) or len(parts) > BATCH_MAX_SIZE:
+            raise ApiError(400, 'badRequest',
+                           f'A batch request must contain between 1 and '
+                           f'{BATCH_MAX_SIZE} requests')
+        boundary = f'batch_{uuid.uuid4().hex}'
+        answer = []
+        for part in parts:
+            request_line, _, request = part.get_payload().partition('\n')
+            method, target, _ = request_line.strip().split(' ')
+            request = email.message_from_string(request)
+            split = urlsplit(target)
+            status, response_headers, content = self._answer(
+                method, split.path, split.query,
+                {name.lower(): value for name, value in request.items()},
+                request.get_payload().encode())
+            content_id = part['Content-ID'].strip('<>')
+            answer.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {responses.get(status, "")}\r\n'
+                + ''.join(f'{name}: {value}\r\n'
+                          for name, value in response_headers.items())
+                + f'Content-Length: {len(content)}\r\n'
+                + f'\r\n{content.decode()}\r\n')
+        answer.append(f'--{boundary}--\r\n')
+        return (200,
+                {'content-type': f'multipart/mixed; boundary={boundary}'},
+                ''.join(answer).encode())
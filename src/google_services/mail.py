@@ -2,64 +2,94 @@
 
 """
 
-from google_services.credentials import get_creds
-from google_services._utilities import memoize, apply_defaults, logger
+from google_services import metrics
+from google_services.cache import Cache
+from google_services.config import default as default_config
+from google_services.pool import default_pool, pool_like, Executor
+from google_services._utilities import apply_defaults, logger, execute_batch, \
+    parse_response
+from google_services.retry import retrying, execute, default_policy
 
-# The different components of the python google-api-wrapper
-from googleapiclient.discovery import build
-from httplib2 import Http
-
-# The components letting us send email
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import base64
+from itertools import islice
+import json
+from pathlib import Path
+import re
+from string import Template
+import threading
+import time
+
+# Maximum number of messages per batchModify / batchDelete request
+BATCH_MODIFY_SIZE = 1000
+
+# Label ids by ('name', name), and names by ('id', id), see `label_id`. The
+# functions of this module update it with the changes they make.
+label_cache = Cache(max_size=None, ttl=default_config.label_cache_ttl,
+                    name='mail.label_cache')
 
 
-@memoize
 def default_service():
     """Lazy getter for the default gmail-api-service to use
+
+    Each thread gets its own service, see `pool.ServicePool`.
     """
-    logger.info("instantiating gmail service")
-    return build('gmail', 'v1', http=get_creds().authorize(Http()))
+    return default_pool.get('gmail', 'v1')
 
 
+@retrying('gmail')
 @apply_defaults(service=default_service)
-def get_labels(service=None)->list:
+def get_labels(service=None, fields: str=None)->list:
     """Fetches all existing labels in the user's inbox
 
     Args:
         service (optional, gmail-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): the fields of the labels to return, ex: "id, type".
+            Default: `config.default.gmail_label_fields`
     Returns:
-        list of dict, label information records. The id and name for each
-        label existing in the user's inbox.
+        list of dict, label information records. The `fields` of each label
+        existing in the user's inbox.
     """
     logger.info('fetching labels')
-    return service.users().labels().list(userId='me').execute().get(
+    fields = fields or default_config.gmail_label_fields
+    # The id and name index the labels, see `label_id`
+    labels = service.users().labels().list(
+        userId='me', fields=f'labels({fields}, id, name)').execute().get(
         'labels', [])
+    # Set first, to expire before the entries of the labels
+    label_cache.set('loaded', True)
+    for label in labels:
+        _index_label(label)
+    return [_project_label(label, fields) for label in labels]
 
 
+@retrying('gmail', idempotent=False)
 @apply_defaults(service=default_service)
-def create_label(label_name: str, service=None)->dict:
+def create_label(label_name: str, service=None, fields: str=None)->dict:
     """Create a label with the specified name in the user's inbox
 
     Args:
         label_name(str): Name of the label to create
         service (optional, gmail-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): see `get_labels`
     Returns:
-        dict containing the id and name of the created label
+        dict containing the `fields` of the created label
     """
     logger.info('creating label')
+    fields = fields or default_config.gmail_label_fields
     label = service.users().labels().create(
         userId='me',
         body={
             'messageListVisibility': 'show',
             'name': label_name,
-            'labelListVisibility': 'labelShow'}).execute()
-    return label
+            'labelListVisibility': 'labelShow'},
+        fields=f'{fields}, id, name').execute()
+    _index_label(label)
+    return _project_label(label, fields)
 
 
+@retrying('gmail')
 @apply_defaults(service=default_service)
 def delete_label(label_id: str, service=None)->dict:
     """Delete the label with the specified id
@@ -72,25 +102,163 @@ def delete_label(label_id: str, service=None)->dict:
         dict containing the id and name of the created label
     """
     service.users().labels().delete(id=label_id, userId='me').execute()
+    label_cache.invalidate(('name', label_cache.get(('id', label_id))))
+    label_cache.invalidate(('id', label_id))
+
+
+def _project_label(label: dict, fields: str)->dict:
+    """The top-level `fields` of a label record, ex: "id, color/textColor"
+    keeps its id and color"""
+    keys, depth, start = set(), 0, 0
+    for i, character in enumerate(fields + ','):
+        depth += {'(': 1, ')': -1}.get(character, 0)
+        if character == ',' and depth == 0:
+            keys.add(re.split(r'[/(]', fields[start:i])[0].strip())
+            start = i + 1
+    if '*' in keys:
+        return label
+    return {key: value for key, value in label.items() if key in keys}
+
+
+def _index_label(label: dict):
+    label_cache.set(('name', label['name']), label['id'])
+    label_cache.set(('id', label['id']), label['name'])
+
+
+@apply_defaults(service=default_service)
+def label_id(label_name: str, create: bool=False, service=None)->str:
+    """Id of the label with the specified name
+
+    Labels are looked up in `label_cache`, filled by a single labels.list
+    request, and kept up to date by `create_label` and `delete_label`.
+    Labels changed by other clients are seen once the cache expires, after
+    `config.default.label_cache_ttl` seconds.
+
+    Args:
+        label_name (str): Name of the label, ex: "INBOX" or "test_label"
+        create (bool): create the label if it does not exist
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        str, the id of the label
+    Raises:
+        KeyError, if there is no label with this name and `create` is False
+    """
+    if label_cache.get('loaded') is None:
+        get_labels(service=service)
+    found = label_cache.get(('name', label_name))
+    if found is not None:
+        return found
+    if not create:
+        raise KeyError(f'no label named {label_name!r}')
+    from googleapiclient.errors import HttpError
+
+    try:
+        return create_label(label_name, service=service)['id']
+    except HttpError as error:
+        if error.resp.status != 409:
+            raise
+        # Created by another client since the index was loaded
+        get_labels(service=service)
+        return label_id(label_name, service=service)
+
+
+@apply_defaults(service=default_service)
+def label_name(label_id: str, service=None)->str:
+    """Name of the label with the specified id, see `label_id`
+
+    Args:
+        label_id (str): Id of the label
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        str, the name of the label
+    Raises:
+        KeyError, if there is no label with this id
+    """
+    if label_cache.get('loaded') is None:
+        get_labels(service=service)
+    found = label_cache.get(('id', label_id))
+    if found is None:
+        raise KeyError(f'no label with id {label_id!r}')
+    return found
+
+
+@apply_defaults(service=default_service)
+def label_ids(labels, create: bool=False, service=None)->list:
+    """Ids of labels given by id or by name
+
+    Args:
+        labels (str or list of str): Ids or names of the labels. A str is
+            a single label, whose name can contain commas.
+        create (bool): create the labels that do not exist
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        list of str, the ids of the labels
+    Raises:
+        KeyError, if a label does not exist and `create` is False
+    """
+    if isinstance(labels, str):
+        labels = [labels]
+    if label_cache.get('loaded') is None:
+        get_labels(service=service)
+    return [label if label_cache.get(('id', label)) is not None
+            else label_id(label, create=create, service=service)
+            for label in labels]
+
+
+def _write_attachment(destination, path: Path):
+    """Write a file, base64 encoded, as a part of a multipart message
+
+    The file is read by blocks, so it is never held in memory.
+    """
+    import mimetypes
+    from email.mime.base import MIMEBase
+
+    mime_type, encoding = mimetypes.guess_type(path.name)
+    if mime_type is None or encoding is not None:
+        mime_type = 'application/octet-stream'
+    part = MIMEBase(*mime_type.split('/', 1))
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=path.name)
+    part.set_payload('')
+    destination.write(part.as_bytes())
+    with path.open('rb') as source:
+        # Multiple of the 57 bytes encoded on each 76 characters line
+        for block in iter(lambda: source.read(57 * 1024), b''):
+            destination.write(base64.encodebytes(block))
 
 
 # https://stackoverflow.com/questions/37201250/sending-email-via-gmail-python
 def create_mail(sender: str, to: str, subject: str, msg_html: str,
-                msg_plain: str)->dict:
+                msg_plain: str, attachments: list=None)->dict:
     """Create an email message.
 
     I got this to work thanks to
     https://stackoverflow.com/questions/37201250/sending-email-via-gmail-python
 
+    With attachments, the message is written to a temporary file, streaming
+    the attachments from the disk, and is sent by `send` through a media
+    upload: neither the attachments nor the message are held in memory.
+
     Args:
         sender (str): Mail address of sender
         to (str): Destination mail address
         subject (str): Mail subject
         msg_html (str): Html content for the mail
         msg_plain (str): String version of the mail
+        attachments (list of str): Paths to the files to attach
     Returns:
-        Message body in mime format
+        Message body in mime format. With attachments, {"file": path}, the
+        path to the temporary file holding the message, to remove once the
+        message is sent (see `send_mail`).
     """
+    # The components letting us send email
+    from email.mime.base import MIMEBase
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     logger.info('creating mail')
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
@@ -98,34 +266,117 @@ def create_mail(sender: str, to: str, subject: str, msg_html: str,
     msg['To'] = to
     msg.attach(MIMEText(msg_plain, 'plain'))
     msg.attach(MIMEText(msg_html, 'html'))
-    raw = base64.urlsafe_b64encode(msg.as_bytes())
-    raw = raw.decode()
-    body = {'raw': raw}
-    return body
-
-
+    if not attachments:
+        raw = base64.urlsafe_b64encode(msg.as_bytes())
+        raw = raw.decode()
+        body = {'raw': raw}
+        return body
+
+    import tempfile
+    import uuid
+
+    boundary = f'==============={uuid.uuid4().hex}=='
+    envelope = MIMEBase('multipart', 'mixed', boundary=boundary)
+    for header in ['Subject', 'From', 'To']:
+        envelope[header] = msg[header]
+        del msg[header]
+    envelope.set_payload('')
+    with tempfile.NamedTemporaryFile(suffix='.eml', delete=False) as file:
+        try:
+            file.write(envelope.as_bytes())
+            file.write(f'--{boundary}\n'.encode())
+            file.write(msg.as_bytes())
+            for attachment in attachments:
+                file.write(f'\n--{boundary}\n'.encode())
+                _write_attachment(file, Path(attachment).expanduser())
+            file.write(f'\n--{boundary}--\n'.encode())
+        except BaseException:
+            # Ex: a missing attachment, do not leave the partial message
+            file.close()
+            Path(file.name).unlink()
+            raise
+    return {'file': file.name}
+
+
+@retrying('gmail', idempotent=False)
 @apply_defaults(service=default_service)
-def send(user_id: str, mime_msg: dict, service=None)->dict:
+def send(user_id: str, mime_msg: dict, service=None, fields: str=None,
+         parse: bool=True)->dict:
     logger.info('sending mail')
     """Send an email message.
     
+    Messages created with attachments are uploaded from their file, through
+    a resumable upload if they are bigger than
+    `config.default.resumable_upload_threshold`.
+
     Args:
         user_id (str): User's email address. The special value
             "me" can be used to indicate the authenticated user.
         mime_msg (mime message): Message to be sent
         service (optional, gmail-api-service): the service to use. Default: 
             the result of `default_service()`
+        fields (str): the fields of the message to return, ex: "id".
+            Default: `config.default.gmail_message_fields`
+        parse (bool): if False, the response is not parsed, and its raw
+            bytes are returned. For calls whose result is not used.
     Returns:
         dict containing information about the message sent, including it's id
     """
-    result = service.users().messages().send(
-        userId=user_id, body=mime_msg).execute()
+    fields = fields or default_config.gmail_message_fields
+    if 'file' in mime_msg:
+        from googleapiclient.http import MediaFileUpload
+
+        path = Path(mime_msg['file'])
+        body = {key: value for key, value in mime_msg.items()
+                if key != 'file'}
+        media_body = MediaFileUpload(
+            str(path),
+            mimetype='message/rfc822',
+            chunksize=default_config.upload_chunk_size,
+            resumable=(path.stat().st_size
+                       > default_config.resumable_upload_threshold))
+        return parse_response(service.users().messages().send(
+            userId=user_id, body=body or None, media_body=media_body,
+            fields=fields), parse).execute()
+    result = parse_response(service.users().messages().send(
+        userId=user_id, body=mime_msg, fields=fields), parse).execute()
     return result
 
 
+@apply_defaults(service=default_service)
+def send_mail(sender: str, to: str, subject: str, msg_html: str,
+              msg_plain: str, attachments: list=None, service=None,
+              fields: str=None, parse: bool=True)->dict:
+    """Create and send an email message, see `create_mail` and `send`
+
+    Args:
+        sender (str): Mail address of sender
+        to (str): Destination mail address
+        subject (str): Mail subject
+        msg_html (str): Html content for the mail
+        msg_plain (str): String version of the mail
+        attachments (list of str): Paths to the files to attach
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+        fields (str): see `send`
+        parse (bool): see `send`
+    Returns:
+        dict containing information about the message sent, including it's id
+    """
+    message = create_mail(sender, to, subject, msg_html, msg_plain,
+                          attachments)
+    try:
+        return send('me', message, service=service, fields=fields,
+                    parse=parse)
+    finally:
+        if 'file' in message:
+            Path(message['file']).unlink()
+
+
 @apply_defaults(service=default_service)
 def send_file(mail_address: str, mail_subject: str, file_id: str,
-              service=None, sender: str='send.file@google.api')->dict:
+              service=None, sender: str='send.file@google.api',
+              fields: str=None, parse: bool=True)->dict:
     """Send a mail with a link to a google doc
 
     Args:
@@ -135,6 +386,8 @@ def send_file(mail_address: str, mail_subject: str, file_id: str,
         service (optional, gmail-api-service): the service to use. Default:
             the result of `default_service()`
         sender (str): Mail address of the sender
+        fields (str): see `send`
+        parse (bool): see `send`
     Returns:
         dict, information about the message used to send the file, including
         it's id
@@ -147,12 +400,195 @@ def send_file(mail_address: str, mail_subject: str, file_id: str,
         f"<a href=https://docs.google.com/document/d/{file_id}>"
         f"Project description</a>",
         f"https://docs.google.com/document/d/{file_id}")
-    return send('me', message, service=service)
+    return send('me', message, service=service, fields=fields, parse=parse)
+
+
+@apply_defaults(service=default_service)
+def send_bulk(recipients, sender: str, subject: str, msg_html: str,
+              msg_plain: str, journal_path: str, workers: int=8,
+              resend_unconfirmed: bool=False, service=None)->dict:
+    """Send a templated mail to many recipients
+
+    `subject`, `msg_html` and `msg_plain` are `string.Template`s, compiled
+    once and rendered with the fields of each recipient, ex:
+    "Hello $first_name". The mails are sent by `workers` concurrent
+    threads.
+
+    Each send is recorded in the journal, a JSON-lines file. Running
+    `send_bulk` again with the same journal resumes the run: the recipients
+    already sent to are skipped, as are the ones whose send was interrupted
+    or got an ambiguous error: a server error, a timeout or a lost
+    connection (it may have been sent: they are reported "unconfirmed"
+    instead of risking a duplicate). The recipients whose send failed are
+    retried.
+
+    Args:
+        recipients (iterable of dict): the recipients, with a "to" field
+            holding their mail address, and the template fields. An
+            optional "key" field identifies the recipient in the journal,
+            default: the "to" field. Can be a generator.
+        sender (str): Mail address of the sender
+        subject (str): template of the mail subject
+        msg_html (str): template of the html content of the mail
+        msg_plain (str): template of the string version of the mail
+        journal_path (str): path to the journal of the run
+        workers (int): number of concurrent sends. Each worker uses its own
+            service, with the credentials of `service`.
+        resend_unconfirmed (bool): send again to the recipients whose send
+            by a previous run is unconfirmed, at the risk of duplicates
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        dict, report of the run, with the keys:
+            sent, failed, skipped, unconfirmed (int): number of recipients
+                sent to, whose send failed, already sent to by a previous
+                run, and whose send (by this run or a previous one) is
+                unconfirmed
+            duration (float): duration of the run, in seconds
+            rate (float): mails sent per second
+    """
+    logger.info('sending mails')
+    templates = [Template(subject), Template(msg_html), Template(msg_plain)]
+    journal_path = Path(journal_path).expanduser()
+    journal_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = {}
+    if journal_path.exists():
+        with journal_path.open() as journal:
+            for line in journal:
+                entry = json.loads(line)
+                previous[entry['key']] = entry['status']
+
+    report = dict(sent=0, failed=0, skipped=0, unconfirmed=0)
+    lock = threading.Lock()
+    journal = journal_path.open('a')
+
+    def record(key: str, status: str, **details):
+        with lock:
+            journal.write(json.dumps(dict(key=key, status=status,
+                                          **details)) + '\n')
+            journal.flush()
+            if status != 'sending':
+                report[status] += 1
+
+    def pending():
+        seen = set()
+        for recipient in recipients:
+            key = recipient.get('key', recipient['to'])
+            if key in seen:
+                continue
+            seen.add(key)
+            status = previous.get(key)
+            if status == 'sent':
+                report['skipped'] += 1
+            elif status in ('sending', 'unconfirmed') \
+                    and not resend_unconfirmed:
+                report['unconfirmed'] += 1
+            else:
+                yield key, recipient
+
+    pool = pool_like(service)
+
+    def send_one(key: str, recipient: dict):
+        sending = False
+        try:
+            send_service = pool.get('gmail', 'v1') if workers > 1 else service
+            message = create_mail(
+                sender, recipient['to'],
+                *[template.substitute(recipient) for template in templates])
+            record(key, 'sending')
+            sending = True
+            result = send('me', message, service=send_service, fields='id')
+        except Exception as error:
+            # The send may have been processed before a server error or a
+            # lost response
+            ambiguous = (sending and default_policy.is_retryable(error)
+                         and not default_policy.is_retryable(
+                             error, idempotent=False))
+            record(key, 'unconfirmed' if ambiguous else 'failed',
+                   error=str(error))
+        else:
+            record(key, 'sent', id=result['id'])
+
+    start = time.perf_counter()
+    try:
+        with Executor(max_workers=workers) as executor:
+            for _ in executor.map(lambda args: send_one(*args), pending()):
+                pass
+    finally:
+        journal.close()
+    report['duration'] = time.perf_counter() - start
+    report['rate'] = report['sent'] / report['duration']
+    logger.info(f"sent {report['sent']} mails at {report['rate']:.1f}/s")
+    return report
+
+
+@apply_defaults(service=default_service)
+def iter_messages(query: str, max_results: int=500, hydrate: bool=False,
+                  message_format: str='metadata', metadata_headers: list=None,
+                  fields: str=None, batch_size: int=50, service=None):
+    """Lazily list messages matching the specified query
+
+    Pages of results are fetched on demand, and only one page is held in
+    memory at a time. With `hydrate`, the content of the messages is fetched
+    by batch requests of `batch_size` messages, instead of one request per
+    message.
+
+    Args:
+        query (str): a gmail-message-search-query. Documentation link:
+            https://support.google.com/mail/answer/7190?hl=en
+        max_results (int): number of messages requested per page, at most
+            500
+        hydrate (bool): yield the messages' content instead of their ids
+        message_format (str): format of the hydrated messages: "minimal",
+            "metadata", "full" or "raw"
+        metadata_headers (list of str): with the "metadata" format, the
+            headers to fetch, ex: ["From", "Subject"]. Default: all of them
+        fields (str): the message fields to fetch, ex: "id, labelIds".
+            Documentation link:
+            https://developers.google.com/gmail/api/guides/performance
+        batch_size (int): number of messages fetched per batch request.
+            Gmail advises against batches of more than 50 requests.
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Yields:
+        dict, the ids (and thread ids) of the messages matching the query,
+        or their content with `hydrate`. Messages deleted before being
+        hydrated are skipped.
+    """
+    logger.info('iterating over mails')
+    messages = service.users().messages()
+    page_token = None
+    while True:
+        # Retried alone: a failure does not restart the listing
+        response = execute(messages.list(userId='me', q=query,
+                                         maxResults=max_results,
+                                         pageToken=page_token))
+        page = response.get('messages', [])
+        metrics.hooks.page('gmail.users.messages.list', len(page))
+        if not hydrate:
+            yield from page
+        else:
+            for start in range(0, len(page), batch_size):
+                requests = [messages.get(userId='me', id=message['id'],
+                                         format=message_format,
+                                         metadataHeaders=metadata_headers,
+                                         fields=fields)
+                            for message in page[start:start + batch_size]]
+                for message, error in execute_batch(service, requests):
+                    if error is None:
+                        yield message
+                    elif error.resp.status != 404:
+                        raise error
+
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            break
 
 
 @apply_defaults(service=default_service)
 def get_messages(query: str, service=None)->list:
-    """List messages matching the specified query
+    """List messages matching the specified query, see `iter_messages`
+
     Args:
         query (str): a gmail-message-search-query. Documentation link:
             https://support.google.com/mail/answer/7190?hl=en
@@ -164,30 +600,22 @@ def get_messages(query: str, service=None)->list:
         appropriate ID to get the details of a Message.
     """
     logger.info('getting mails')
-    response = service.users().messages().list(userId='me',
-                                               q=query).execute()
-    messages = []
-    if 'messages' in response:
-        messages.extend(response['messages'])
-
-    while 'nextPageToken' in response:
-        page_token = response['nextPageToken']
-        response = service.users().messages().list(
-            userId='me', q=query, pageToken=page_token).execute()
-        messages.extend(response['messages'])
-
-    return messages
+    return list(iter_messages(query, service=service))
 
 
+@retrying('gmail')
 @apply_defaults(service=default_service)
-def archive_message(message_id: str, extra_labels: str=None, service=None):
+def archive_message(message_id: str, extra_labels: str=None, service=None,
+                    fields: str=None, parse: bool=True):
     """Mark a message with a label, as read and archive it
     Args:
         message_id (str): Id of the message to archive
-        extra_labels (str): Labels to add to the message in the form
-            "label_1,label2"
+        extra_labels (str or list of str): Id or name of a label to add to
+            the message, or a list of them. The missing labels are created.
         service (optional, gmail-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): see `send`
+        parse (bool): see `send`
     Returns:
         the api request's result
     """
@@ -198,28 +626,272 @@ def archive_message(message_id: str, extra_labels: str=None, service=None):
             ]
         }
     if extra_labels is not None:
-        body["addLabelIds"] = [extra_labels]
-    return service.users().messages().modify(
+        body["addLabelIds"] = label_ids(extra_labels, create=True,
+                                        service=service)
+    return parse_response(service.users().messages().modify(
         id=message_id,
-        userId='me', body=body).execute()
+        userId='me', body=body,
+        fields=fields or default_config.gmail_message_fields), parse).execute()
 
 
+@retrying('gmail')
 @apply_defaults(service=default_service)
-def move_to_trash(message_id: str, service=None):
+def move_to_trash(message_id: str, service=None, fields: str=None,
+                  parse: bool=True):
     """Mark a message with a label, as read and archive it
     Args:
         message_id (str): Id of the message to trash
         service (optional, gmail-api-service): the service to use. Default:
             the result of `default_service()`
+        fields (str): see `send`
+        parse (bool): see `send`
     Returns:
         the api request's result
     """
     logger.info('moving mail to trash')
 
-    return service.users().messages().modify(
+    return parse_response(service.users().messages().modify(
         id=message_id,
         userId='me', body={
             "addLabelIds": [
                 'TRASH',
             ]
-        }).execute()
+        }, fields=fields or default_config.gmail_message_fields),
+        parse).execute()
+
+
+def _chunks(messages, size: int=BATCH_MODIFY_SIZE):
+    """Lists of at most `size` message ids, from an iterable of ids or of
+    message records"""
+    messages = iter(messages)
+    while True:
+        chunk = [message['id'] if isinstance(message, dict) else message
+                 for message in islice(messages, size)]
+        if not chunk:
+            break
+        yield chunk
+
+
+def _execute_chunks(build_request: callable, messages)->int:
+    """Execute one request per chunk of messages
+
+    A chunk failing with a transient error is re-sent (see `retry.py`). The
+    chunks that succeeded are not re-sent.
+
+    Returns:
+        int, the number of messages processed
+    """
+    count = 0
+    for chunk in _chunks(messages):
+        execute(build_request(chunk))
+        count += len(chunk)
+    return count
+
+
+@apply_defaults(service=default_service)
+def modify_messages(messages, add_label_ids: list=None,
+                    remove_label_ids: list=None, service=None)->int:
+    """Add and remove labels of many messages
+
+    Messages are modified by chunks of 1000, in one request per chunk.
+
+    Args:
+        messages (iterable): Ids of the messages, or message records as
+            yielded by `iter_messages`. Can be a generator.
+        add_label_ids (list of str): Ids or names of the labels to add. The
+            missing labels are created.
+        remove_label_ids (list of str): Ids or names of the labels to remove
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        int, the number of messages modified
+    """
+    logger.info('modifying mails')
+    body = {}
+    if add_label_ids:
+        body['addLabelIds'] = label_ids(add_label_ids, create=True,
+                                        service=service)
+    if remove_label_ids:
+        body['removeLabelIds'] = label_ids(remove_label_ids, service=service)
+    return _execute_chunks(
+        lambda chunk: service.users().messages().batchModify(
+            userId='me', body={'ids': chunk, **body}),
+        messages)
+
+
+@apply_defaults(service=default_service)
+def archive_messages(messages, extra_labels: list=None, service=None)->int:
+    """Mark many messages with labels, as read and archive them
+
+    See `archive_message` and `modify_messages`.
+
+    Args:
+        messages (iterable): Ids of the messages, or message records as
+            yielded by `iter_messages`. Can be a generator.
+        extra_labels (list of str): Ids or names of the labels to add to the
+            messages. The missing labels are created.
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        int, the number of messages archived
+    """
+    logger.info('archiving mails')
+    return modify_messages(messages, add_label_ids=extra_labels,
+                           remove_label_ids=['UNREAD', 'INBOX'],
+                           service=service)
+
+
+@apply_defaults(service=default_service)
+def trash_messages(messages, service=None)->int:
+    """Move many messages to the trash
+
+    See `move_to_trash` and `modify_messages`.
+
+    Args:
+        messages (iterable): Ids of the messages, or message records as
+            yielded by `iter_messages`. Can be a generator.
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        int, the number of messages moved to the trash
+    """
+    logger.info('moving mails to trash')
+    return modify_messages(messages, add_label_ids=['TRASH'],
+                           service=service)
+
+
+@apply_defaults(service=default_service)
+def delete_messages(messages, service=None)->int:
+    """Permanently delete many messages, by chunks of 1000
+
+    Requires the "https://mail.google.com/" scope, see `config.Config`.
+
+    Args:
+        messages (iterable): Ids of the messages, or message records as
+            yielded by `iter_messages`. Can be a generator.
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        int, the number of messages deleted
+    """
+    logger.info('deleting mails')
+    return _execute_chunks(
+        lambda chunk: service.users().messages().batchDelete(
+            userId='me', body={'ids': chunk}),
+        messages)
+
+
+def _full_sync(service)->dict:
+    """Report listing all the messages as added, see `sync`"""
+    logger.info('listing all mails')
+    # Taken before the listing so that no change is missed
+    history_id = execute(service.users().getProfile(
+        userId='me', fields='historyId'))['historyId']
+    return dict(history_id=history_id,
+                full_sync=True,
+                added=[message['id'] for message in iter_messages(
+                    '', service=service)],
+                deleted=[],
+                labels_added={},
+                labels_removed={})
+
+
+def _history_sync(history_id: str, service)->dict:
+    """Report of the changes since `history_id`, see `sync`"""
+    logger.info('fetching mail history')
+    added, deleted = set(), set()
+    labels_added, labels_removed = {}, {}
+    page_token = None
+    while True:
+        response = execute(service.users().history().list(
+            userId='me', startHistoryId=history_id, maxResults=500,
+            pageToken=page_token,
+            fields='nextPageToken, historyId, history('
+                   'messagesAdded/message/id, messagesDeleted/message/id, '
+                   'labelsAdded(message/id, labelIds), '
+                   'labelsRemoved(message/id, labelIds))'))
+        metrics.hooks.page('gmail.users.history.list',
+                           len(response.get('history', [])))
+        for record in response.get('history', []):
+            for change in record.get('messagesAdded', []):
+                added.add(change['message']['id'])
+            for change in record.get('messagesDeleted', []):
+                deleted.add(change['message']['id'])
+            for changes, labels in [
+                    (record.get('labelsAdded', []), labels_added),
+                    (record.get('labelsRemoved', []), labels_removed)]:
+                for change in changes:
+                    labels.setdefault(change['message']['id'], set()).update(
+                        change['labelIds'])
+
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            break
+    return dict(history_id=response['historyId'],
+                full_sync=False,
+                added=sorted(added - deleted),
+                deleted=sorted(deleted),
+                labels_added={message_id: sorted(labels)
+                              for message_id, labels in labels_added.items()
+                              if message_id not in deleted},
+                labels_removed={message_id: sorted(labels)
+                                for message_id, labels
+                                in labels_removed.items()
+                                if message_id not in deleted})
+
+
+@apply_defaults(service=default_service)
+def sync(history_path: str=None, service=None)->dict:
+    """Changes of the mailbox since the previous synchronization
+
+    The history id reached is stored in `history_path`, and the next
+    synchronization only fetches the changes made after it, from the gmail
+    history:
+    https://developers.google.com/gmail/api/guides/sync
+    Its cost depends on the number of changes, not on the size of the
+    mailbox.
+
+    The first synchronization, or one whose history id has expired (gmail
+    keeps about a week of history), lists all the messages of the mailbox
+    as added, and sets `full_sync` in the report.
+
+    Args:
+        history_path (str): path to the file storing the history id.
+            Default: `config.default.mail_history_path`
+        service (optional, gmail-api-service): the service to use. Default:
+            the result of `default_service()`
+    Returns:
+        dict, report of the synchronization, with the keys:
+            history_id (str): the history id reached
+            full_sync (bool): whether all the messages were listed
+            added (list of str): ids of the new messages
+            deleted (list of str): ids of the deleted messages
+            labels_added (dict): label ids added, by message id
+            labels_removed (dict): label ids removed, by message id
+    """
+    from googleapiclient.errors import HttpError
+
+    logger.info('synchronizing mails')
+    if history_path is None:
+        history_path = default_config.mail_history_path
+    history_path = Path(history_path).expanduser()
+    history_id = (json.loads(history_path.read_text())['history_id']
+                  if history_path.exists() else None)
+
+    report = None
+    if history_id is not None:
+        try:
+            report = _history_sync(history_id, service)
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            logger.info('mail history id expired')
+    if report is None:
+        report = _full_sync(service)
+
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = history_path.with_suffix('.tmp')
+    temporary_path.write_text(json.dumps(
+        {'history_id': report['history_id']}))
+    temporary_path.replace(history_path)
+    return report
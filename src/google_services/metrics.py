@@ -0,0 +1,650 @@
+"""Instrumentation of the api calls: metrics and traces
+
+The package reports what it does to `hooks`, an implementation of `Hooks`:
+- `request`: each http request sent by the google-api services, with the
+  id of its api method (ex: "drive.files.list"), its duration, status and
+  sizes in bytes. The sub-requests of a batch are reported with the
+  duration of the whole batch, and the batch itself as an "<api>.batch"
+  request.
+- `call`: each call of a wrapper function, ex: "drive.get_files"
+- `page`: each page of results fetched by a listing
+- `retry`: each call re-sent after a transient error (see `retry.py`)
+- `throttle`: each wait for the quotas (see `quota.py`)
+- `cache`: each lookup in a named `cache.Cache`, hit or miss
+- `span`: context manager around the calls of the wrapper functions and
+  the requests, for tracing
+
+The default hooks do nothing, and the requests and calls are not measured
+while they are installed.
+Other hooks are installed with `set_hooks`:
+- `Recorder` keeps the metrics in memory, see `Recorder.snapshot`
+- `PrometheusHooks` updates `prometheus_client` counters and histograms
+- `OpenTelemetryHooks` traces the calls and requests as OpenTelemetry spans
+- `combine` reports to several hooks at once, ex:
+  `set_hooks(combine(PrometheusHooks(), OpenTelemetryHooks()))`
+
+The requests of the `aio` module are not reported.
+
+"""
+
+from contextlib import contextmanager, nullcontext, ExitStack
+import math
+import threading
+import time
+
+
+class Hooks:
+    """Receiver of the measures of the package, doing nothing
+
+    Subclasses override the methods of the measures they are interested in,
+    and set `enabled`.
+
+    Attributes:
+        enabled (bool): if False, the requests, calls and cache lookups are
+            neither measured nor reported, and there are no spans. The
+            other measures, which cost nothing, are still reported.
+    """
+
+    enabled = False
+
+    def request(self, method_id: str, duration: float, status: int,
+                request_bytes: int, response_bytes: int):
+        """An http request was sent
+
+        Args:
+            method_id (str): id of the api method, ex: "drive.files.list"
+            duration (float): time in seconds until the response arrived
+            status (int): http status of the response. None if no response
+                arrived, ex: after a network error
+            request_bytes (int): size of the request's body, None if unknown
+            response_bytes (int): size of the response's body, None if
+                unknown
+        """
+
+    def call(self, function: str, duration: float, error: Exception):
+        """A wrapper function returned
+
+        Args:
+            function (str): name of the function, ex: "drive.get_files"
+            duration (float): time in seconds spent in the call. For
+                generators, from the first item requested to the last one.
+            error (Exception): the error raised by the call, None if it
+                succeeded
+        """
+
+    def page(self, method_id: str, items: int):
+        """A listing fetched a page of results
+
+        Args:
+            method_id (str): id of the api method, ex: "drive.files.list"
+            items (int): number of items in the page
+        """
+
+    def retry(self, api: str, attempt: int, delay: float, error: Exception):
+        """A call failed with a transient error and will be re-sent
+
+        Args:
+            api (str): name of the api called, ex: "drive"
+            attempt (int): number of the failed attempt, starting from 0
+            delay (float): time in seconds before the next attempt
+            error (Exception): the error raised by the failed attempt
+        """
+
+    def throttle(self, api: str, wait: float):
+        """A request waited for the quotas
+
+        Args:
+            api (str): name of the api, ex: "gmail"
+            wait (float): time waited, in seconds
+        """
+
+    def cache(self, name: str, hit: bool):
+        """A cache was looked up
+
+        Args:
+            name (str): name of the cache, ex: "drive.path_cache"
+            hit (bool): whether the value was in the cache
+        """
+
+    def span(self, name: str, **attributes):
+        """Context manager around a call or a request
+
+        Args:
+            name (str): name of the function or id of the api method
+            **attributes: details of the call or request
+        """
+        return _NO_SPAN
+
+
+_NO_SPAN = nullcontext()
+
+hooks = Hooks()
+
+
+def set_hooks(new_hooks: Hooks)->Hooks:
+    """Report the measures of the package to `new_hooks`
+
+    Args:
+        new_hooks (Hooks): the hooks to install. `Hooks()` to stop
+            reporting.
+
+    Returns:
+        Hooks, the previously installed hooks
+    """
+    global hooks
+    previous, hooks = hooks, new_hooks
+    return previous
+
+
+def _size(body)->int:
+    return len(body) if body is not None else 0
+
+
+def measure_request(method_id: str, send: callable, http_method: str='GET',
+                    request_bytes: callable=None, response: callable=None):
+    """Call `send()`, sending an http request, and report it to the hooks
+
+    Args:
+        method_id (str): id of the api method, ex: "drive.files.list"
+        send (callable): sends the request, called with no arguments
+        http_method (str): ex: "GET"
+        request_bytes (callable): called with no arguments once the request
+            is sent, returns the size of its body
+        response (callable): called with the result of a successful
+            `send()`, returns the status and body size of the response
+
+    Returns:
+        the result of `send()`
+    """
+    current = hooks
+    if not current.enabled:
+        return send()
+    from googleapiclient.errors import HttpError
+
+    with current.span(method_id, http_method=http_method):
+        start = time.perf_counter()
+        status, response_bytes = None, None
+        try:
+            result = send()
+            if response is not None:
+                status, response_bytes = response(result)
+            return result
+        except HttpError as error:
+            status = int(error.resp.status)
+            response_bytes = _size(error.content)
+            raise
+        finally:
+            current.request(
+                method_id, time.perf_counter() - start, status,
+                request_bytes() if request_bytes is not None else None,
+                response_bytes)
+
+
+def _body_size(body, headers: dict)->int:
+    """Size of a request body, bytes or a stream of a resumable upload"""
+    if body is None or isinstance(body, (bytes, str)):
+        return _size(body)
+    length = (headers or {}).get('Content-Length')
+    return int(length) if length is not None else None
+
+
+class _MeasuredHttp:
+    """Http object reporting each of its requests to the hooks
+
+    Measured at the http level, each request is reported once, ex: the
+    session start and each chunk of a resumable upload, and whatever
+    processes the responses, ex: `_utilities.parse_response`.
+    """
+
+    def __init__(self, http, method_id: str):
+        self.http = http
+        self.method_id = method_id
+
+    def request(self, uri: str, method: str='GET', body=None,
+                headers: dict=None, *args, **kwargs):
+        return measure_request(
+            self.method_id,
+            lambda: self.http.request(uri, method, body, headers, *args,
+                                      **kwargs),
+            method, request_bytes=lambda: _body_size(body, headers),
+            response=lambda result: (int(result[0].status),
+                                     _size(result[1])))
+
+    def __getattr__(self, name: str):
+        return getattr(self.http, name)
+
+
+def measure_batch(requests: list, send: callable, results: callable):
+    """Execute a batch of requests with `send`, and report it
+
+    Args:
+        requests (list of HttpRequest): the sub-requests of the batch
+        send (callable): executes the batch, called with the http object
+            to send it with, None for the default one
+        results (callable): called with no arguments after a successful
+            `send`, returns the (result, error) tuples of the sub-requests
+
+    Returns:
+        the result of `send`
+    """
+    current = hooks
+    if not current.enabled:
+        return send(None)
+    start = time.perf_counter()
+    result = send(_MeasuredHttp(requests[0].http,
+                                requests[0].methodId.split('.')[0] + '.batch'))
+    duration = time.perf_counter() - start
+    for request, (_, error) in zip(requests, results()):
+        if error is None:
+            # The sizes of the parts of the batch response are not known
+            status, response_bytes = 200, None
+        else:
+            status = int(error.resp.status)
+            response_bytes = _size(error.content)
+        # Each in its own span, like the requests sent alone
+        with current.span(request.methodId, http_method=request.method,
+                          batched=True):
+            current.request(request.methodId, duration, status,
+                            _size(request.body), response_bytes)
+    return result
+
+
+def _measure_generator(function: str, items):
+    current = hooks
+    start = time.perf_counter()
+    error = None
+    try:
+        return (yield from items)
+    except GeneratorExit:
+        # Closed before the end: not a failure
+        raise
+    except Exception as exception:
+        error = exception
+        raise
+    finally:
+        current.call(function, time.perf_counter() - start, error)
+
+
+def measure_call(function: str, call: callable, generator: bool=False):
+    """Call `call()`, a call of a wrapper function, and report it
+
+    Used by `_utilities.apply_defaults`, for all the wrapper functions.
+
+    Args:
+        function (str): name of the function, ex: "drive.get_files"
+        call (callable): makes the call, with no arguments
+        generator (bool): `call()` returns a generator. The call is then
+            measured until the generator is exhausted, and has no span:
+            the generator runs interleaved with its consumer.
+
+    Returns:
+        the result of `call()`
+    """
+    current = hooks
+    if not current.enabled:
+        return call()
+    if generator:
+        return _measure_generator(function, call())
+    with current.span(function):
+        start = time.perf_counter()
+        error = None
+        try:
+            return call()
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            current.call(function, time.perf_counter() - start, error)
+
+
+def request_builder():
+    """`HttpRequest` subclass reporting its requests to the hooks
+
+    Each http request sent by `execute` or `next_chunk`, ex: the session
+    start and each chunk of a resumable upload, is reported with the status
+    and size of its http response.
+
+    Returns:
+        class
+    """
+    global _InstrumentedHttpRequest
+    if _InstrumentedHttpRequest is None:
+        from googleapiclient.http import HttpRequest
+
+        class InstrumentedHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                if hooks.enabled and not isinstance(http, _MeasuredHttp):
+                    http = _MeasuredHttp(http or self.http, self.methodId)
+                return super().execute(http=http, num_retries=num_retries)
+
+            def next_chunk(self, http=None, num_retries=0):
+                if hooks.enabled and not isinstance(http, _MeasuredHttp):
+                    http = _MeasuredHttp(http or self.http, self.methodId)
+                return super().next_chunk(http=http,
+                                          num_retries=num_retries)
+
+        _InstrumentedHttpRequest = InstrumentedHttpRequest
+    return _InstrumentedHttpRequest
+
+
+_InstrumentedHttpRequest = None
+
+
+class Recorder(Hooks):
+    """Hooks keeping the metrics in memory, see `snapshot`
+
+    Attributes:
+        buckets (tuple of float): upper bounds, in seconds, of the buckets
+            of the duration histograms
+    """
+
+    enabled = True
+    BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, math.inf)
+
+    def __init__(self, buckets: tuple=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all the measures"""
+        with self._lock:
+            self._requests = {}
+            self._calls = {}
+            self._pages = {}
+            self._retries = {}
+            self._throttles = {}
+            self._caches = {}
+
+    def _timing(self, timings: dict, key: str, duration: float,
+                failed: bool)->dict:
+        timing = timings.get(key)
+        if timing is None:
+            timing = timings[key] = dict(
+                count=0, errors=0, duration=0., max_duration=0.,
+                histogram=[0] * len(self.buckets))
+        timing['count'] += 1
+        timing['errors'] += failed
+        timing['duration'] += duration
+        timing['max_duration'] = max(timing['max_duration'], duration)
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                timing['histogram'][i] += 1
+                break
+        return timing
+
+    def request(self, method_id, duration, status, request_bytes,
+                response_bytes):
+        with self._lock:
+            timing = self._timing(self._requests, method_id, duration,
+                                  status is None or status >= 400)
+            timing.setdefault('statuses', {})
+            timing['statuses'][status] = timing['statuses'].get(status,
+                                                                0) + 1
+            timing['request_bytes'] = (timing.get('request_bytes', 0)
+                                       + (request_bytes or 0))
+            timing['response_bytes'] = (timing.get('response_bytes', 0)
+                                        + (response_bytes or 0))
+
+    def call(self, function, duration, error):
+        with self._lock:
+            self._timing(self._calls, function, duration, error is not None)
+
+    def page(self, method_id, items):
+        with self._lock:
+            pages = self._pages.setdefault(method_id, dict(count=0, items=0))
+            pages['count'] += 1
+            pages['items'] += items
+
+    def retry(self, api, attempt, delay, error):
+        with self._lock:
+            self._retries[api] = self._retries.get(api, 0) + 1
+
+    def throttle(self, api, wait):
+        with self._lock:
+            throttles = self._throttles.setdefault(api, dict(count=0,
+                                                             wait=0.))
+            throttles['count'] += 1
+            throttles['wait'] += wait
+
+    def cache(self, name, hit):
+        with self._lock:
+            cache = self._caches.setdefault(name, dict(hits=0, misses=0))
+            cache['hits' if hit else 'misses'] += 1
+
+    def snapshot(self)->dict:
+        """Metrics measured since the creation or the last `reset`
+
+        Returns:
+            dict of
+            - "requests": {method id: timing}. A timing has the "count",
+              number of "errors", total and maximum "duration" and
+              "max_duration" in seconds, and "histogram" of the durations,
+              with the number of durations per bucket of `buckets`. The
+              requests also have their number of responses by
+              "statuses", and total "request_bytes" and "response_bytes".
+            - "calls": {function name: timing}
+            - "pages": {method id: {"count", "items"}}
+            - "retries": {api: number of retries}
+            - "throttles": {api: {"count", "wait"}}, wait in seconds
+            - "caches": {cache name: {"hits", "misses", "hit_rate"}}
+        """
+        with self._lock:
+            snapshot = dict(
+                requests=self._requests, calls=self._calls,
+                pages=self._pages, retries=self._retries,
+                throttles=self._throttles, caches=self._caches)
+            snapshot = {key: {name: _copy(value)
+                              for name, value in values.items()}
+                        for key, values in snapshot.items()}
+        for cache in snapshot['caches'].values():
+            cache['hit_rate'] = cache['hits'] / (cache['hits']
+                                                 + cache['misses'])
+        return snapshot
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class PrometheusHooks(Hooks):
+    """Hooks updating `prometheus_client` counters and histograms
+
+    Requires the `prometheus_client` package. The metrics, named after
+    `prefix`:
+    - `_requests_total`, by api "method" and "status"
+    - `_request_duration_seconds` histogram, by "method"
+    - `_request_bytes_total` and `_response_bytes_total`, by "method"
+    - `_calls_total`, by "function" and "outcome" ("success" or "error")
+    - `_call_duration_seconds` histogram, by "function"
+    - `_pages_total` and `_page_items_total`, by "method"
+    - `_retries_total`, by "api"
+    - `_throttle_seconds_total`, by "api"
+    - `_cache_lookups_total`, by "cache" and "result" ("hit" or "miss")
+
+    Attributes:
+        registry (prometheus_client.CollectorRegistry): where the metrics
+            are registered. Default: the global registry
+        prefix (str): prefix of the names of the metrics
+    """
+
+    enabled = True
+
+    def __init__(self, registry=None, prefix: str='google_services'):
+        from prometheus_client import Counter, Histogram, REGISTRY
+
+        self.registry = registry or REGISTRY
+        self.prefix = prefix
+
+        def metric(kind, name, documentation, labels):
+            return kind(f'{prefix}_{name}', documentation, labels,
+                        registry=self.registry)
+
+        self._requests = metric(Counter, 'requests', 'Api requests sent',
+                                ['method', 'status'])
+        self._request_duration = metric(
+            Histogram, 'request_duration_seconds',
+            'Duration of the api requests', ['method'])
+        self._request_bytes = metric(Counter, 'request_bytes',
+                                     'Size of the api requests bodies',
+                                     ['method'])
+        self._response_bytes = metric(Counter, 'response_bytes',
+                                      'Size of the api responses bodies',
+                                      ['method'])
+        self._calls = metric(Counter, 'calls', 'Calls of the functions',
+                             ['function', 'outcome'])
+        self._call_duration = metric(Histogram, 'call_duration_seconds',
+                                     'Duration of the calls of the '
+                                     'functions', ['function'])
+        self._pages = metric(Counter, 'pages', 'Pages of results fetched',
+                             ['method'])
+        self._page_items = metric(Counter, 'page_items',
+                                  'Items in the pages of results',
+                                  ['method'])
+        self._retries = metric(Counter, 'retries',
+                               'Calls re-sent after transient errors',
+                               ['api'])
+        self._throttle = metric(Counter, 'throttle_seconds',
+                                'Time waited for the quotas', ['api'])
+        self._cache_lookups = metric(Counter, 'cache_lookups',
+                                     'Lookups in the caches',
+                                     ['cache', 'result'])
+
+    def request(self, method_id, duration, status, request_bytes,
+                response_bytes):
+        self._requests.labels(method_id, str(status)).inc()
+        self._request_duration.labels(method_id).observe(duration)
+        if request_bytes:
+            self._request_bytes.labels(method_id).inc(request_bytes)
+        if response_bytes:
+            self._response_bytes.labels(method_id).inc(response_bytes)
+
+    def call(self, function, duration, error):
+        self._calls.labels(function,
+                           'success' if error is None else 'error').inc()
+        self._call_duration.labels(function).observe(duration)
+
+    def page(self, method_id, items):
+        self._pages.labels(method_id).inc()
+        self._page_items.labels(method_id).inc(items)
+
+    def retry(self, api, attempt, delay, error):
+        self._retries.labels(api).inc()
+
+    def throttle(self, api, wait):
+        self._throttle.labels(api).inc(wait)
+
+    def cache(self, name, hit):
+        self._cache_lookups.labels(name, 'hit' if hit else 'miss').inc()
+
+
+class OpenTelemetryHooks(Hooks):
+    """Hooks tracing the calls and requests as OpenTelemetry spans
+
+    Requires the `opentelemetry-api` package. The calls of the wrapper
+    functions and the requests are spans, the requests being children of the
+    calls sending them. The status and sizes of a request are attributes of
+    its span. The sub-requests of a batch have their own spans, opened once
+    the batch response arrived, with a "batched" attribute. The pages,
+    retries, throttling waits and cache lookups are events of the current
+    span.
+
+    Attributes:
+        tracer (opentelemetry.trace.Tracer): Default: the tracer of the
+            global tracer provider
+    """
+
+    enabled = True
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer('google_services')
+
+    def span(self, name, **attributes):
+        return self.tracer.start_as_current_span(name, attributes={
+            key: value for key, value in attributes.items()
+            if value is not None})
+
+    def _event(self, name: str, **attributes):
+        self._trace.get_current_span().add_event(name, {
+            key: value for key, value in attributes.items()
+            if value is not None})
+
+    def request(self, method_id, duration, status, request_bytes,
+                response_bytes):
+        span = self._trace.get_current_span()
+        for key, value in [('http.status_code', status),
+                           ('http.request_content_length', request_bytes),
+                           ('http.response_content_length',
+                            response_bytes)]:
+            if value is not None:
+                span.set_attribute(key, value)
+
+    def page(self, method_id, items):
+        self._event('page', method=method_id, items=items)
+
+    def retry(self, api, attempt, delay, error):
+        self._event('retry', api=api, attempt=attempt, delay=delay,
+                    error=repr(error) if error is not None else None)
+
+    def throttle(self, api, wait):
+        self._event('throttle', api=api, wait=wait)
+
+    def cache(self, name, hit):
+        self._event('cache', cache=name, hit=hit)
+
+
+class _Combined(Hooks):
+    enabled = True
+
+    def __init__(self, hooks: tuple):
+        self.hooks = hooks
+
+    def request(self, *args):
+        for hook in self.hooks:
+            hook.request(*args)
+
+    def call(self, *args):
+        for hook in self.hooks:
+            hook.call(*args)
+
+    def page(self, *args):
+        for hook in self.hooks:
+            hook.page(*args)
+
+    def retry(self, *args):
+        for hook in self.hooks:
+            hook.retry(*args)
+
+    def throttle(self, *args):
+        for hook in self.hooks:
+            hook.throttle(*args)
+
+    def cache(self, *args):
+        for hook in self.hooks:
+            hook.cache(*args)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        with ExitStack() as stack:
+            for hook in self.hooks:
+                stack.enter_context(hook.span(name, **attributes))
+            yield
+
+
+def combine(*hooks: Hooks)->Hooks:
+    """Hooks reporting the measures to each of `hooks`
+
+    Args:
+        *hooks (Hooks): ex: `PrometheusHooks(), OpenTelemetryHooks()`
+
+    Returns:
+        Hooks
+    """
+    return _Combined(hooks)
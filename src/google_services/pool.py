@@ -0,0 +1,144 @@
+"""Thread-safe access to the google-api services, and concurrent calls
+
+`httplib2.Http` is not thread-safe, so a google-api service must not be used
+by several threads at once. The pool gives each thread its own services,
+all authorized with the same credentials object. The services of a thread
+share one http object, backed by the connections of the transport (see
+`transport.py`).
+
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from google_services.credentials import get_creds, authorize
+from google_services.discovery import build_service
+from google_services.transport import default_transport
+from google_services._utilities import logger
+
+
+class ServicePool:
+    """Per-thread google-api services sharing one credentials object
+
+    Attributes:
+        credentials_getter (callable): called with no arguments to get the
+            credentials to authorize the services with
+        transport (HttplibTransport or Http2Transport): the transport of
+            the services. Default: the result of `default_transport()`
+    """
+
+    def __init__(self, credentials_getter: callable=get_creds,
+                 transport=None):
+        self.credentials_getter = credentials_getter
+        self.transport = transport
+        self._local = threading.local()
+
+    def get(self, api: str, version: str):
+        """Service of the current thread for an api
+
+        Args:
+            api (str): name of the api, ex: "drive"
+            version (str): version of the api, ex: "v3"
+
+        Returns:
+            The official python wrapper around the api
+        """
+        credentials = self.credentials_getter()
+        if getattr(self._local, 'credentials', None) is not credentials:
+            # The credentials were reloaded, ex: after a token rotation
+            transport = self.transport or default_transport()
+            self._local.credentials = credentials
+            self._local.http = authorize(credentials, transport.http())
+            self._local.services = {}
+        services = self._local.services
+        if (api, version) not in services:
+            logger.info(f"instantiating {api} service for "
+                        f"{threading.current_thread().name}")
+            services[(api, version)] = build_service(
+                api, version, http=self._local.http)
+        return services[(api, version)]
+
+    def clear(self):
+        """Forget the services of the current thread"""
+        self._local.__dict__.pop('credentials', None)
+
+
+default_pool = ServicePool()
+
+
+def pool_like(service)->ServicePool:
+    """Pool whose services use the credentials of `service`
+
+    For the worker threads of a function called with an explicit service:
+    the service itself can not be shared with them.
+
+    Args:
+        service (google-api-service): a service authorized by `authorize`
+
+    Returns:
+        ServicePool, `default_pool` if the credentials of `service` are
+        not known
+    """
+    credentials = getattr(getattr(service, '_http', None), 'request', None)
+    credentials = getattr(credentials, 'credentials', None)
+    if credentials is None:
+        return default_pool
+    return ServicePool(lambda: credentials, default_pool.transport)
+
+
+class Executor:
+    """Run wrapper functions concurrently, with bounded concurrency
+
+    The wrapper functions of this package can be run as is: when no
+    `service` is given, each worker thread uses its own default service.
+
+    Example:
+        with Executor(max_workers=8) as executor:
+            for result in executor.map(drive.copy_file, file_ids, names):
+                ...
+
+    Attributes:
+        max_workers (int): number of calls running at the same time
+    """
+
+    def __init__(self, max_workers: int=8):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='google_services')
+
+    def submit(self, f: callable, *args, **kwargs):
+        """Schedule `f(*args, **kwargs)`
+
+        Returns:
+            concurrent.futures.Future of the result
+        """
+        return self._executor.submit(f, *args, **kwargs)
+
+    def map(self, f: callable, *iterables):
+        """Apply `f` on the items of `iterables`, like the builtin `map`
+
+        The inputs are consumed lazily: at most twice `max_workers` calls
+        are pending at a time, so `iterables` can be large generators.
+
+        Yields:
+            the results of the calls, in the order of the inputs. The first
+            exception raised by a call is raised again here.
+        """
+        pending = deque()
+        for args in zip(*iterables):
+            if len(pending) >= 2 * self.max_workers:
+                yield pending.popleft().result()
+            pending.append(self._executor.submit(f, *args))
+        while pending:
+            yield pending.popleft().result()
+
+    def shutdown(self, wait: bool=True):
+        """Free the worker threads, see `ThreadPoolExecutor.shutdown`"""
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,265 @@
+"""Client-side throttling of the google-api requests to their quotas
+
+The apis limit the quota units spent per second, per user and per project.
+A gmail `messages.send` costs 100 units while a `labels.list` costs 1, and
+each drive request counts as one query:
+https://developers.google.com/gmail/api/reference/quota
+https://developers.google.com/drive/api/guides/limits
+
+Every request of the services built by `discovery.build_service` first
+takes its cost from two token buckets of its api: the user's and the
+project's. When a bucket is empty, the request waits for it to refill
+instead of being rejected by the api. The requests wait in their order of
+arrival, and the buckets refill at `config.default.quota_headroom` times
+the quotas, so that the throughput stays right under them.
+
+The project buckets are per process: processes sharing a project should
+divide its quota between them through the `Config`.
+
+"""
+
+from collections import deque
+import threading
+import time
+
+from google_services import metrics
+from google_services._utilities import logger
+from google_services.config import default as default_config, Config
+
+# Quota units of the gmail methods, by method id
+GMAIL_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.drafts.create': 10,
+    'gmail.users.drafts.delete': 10,
+    'gmail.users.drafts.get': 5,
+    'gmail.users.drafts.list': 5,
+    'gmail.users.drafts.send': 100,
+    'gmail.users.drafts.update': 15,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.create': 5,
+    'gmail.users.labels.delete': 5,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.labels.patch': 5,
+    'gmail.users.labels.update': 5,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.messages.batchDelete': 50,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.delete': 10,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.import': 25,
+    'gmail.users.messages.insert': 25,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.untrash': 5,
+    'gmail.users.threads.get': 10,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.modify': 10,
+    'gmail.users.watch': 100,
+}
+# Cost of the gmail methods missing from GMAIL_COSTS
+GMAIL_DEFAULT_COST = 5
+
+
+def cost(method_id: str)->int:
+    """Quota units used by a call to an api method
+
+    Args:
+        method_id (str): id of the method, ex: "gmail.users.messages.send"
+
+    Returns:
+        int, 1 for the drive methods
+    """
+    if method_id.startswith('gmail.'):
+        return GMAIL_COSTS.get(method_id, GMAIL_DEFAULT_COST)
+    return 1
+
+
+class TokenBucket:
+    """Token bucket, refilled at `rate` tokens per second
+
+    Requests reserve their tokens in their order of arrival, and wait until
+    the bucket has refilled enough to cover their reservation.
+
+    Attributes:
+        rate (float): tokens added per second
+        capacity (float): maximum number of tokens, that is the largest
+            burst let through without waiting
+    """
+
+    # Time in seconds over which the utilization is measured
+    WINDOW = 10
+
+    def __init__(self, rate: float, capacity: float=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens
+                           + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, tokens: float)->float:
+        """Take tokens from the bucket, possibly before they are available
+
+        Args:
+            tokens (float): number of tokens to take
+
+        Returns:
+            float, time in seconds to wait before the tokens are available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            self._spent.append((now, tokens))
+            return max(-self._tokens / self.rate, 0.)
+
+    def acquire(self, tokens: float)->float:
+        """Take tokens from the bucket, waiting until they are available
+
+        Args:
+            tokens (float): number of tokens to take
+
+        Returns:
+            float, the time waited, in seconds
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def utilization(self)->float:
+        """Tokens taken over the last `WINDOW` seconds, relative to the rate
+
+        Returns:
+            float, 1 when the tokens are taken as fast as they are added
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._spent and now - self._spent[0][0] > self.WINDOW:
+                self._spent.popleft()
+            return sum(tokens for _, tokens in self._spent) / (
+                self.rate * self.WINDOW)
+
+
+class Scheduler:
+    """Token buckets of the apis, per user and per project
+
+    Attributes:
+        config (Config): the quotas, see `config.Config`
+    """
+
+    def __init__(self, config: Config=default_config):
+        self.config = config
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: tuple, quota: float)->TokenBucket:
+        with self._lock:
+            if key not in self._buckets:
+                rate = quota * self.config.quota_headroom
+                self._buckets[key] = TokenBucket(
+                    rate, rate * self.config.quota_burst)
+            return self._buckets[key]
+
+    def acquire(self, method_id: str, user=None)->float:
+        """Wait until a call to an api method fits in the quotas
+
+        Args:
+            method_id (str): id of the method, ex: "gmail.users.messages.send"
+            user (hashable): identifies the user making the call
+
+        Returns:
+            float, the time waited, in seconds
+        """
+        api = method_id.split('.')[0]
+        if not self.config.quota_enabled \
+                or not hasattr(self.config, f'{api}_user_quota'):
+            return 0.
+        units = cost(method_id)
+        user_bucket = self._bucket(
+            (api, 'user', user), getattr(self.config, f'{api}_user_quota'))
+        project_bucket = self._bucket(
+            (api, 'project'), getattr(self.config, f'{api}_project_quota'))
+        wait = max(user_bucket.reserve(units), project_bucket.reserve(units))
+        if wait > 0:
+            logger.debug(f'waiting {wait:.2f}s for {api} quota')
+            metrics.hooks.throttle(api, wait)
+            time.sleep(wait)
+        return wait
+
+    def utilization(self)->dict:
+        """Current use of the quotas
+
+        Returns:
+            dict of {(api, "project") or (api, "user", user): float}. 1 means
+            that the requests are throttled at `quota_headroom` times the
+            quota.
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.utilization() for key, bucket in buckets.items()}
+
+
+default_scheduler = Scheduler()
+
+
+def _user(http)->int:
+    """Identify the user of an authorized http object, by its credentials"""
+    return id(getattr(getattr(http, 'request', None), 'credentials', None))
+
+
+def acquire(request)->float:
+    """Wait until a request fits in the quotas, see `Scheduler.acquire`
+
+    Args:
+        request (HttpRequest): the request about to be sent
+
+    Returns:
+        float, the time waited, in seconds
+    """
+    if request.methodId is None:
+        return 0.
+    return default_scheduler.acquire(request.methodId, _user(request.http))
+
+
+def utilization()->dict:
+    """Current use of the quotas, see `Scheduler.utilization`"""
+    return default_scheduler.utilization()
+
+
+def request_builder():
+    """`HttpRequest` subclass waiting for the quotas before each request
+
+    To give as `requestBuilder` when building a service. Resumable uploads
+    are counted once, when their session starts. The requests are also
+    reported to the metrics hooks, see `metrics.request_builder`.
+
+    Returns:
+        class
+    """
+    global _QuotaHttpRequest
+    if _QuotaHttpRequest is None:
+        class QuotaHttpRequest(metrics.request_builder()):
+            def execute(self, http=None, num_retries=0):
+                if self.resumable is None:
+                    acquire(self)
+                return super().execute(http=http, num_retries=num_retries)
+
+            def next_chunk(self, http=None, num_retries=0):
+                if self.resumable_uri is None:
+                    acquire(self)
+                return super().next_chunk(http=http, num_retries=num_retries)
+
+        _QuotaHttpRequest = QuotaHttpRequest
+    return _QuotaHttpRequest
+
+
+_QuotaHttpRequest = None
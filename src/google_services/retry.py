@@ -0,0 +1,322 @@
+"""Retries of the google-api requests failing with transient errors
+
+Rate limitations (429, 403 with a rate-limit reason) and server errors are
+retried with an exponential backoff with jitter, or after the delay asked by
+the api through the `Retry-After` header. Which errors are worth retrying is
+decided by `_utilities.is_retryable`, from the status and reason codes.
+
+Calls that can not be repeated safely, ex: creating a file or sending a mail,
+are not idempotent: a timeout or a server error can happen after the api
+processed them. They are only retried after errors showing that the request
+was not processed: rate limitations, and failures to connect.
+
+Two ways to retry:
+- `retrying` decorates the wrapper functions of the package: a call failing
+  with a transient error is made again, with the same arguments.
+- `execute` executes a single request, ex: one page of a listing, so that
+  a failure does not restart the listing from its first page.
+
+Each api has a circuit breaker: after `failure_threshold` transient errors
+in a row, its calls fail immediately with `CircuitOpenError` for
+`reset_timeout` seconds, instead of adding load to a struggling api.
+
+"""
+
+from functools import wraps
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import socket
+import threading
+import time
+
+from google_services import metrics
+from google_services._utilities import logger, is_retryable
+from google_services.config import default as default_config
+from google_services.transport import ConnectError
+
+# Network errors worth retrying
+TRANSIENT_EXCEPTIONS = (ConnectionError, TimeoutError, socket.timeout)
+# Network errors raised before the request was sent
+CONNECT_EXCEPTIONS = (ConnectionRefusedError, socket.gaierror, ConnectError)
+# Http methods of the requests that can be repeated safely
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# Api methods that can be repeated safely despite their http method: they
+# set labels or delete, rather than create
+IDEMPOTENT_METHOD_IDS = {
+    'drive.files.update',
+    'gmail.users.messages.modify',
+    'gmail.users.messages.batchModify',
+    'gmail.users.messages.batchDelete',
+    'gmail.users.messages.trash',
+    'gmail.users.messages.untrash',
+    'gmail.users.threads.modify',
+}
+
+
+class CircuitOpenError(IOError):
+    """Raised instead of calling an api whose circuit breaker is open"""
+
+
+class RetryPolicy:
+    """How many times, and after which delays, failed calls are retried
+
+    Attributes:
+        max_attempts (int): maximum number of attempts of a call, including
+            the first one
+        base_delay (float): delay in seconds before the first retry, doubled
+            at each following one
+        max_delay (float): maximum delay in seconds between two attempts,
+            including the ones asked by `Retry-After`
+        jitter (bool): wait a random delay between 0 and the backoff delay
+            ("full jitter"), so that concurrent clients do not retry in sync
+    """
+
+    def __init__(self, max_attempts: int=5, base_delay: float=1,
+                 max_delay: float=64, jitter: bool=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def is_retryable(self, error: Exception, idempotent: bool=True)->bool:
+        """Tell if a failed call is worth retrying
+
+        Args:
+            error (Exception): the error raised by the call
+            idempotent (bool): whether the call can be repeated safely. If
+                False, only the errors raised before the api processed the
+                call are retryable.
+
+        Returns:
+            bool, True for transient api and network errors
+        """
+        from googleapiclient.errors import HttpError
+
+        if isinstance(error, HttpError):
+            return is_retryable(error, idempotent)
+        if not idempotent:
+            return isinstance(error, CONNECT_EXCEPTIONS)
+        return isinstance(error, TRANSIENT_EXCEPTIONS)
+
+    def delay(self, attempt: int, error: Exception=None)->float:
+        """Time to wait before retrying
+
+        Args:
+            attempt (int): number of the failed attempt, starting from 0
+            error (Exception): the error raised by the failed attempt
+
+        Returns:
+            float, the delay in seconds
+        """
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+def _retry_after(error: Exception)->float:
+    """Delay in seconds asked by the `Retry-After` header of an api error"""
+    response = getattr(error, 'resp', None)
+    value = response.get('retry-after') if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value)
+                    - datetime.now(timezone.utc)).total_seconds(), 0.)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Stop calling an api after too many transient errors in a row
+
+    Once open, calls are refused for `reset_timeout` seconds. Then, one call
+    is let through: the breaker closes if it succeeds, and opens again if it
+    fails.
+
+    Attributes:
+        failure_threshold (int): number of transient errors in a row opening
+            the breaker
+        reset_timeout (float): time in seconds during which calls are refused
+    """
+
+    def __init__(self, failure_threshold: int=10, reset_timeout: float=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        # Thread making the trial call of a half open breaker
+        self._trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self)->bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self, name: str=''):
+        """Raise CircuitOpenError if the call should not be made"""
+        with self._lock:
+            thread = threading.get_ident()
+            if self._opened_at is None or self._trial == thread:
+                return
+            if self._trial is not None or (time.monotonic() - self._opened_at
+                                           < self.reset_timeout):
+                raise CircuitOpenError(f'too many {name} api errors, calls '
+                                       f'suspended')
+            # Half open: only this thread's call goes through until it ends
+            self._trial = thread
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial is not None \
+                    or self._failures >= self.failure_threshold:
+                logger.warning('opening circuit breaker')
+                self._opened_at = time.monotonic()
+                self._trial = None
+
+
+default_policy = RetryPolicy(
+    max_attempts=default_config.retry_max_attempts,
+    base_delay=default_config.retry_base_delay,
+    max_delay=default_config.retry_max_delay)
+
+# Circuit breakers by api name, ex: "drive"
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(api: str)->CircuitBreaker:
+    """Circuit breaker of an api, created on first use
+
+    Args:
+        api (str): name of the api, ex: "drive" or "gmail"
+    """
+    with _breakers_lock:
+        if api not in breakers:
+            breakers[api] = CircuitBreaker(
+                default_config.circuit_failure_threshold,
+                default_config.circuit_reset_timeout)
+        return breakers[api]
+
+
+def call(f: callable, api: str, policy: RetryPolicy=None,
+         idempotent: bool=True):
+    """Call `f()`, retrying it after transient errors
+
+    Errors raised once the retries are exhausted are marked, so that the
+    retries of an enclosing call do not retry them again.
+
+    Args:
+        f (callable): the call to make, without arguments
+        api (str): name of the api called, selecting the circuit breaker
+        policy (RetryPolicy): Default: `default_policy`
+        idempotent (bool): whether `f` can be repeated safely, see
+            `RetryPolicy.is_retryable`
+
+    Returns:
+        the result of `f()`
+    """
+    policy = policy or default_policy
+    breaker = get_breaker(api)
+    for attempt in range(policy.max_attempts):
+        breaker.before_call(api)
+        try:
+            result = f()
+        except CircuitOpenError:
+            raise
+        except Exception as error:
+            if getattr(error, 'retries_exhausted', False):
+                # Already retried by an enclosing call
+                raise
+            if not policy.is_retryable(error):
+                # The api answered: not a sign of an api in trouble
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if not policy.is_retryable(error, idempotent):
+                # Maybe processed: not to be repeated by an enclosing call
+                error.retries_exhausted = True
+                raise
+            if attempt == policy.max_attempts - 1:
+                error.retries_exhausted = True
+                raise
+            delay = policy.delay(attempt, error)
+            logger.info(f'retrying {api} call in {delay:.1f}s: {error}')
+            metrics.hooks.retry(api, attempt, delay, error)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def is_idempotent(request)->bool:
+    """Tell if a google-api request can be repeated safely, from its http
+    method or its api method, see `IDEMPOTENT_METHOD_IDS`
+
+    Args:
+        request (HttpRequest): the request
+
+    Returns:
+        bool
+    """
+    # The GETs with long urls are sent as POSTs overriding their method
+    method = request.headers.get('x-http-method-override', request.method)
+    return (method in IDEMPOTENT_METHODS
+            or request.methodId in IDEMPOTENT_METHOD_IDS)
+
+
+def execute(request, policy: RetryPolicy=None):
+    """Execute a google-api request, retrying it after transient errors
+
+    Args:
+        request (HttpRequest): the request to execute
+        policy (RetryPolicy): Default: `default_policy`
+
+    Returns:
+        the result of the request
+    """
+    return call(request.execute, request.methodId.split('.')[0], policy,
+                is_idempotent(request))
+
+
+def retrying(api: str, policy: RetryPolicy=None,
+             idempotent: bool=True)->callable:
+    """Retry the calls of a function after transient errors, see `call`
+
+    Stacked on top of `apply_defaults`, the default arguments are also
+    instantiated again for each attempt.
+
+    Example:
+        @retrying('drive')
+        @apply_defaults(service=default_service)
+        def delete_file(file_id: str, service=None):
+            ...
+
+    Args:
+        api (str): name of the api called by the function, ex: "drive"
+        policy (RetryPolicy): Default: `default_policy`
+        idempotent (bool): False for the functions that can not be repeated
+            safely, ex: creating a file or sending a mail
+    Returns:
+        decorator
+    """
+    def decorator(f: callable):
+        @wraps(f)
+        def helper(*args, **kwargs):
+            return call(lambda: f(*args, **kwargs), api, policy, idempotent)
+        return helper
+    return decorator
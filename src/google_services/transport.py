@@ -0,0 +1,231 @@
+"""Http transports shared by the google-api services
+
+`googleapiclient` sends its requests through an `httplib2.Http`-like object.
+Giving each service its own `Http()` means that the drive and gmail services
+never share a connection: each opens, and negotiates TLS for, its own
+connections to googleapis.com. A transport hands out the http objects of the
+services, backed by connections shared by all of them:
+
+- `HttplibTransport`: `httplib2.Http` objects sharing one set of keep-alive
+  connections per thread.
+- `Http2Transport`: one `httpx.Client` shared by all the threads, with a
+  bounded pool of keep-alive connections. Requests are multiplexed over
+  HTTP/2 connections when the `h2` package is installed.
+
+`default_transport()` picks between the two according to `config.default`.
+
+"""
+
+import threading
+
+from google_services._utilities import logger
+from google_services.config import default as default_config, Config
+
+
+class ConnectError(ConnectionError):
+    """No connection to the api could be opened: the request was not sent"""
+
+
+class HttplibTransport:
+    """`httplib2.Http` objects sharing the connections of their thread
+
+    `httplib2.Http` is not thread-safe, and keeps at most one connection per
+    host: the connection pool is made of the connections of the threads, each
+    reused by all the http objects, and so all the services, of its thread.
+
+    Attributes:
+        timeout (float): socket timeout of the requests, in seconds
+        connection_type (type): class of the connections, with the
+            interface of `http.client.HTTPConnection`. Default: the one of
+            httplib2 for the scheme of the urls. Ex: to send the requests to
+            `fake.FakeBackend`.
+    """
+
+    def __init__(self, timeout: float=None, connection_type: type=None):
+        self.timeout = timeout
+        self.connection_type = connection_type
+        self._http_type = None
+        self._local = threading.local()
+
+    def http(self):
+        """Http object using the connections of the current thread
+
+        Returns:
+            httplib2.Http
+        """
+        from httplib2 import Http
+
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        if self.connection_type is None:
+            http = Http(timeout=self.timeout)
+        else:
+            if self._http_type is None:
+                self._http_type = _connection_http(self.connection_type)
+            http = self._http_type(timeout=self.timeout)
+        # Resumable uploads answer their chunks with 308s, not redirects.
+        # httplib2 < 0.16 does not follow 308s, and has no `redirect_codes`
+        if hasattr(http, 'redirect_codes'):
+            http.redirect_codes = http.redirect_codes - {308}
+        http.connections = self._local.connections
+        return http
+
+    def close(self):
+        """Close the connections of the current thread"""
+        connections = self._local.__dict__.pop('connections', {})
+        for connection in connections.values():
+            connection.close()
+
+
+def _connection_http(connection_type: type)->type:
+    """`httplib2.Http` subclass opening its connections with
+    `connection_type`"""
+    from httplib2 import Http, DEFAULT_MAX_REDIRECTS
+
+    default_type = connection_type
+
+    class ConnectionHttp(Http):
+        def request(self, uri: str, method: str='GET', body=None,
+                    headers: dict=None,
+                    redirections: int=DEFAULT_MAX_REDIRECTS,
+                    connection_type: type=None):
+            return super().request(uri, method, body, headers, redirections,
+                                   connection_type or default_type)
+
+    return ConnectionHttp
+
+
+class _HttpxHttp:
+    """Minimal `httplib2.Http` interface over an `httpx.Client`
+
+    One is created per call to `Http2Transport.http`, since the credentials
+    authorize an http object by replacing its `request` method.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.timeout = client.timeout.read
+
+    def request(self, uri: str, method: str='GET', body=None,
+                headers: dict=None, redirections: int=5,
+                connection_type=None):
+        from httplib2 import Response
+
+        if hasattr(body, 'read'):
+            # The chunks of resumable uploads are file-like slices of the
+            # uploaded file, which httpx does not accept as content
+            body = body.read()
+        import httpx
+
+        # Raised as the network errors of httplib2, see `retry.py`
+        try:
+            response = self.client.request(
+                method, uri, content=body, headers=headers,
+                follow_redirects=redirections > 0)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as error:
+            raise ConnectError(str(error)) from error
+        except httpx.TimeoutException as error:
+            raise TimeoutError(str(error)) from error
+        except httpx.NetworkError as error:
+            raise ConnectionError(str(error)) from error
+        content = response.content
+        info = dict(response.headers.items())
+        if 'content-encoding' in info:
+            # Already decompressed by httpx, as httplib2 does
+            info['-content-encoding'] = info.pop('content-encoding')
+            info['content-length'] = str(len(content))
+        info['status'] = str(response.status_code)
+        http_response = Response(info)
+        http_response.reason = response.reason_phrase
+        return http_response, content
+
+    def close(self):
+        pass
+
+
+class Http2Transport:
+    """One `httpx.Client` shared by all the threads and services
+
+    `httpx.Client` is thread-safe: all the requests of the process share a
+    bounded pool of keep-alive connections, and the TLS sessions negotiated
+    for them.
+
+    Attributes:
+        max_connections (int): maximum number of simultaneous connections
+        keepalive_expiry (float): time in seconds after which idle
+            connections are closed
+        timeout (float): timeout of the requests, in seconds
+        http2 (bool): multiplex the requests over HTTP/2 connections.
+            Requires the `h2` package.
+        transport (httpx.BaseTransport): transport of the client. Default:
+            httpx's connection pool. Ex: to send the requests to
+            `fake.FakeBackend`.
+    """
+
+    def __init__(self, max_connections: int=10, keepalive_expiry: float=60,
+                 timeout: float=None, http2: bool=True, transport=None):
+        import httpx
+
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.http2 = http2
+        self.client = httpx.Client(
+            http2=http2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections,
+                                keepalive_expiry=keepalive_expiry),
+            transport=transport)
+
+    def http(self):
+        """Http object sending its requests through the shared client
+
+        Returns:
+            an object with the interface of `httplib2.Http`
+        """
+        return _HttpxHttp(self.client)
+
+    def close(self):
+        """Close all the connections"""
+        self.client.close()
+
+
+def http2_available()->bool:
+    """Whether `httpx` and `h2` are installed"""
+    try:
+        import httpx
+        import h2
+    except ImportError:
+        return False
+    return True
+
+
+_transports = {}
+_lock = threading.Lock()
+
+
+def default_transport(config: Config=default_config):
+    """Transport shared by the services of the package
+
+    An `Http2Transport` if `config.http2` is set and `httpx` and `h2` are
+    installed, else an `HttplibTransport`.
+
+    Args:
+        config: a config element as defined in the `config.py` package
+
+    Returns:
+        HttplibTransport or Http2Transport
+    """
+    with _lock:
+        if config not in _transports:
+            if config.http2 and http2_available():
+                logger.info('using http/2 transport')
+                _transports[config] = Http2Transport(
+                    max_connections=config.http_max_connections,
+                    keepalive_expiry=config.http_keepalive_expiry,
+                    timeout=config.http_timeout)
+            else:
+                _transports[config] = HttplibTransport(
+                    timeout=config.http_timeout)
+        return _transports[config]
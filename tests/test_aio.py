@@ -0,0 +1,87 @@
+import asyncio
+
+from google_services import aio
+
+
+def test_get_files():
+    async def get_files():
+        return await aio.drive.get_files(
+            'name="Project description template"')
+    assert len(asyncio.run(get_files())) > 0
+
+
+def test_concurrent_calls():
+    async def calls():
+        return await asyncio.gather(
+            aio.mail.get_labels(),
+            *[aio.drive.get_files('name="Project description template"')
+              for _ in range(10)])
+    labels, *files = asyncio.run(calls())
+    assert len(labels) > 0
+    assert all(len(result) > 0 for result in files)
+
+
+def test_iter_messages():
+    async def first_message():
+        async for message in aio.mail.iter_messages('', max_results=10):
+            return message
+    assert 'id' in asyncio.run(first_message())
+
+
+def test_sessions_are_closed():
+    async def open_session():
+        session = aio.default_session()
+        session._client()
+        return session
+
+    # With the loop
+    session = asyncio.run(open_session())
+    assert session._session is None
+    # And forgotten with it
+    assert session not in aio._session._sessions.values()
+
+    async def open_and_close():
+        session = await open_session()
+        await aio.close()
+        return session, aio.default_session()
+
+    session, new_session = asyncio.run(open_and_close())
+    assert session._session is None and new_session is not session
+
+    async def context_manager():
+        async with aio.Session() as session:
+            client = session._client()
+        return client
+
+    assert asyncio.run(context_manager()).closed
+
+
+def test_sessions_are_resolved_when_run(monkeypatch):
+    async def request(session, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        resolved.append(session is aio._session._sessions.get(loop))
+        return {}
+
+    monkeypatch.setattr(aio.Session, 'request', request)
+    resolved = []
+    # Created outside of the loop running it
+    coroutine = aio.mail.get_labels()
+    assert asyncio.run(coroutine) == []
+    assert resolved == [True]
+
+
+def test_send_attachments(tmp_path):
+    class Session:
+        async def request(self, method, url, params=None, headers=None,
+                          **kwargs):
+            requests.append((url, params, headers, kwargs['data'].read()))
+            return {'id': 'id'}
+
+    requests = []
+    message = tmp_path / 'message.eml'
+    message.write_bytes(b'message')
+    asyncio.run(aio.mail.send('me', {'file': str(message)},
+                              session=Session()))
+    assert requests == [(f'{aio.mail.UPLOAD_URL}/me/messages/send',
+                         {'uploadType': 'media'},
+                         {'Content-Type': 'message/rfc822'}, b'message')]
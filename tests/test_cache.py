@@ -0,0 +1,60 @@
+import threading
+import time
+
+from google_services.cache import Cache, cached
+
+
+def test_lru_eviction():
+    cache = Cache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl():
+    cache = Cache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_single_flight():
+    calls = []
+
+    @cached()
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.05)
+        return x
+
+    threads = [threading.Thread(target=slow, args=(1,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert slow.cache.stats()['hits'] == 4
+
+
+def test_unhashable_arguments():
+    @cached()
+    def identity(x):
+        return x
+
+    assert identity([1]) == [1]
+    assert identity([1]) is identity([1])
+    identity.cache.clear()
+    assert len(identity.cache) == 0
+
+
+def test_invalidate_where():
+    cache = Cache()
+    cache.set(('parent', 'a'), 'id_a')
+    cache.set(('id_a', 'b'), 'id_b')
+    cache.invalidate_where(lambda key, value: key[0] == 'id_a')
+    assert cache.get(('id_a', 'b')) is None
+    assert cache.get(('parent', 'a')) == 'id_a'
@@ -1,7 +1,54 @@
 from google_services import credentials as creds
+from google_services._utilities import FileLock
 
 
 def test_get_creds():
     """Credentials exist and are valid for the default scopes and location
     """
     creds.get_creds()
+
+
+def _expiring_creds(path):
+    """Credentials, stored in `path`, whose token expires in a minute"""
+    from datetime import datetime, timedelta
+    from oauth2client import client, file
+
+    credentials = client.OAuth2Credentials(
+        'token', 'client_id', 'client_secret', 'refresh_token',
+        datetime.utcnow() + timedelta(seconds=60), 'https://oauth2.googleapis.com/token',
+        'user_agent')
+    store = file.Storage(str(path/'token.json'))
+    store._lock = FileLock(path/'token.json.lock')
+    store.put(credentials)
+    return store.get()
+
+
+def test_refresh_is_shared(tmp_path, monkeypatch):
+    """Concurrent workers refresh the token once, then share it
+    """
+    import threading
+    from datetime import datetime, timedelta
+    from oauth2client import client
+
+    refreshes = []
+
+    def do_refresh_request(self, request):
+        refreshes.append(self)
+        self.access_token = f'token {len(refreshes)}'
+        self.token_expiry = datetime.utcnow() + timedelta(hours=1)
+        self.store.locked_put(self)
+
+    monkeypatch.setattr(client.OAuth2Credentials, '_do_refresh_request',
+                        do_refresh_request)
+    # Two processes, each with its own credentials object
+    first, second = _expiring_creds(tmp_path), _expiring_creds(tmp_path)
+    threads = [threading.Thread(target=creds.refresh, args=(credentials,))
+               for credentials in [first] * 4 + [second] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(refreshes) == 1
+    assert first.access_token == second.access_token == 'token 1'
+    assert not creds.expires_soon(first)
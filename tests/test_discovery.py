@@ -0,0 +1,10 @@
+from google_services import discovery
+from httplib2 import Http
+
+
+def test_build_service():
+    discovery.refresh_document('drive', 'v3')
+    discovery._documents.clear()
+    document = discovery.get_document('drive', 'v3')
+    assert document['name'] == 'drive'
+    assert discovery.build_service('drive', 'v3', http=Http()) is not None
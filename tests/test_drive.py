@@ -11,6 +11,13 @@ def test_get_files():
         'name="Project description template"')) > 0
 
 
+def test_iter_files():
+    files = drive.iter_files('name="Project description template"',
+                             fields='id, name, mimeType', page_size=10,
+                             prefetch=True)
+    assert 'mimeType' in next(files)
+
+
 def test_create_folder():
     drive.create_folder('test_folder')
 
@@ -28,6 +35,24 @@ def test_copy_in_folder():
                     'test_copy', folder_id)
 
 
+def test_create_folders():
+    folder_id = drive.get_files(
+        'name="test_folder" and mimeType="application/vnd.google-apps.folder"'
+    )[0]["id"]
+    results = drive.create_folders(['test_folder_batch_0',
+                                    ('test_folder_batch_1', folder_id)])
+    assert [error for _, error in results] == [None, None]
+    assert results[1][0]['name'] == 'test_folder_batch_1'
+
+
+def test_copy_files():
+    results = drive.copy_files(
+        [('1B91DlZUvPuNXBlAd5KLinuUpBGyUx8D-K_RUZK91BFc', f'test_copy_{i}')
+         for i in range(3)])
+    assert [result['name'] for result, _ in results] == [
+        'test_copy_0', 'test_copy_1', 'test_copy_2']
+
+
 def test_create_file_relative_path():
     path = 'test_create_file_relative_path'
     Path(path).write_text('some content')
@@ -53,6 +78,17 @@ def test_create_file_absolute_path_from_home():
     Path(path).expanduser().unlink()
 
 
+def test_create_file_resumable():
+    path = Path('~/test_create_file_resumable').expanduser()
+    path.write_bytes(b'0' * 3 * 256 * 1024)
+    progress = []
+    drive.create_file(
+        path, resumable=True, chunk_size=256 * 1024,
+        progress_callback=lambda sent, total: progress.append(sent))
+    path.unlink()
+    assert progress[-1] == 3 * 256 * 1024
+
+
 def test_download():
     file_id = drive.get_files(
         'name="test_create_file_absolute_path_from_home"'
@@ -60,6 +96,17 @@ def test_download():
     assert drive.download_file(file_id) == b'some content'
 
 
+def test_download_file_to():
+    file_id = drive.get_files(
+        'name="test_create_file_absolute_path_from_home"'
+    )[0]["id"]
+    path = Path('~/test_download_file_to').expanduser()
+    drive.download_file_to(file_id, path, chunk_size=4, workers=3)
+    assert path.read_bytes() == b'some content'
+    path.unlink()
+    assert b''.join(drive.iter_download(file_id)) == b'some content'
+
+
 def test_create_file_absolute_path_no_name():
     path = '~/test_create_file_absolute_path_no_name'
     Path(path).expanduser().write_text(
@@ -94,6 +141,51 @@ def test_create_file_absolute_path_parent_folder():
     Path(path).expanduser().unlink()
 
 
+def test_sync():
+    folder_id = drive.get_files(
+        'name="test_folder" and mimeType="application/vnd.google-apps.folder"'
+    )[0]["id"]
+    local_dir = Path('~/test_sync').expanduser()
+    (local_dir / 'test_sync_sub').mkdir(parents=True, exist_ok=True)
+    (local_dir / 'test_sync_file').write_text('some content')
+    (local_dir / 'test_sync_sub' / 'test_sync_file').write_text('content')
+
+    report = drive.sync(local_dir, folder_id)
+    assert sorted(report['created']) == [
+        'test_sync_file', 'test_sync_sub/test_sync_file']
+    report = drive.sync(local_dir, folder_id)
+    assert len(report['unchanged']) == 2
+
+    (local_dir / 'test_sync_file').write_text('some other content')
+    assert drive.sync(local_dir, folder_id)['updated'] == ['test_sync_file']
+    for path in sorted(local_dir.rglob('*'), reverse=True):
+        path.rmdir() if path.is_dir() else path.unlink()
+    local_dir.rmdir()
+
+
+def test_make_dirs():
+    folder_id = drive.make_dirs('test_dirs/2026/q3')
+    assert drive.resolve_path('test_dirs/2026/q3') == folder_id
+    assert drive.make_dirs('test_dirs/2026/q3') == folder_id
+
+
+def test_upload_to_path():
+    path = Path('~/test_upload_to_path').expanduser()
+    path.write_text('some content')
+    file_id = drive.upload_to_path(path, 'test_dirs/2026/q4/file')['id']
+    assert drive.upload_to_path(path, 'test_dirs/2026/q4/file')['id'] \
+        == file_id
+    path.unlink()
+    drive.delete_file(drive.resolve_path('test_dirs'))
+    assert drive.resolve_paths(['test_dirs/2026']) == [None]
+
+
+def test_delete_files():
+    files = drive.get_files('name contains "test_copy_"')
+    results = drive.delete_files([file["id"] for file in files])
+    assert all(error is None for _, error in results)
+
+
 def test_delete_file():
     files = drive.get_files('name contains "test"')
     for file in files:
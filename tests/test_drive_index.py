@@ -0,0 +1,18 @@
+from google_services import drive_index
+
+
+def test_lookups():
+    index = drive_index.DriveIndex('~/test_drive_index.sqlite')
+    index.clear()
+    templates = index.by_name('Project description template')
+    assert len(templates) > 0
+    assert index.get(templates[0]['id']) == templates[0]
+    assert index.by_name('Project description template',
+                         consistent=True)[0]['id'] == templates[0]['id']
+    assert len(index.by_mime_type(templates[0]['mimeType'])) > 0
+
+
+def test_sync():
+    index = drive_index.DriveIndex('~/test_drive_index.sqlite', max_age=None)
+    index.sync()
+    assert index._state('page_token') is not None
@@ -0,0 +1,329 @@
+import hashlib
+import io
+import json
+import os
+import socket
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from google_services import config, drive, mail, pool, retry
+from google_services.drive_index import DriveIndex
+from google_services.fake import FakeBackend, ROOT_ID
+
+
+@pytest.fixture(params=['httplib2', 'httpx'])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == 'httpx':
+        pytest.importorskip('httpx')
+    monkeypatch.setattr(config.default, 'upload_checkpoint_path',
+                        str(tmp_path / 'uploads'))
+    monkeypatch.setattr(config.default, 'sync_hash_cache_path',
+                        str(tmp_path / 'hashes.json'))
+    monkeypatch.setattr(config.default, 'quota_enabled', False)
+    sleeps = []
+    monkeypatch.setattr(retry.time, 'sleep', sleeps.append)
+    retry.breakers.clear()
+    backend = FakeBackend()
+    backend.sleeps = sleeps
+    with backend.install(request.param):
+        yield backend
+    backend.close()
+
+
+def test_files(backend, tmp_path):
+    folder = drive.create_folder('reports')
+    for i in range(25):
+        backend.drive.add_file(f'file_{i}', b'x', folder['id'])
+    files = list(drive.iter_files(f"'{folder['id']}' in parents",
+                                  fields='id, name, size', page_size=10))
+    assert len(files) == 25
+    assert files[0] == {'id': files[0]['id'], 'name': 'file_0', 'size': '1'}
+    assert drive.get_files("name = 'file_3' or name contains '_24'") \
+        == [{'id': files[3]['id'], 'name': 'file_3'},
+            {'id': files[24]['id'], 'name': 'file_24'}]
+
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(b'content')
+    uploaded = drive.create_file(str(path), parent_folder_id=folder['id'])
+    assert backend.drive.content(uploaded['id']) == b'content'
+    assert drive.resolve_path('reports/upload.bin') == uploaded['id']
+    # Long queries are sent as POSTs overriding their method
+    paths = [f'reports/file_{i}' for i in range(25)]
+    assert drive.resolve_paths(paths + ['reports/' + 'missing' * 300]) \
+        == [file['id'] for file in files] + [None]
+
+
+def test_resumable_upload(backend, tmp_path):
+    content = os.urandom(1024 * 1024 + 1)
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(content)
+    progress = []
+
+    def fail_once(sent, total):
+        if not progress:
+            backend.fail(503)
+        progress.append(sent)
+
+    uploaded = drive.create_file(str(path), resumable=True,
+                                 chunk_size=256 * 1024,
+                                 progress_callback=fail_once)
+    assert backend.drive.content(uploaded['id']) == content
+    # Session start, 5 chunks, the failed one and the status query: the
+    # upload resumed after the failed chunk
+    assert progress == sorted(progress)
+    assert backend.calls['drive.files.create'] == 8
+
+
+def test_download(backend, tmp_path):
+    content = os.urandom(3 * 1024 * 1024 + 1)
+    file = backend.drive.add_file('download.bin', content)
+    assert drive.download_file(file['id']) == content
+    buffer = io.BytesIO()
+    metadata = drive.download_file_to(file['id'], buffer,
+                                      chunk_size=1024 * 1024)
+    assert buffer.getvalue() == content
+    assert metadata['md5Checksum'] == hashlib.md5(content).hexdigest()
+    drive.download_file_to(file['id'], tmp_path / 'download.bin',
+                           chunk_size=1024 * 1024, workers=4)
+    assert (tmp_path / 'download.bin').read_bytes() == content
+
+    # The workers use the credentials of the given service
+    service = pool.default_pool.get('drive', 'v3')
+    credentials_getter = pool.default_pool.credentials_getter
+    pool.default_pool.credentials_getter = None
+    try:
+        drive.download_file_to(file['id'], tmp_path / 'workers.bin',
+                               chunk_size=1024 * 1024, workers=4,
+                               service=service)
+    finally:
+        pool.default_pool.credentials_getter = credentials_getter
+    assert (tmp_path / 'workers.bin').read_bytes() == content
+
+    # Files without binary content, ex: Google Docs, have no size
+    folder = backend.drive.add_folder('folder')
+    with pytest.raises(HttpError) as error:
+        drive.download_file_to(folder['id'], tmp_path / 'folder',
+                               workers=4)
+    assert error.value.resp.status == 403
+
+
+def test_batch(backend):
+    file = backend.drive.add_file('source', b'x')
+    copies = drive.copy_files([(file['id'], f'copy_{i}') for i in range(150)])
+    assert all(error is None for _, error in copies)
+    assert backend.calls['batch'] == 2
+
+    backend.fail(429, 'rateLimitExceeded', count=3,
+                 method_id='drive.files.delete')
+    results = drive.delete_files([copy['id'] for copy, _ in copies]
+                                 + ['missing'])
+    assert [error for _, error in results[:-1]] == [None] * 150
+    assert results[-1][1].resp.status == 404
+    assert drive.get_files("name contains 'copy_'") == []
+    # Delays of the retry policy, here the ones asked by the api
+    backend.sleeps.clear()
+    backend.fail(429, 'rateLimitExceeded', method_id='drive.files.delete',
+                 retry_after=5)
+    drive.delete_files([backend.drive.add_file('file', b'x')['id']])
+    assert backend.sleeps == [5]
+
+    retry.breakers.clear()
+    breaker = retry.get_breaker('drive')
+    breaker.failure_threshold = 10
+    backend.fail(503, method_id='drive.files.delete', count=20)
+    with pytest.raises(retry.CircuitOpenError):
+        drive.delete_files([backend.drive.add_file(f'file_{i}', b'x')['id']
+                            for i in range(20)])
+
+
+def test_batch_envelope_errors(backend, monkeypatch):
+    file = backend.drive.add_file('source', b'x')
+    send_batch = backend._batch
+
+    def fail_after_first(*args):
+        if not backend.calls['batch'] > 1:
+            backend.fail(503, method_id='batch',
+                         count=retry.default_policy.max_attempts)
+        return send_batch(*args)
+
+    monkeypatch.setattr(backend, '_batch', fail_after_first)
+    with pytest.raises(HttpError):
+        drive.copy_files([(file['id'], f'copy_{i}') for i in range(150)])
+    # The copies of the first batch are not made again
+    assert len(drive.get_files("name contains 'copy_'")) == 100
+
+
+def test_sync(backend, tmp_path):
+    local = tmp_path / 'local'
+    (local / 'folder').mkdir(parents=True)
+    (local / 'folder' / 'a.txt').write_text('a')
+    (local / 'b.txt').write_text('b')
+    folder = backend.drive.add_folder('mirror')
+    backend.drive.add_file('extra.txt', b'extra', folder['id'])
+    report = drive.sync(str(local), folder['id'], delete=True)
+    # Reported in the order the transfers complete
+    assert sorted(report['created']) == ['b.txt', 'folder/a.txt']
+    assert report['deleted'] == ['extra.txt']
+    (local / 'b.txt').write_text('changed')
+    report = drive.sync(str(local), folder['id'])
+    assert report['updated'] == ['b.txt']
+    assert report['unchanged'] == ['folder/a.txt']
+
+    # The workers use the credentials of the given service
+    (local / 'c.txt').write_text('c')
+    service = pool.default_pool.get('drive', 'v3')
+    credentials_getter = pool.default_pool.credentials_getter
+    pool.default_pool.credentials_getter = None
+    try:
+        report = drive.sync(str(local), folder['id'], workers=4,
+                            service=service)
+    finally:
+        pool.default_pool.credentials_getter = credentials_getter
+    assert report['created'] == ['c.txt']
+
+
+def test_lost_responses(backend):
+    backend.lose_responses(method_id='gmail.users.messages.send')
+    with pytest.raises(socket.timeout):
+        mail.send_mail('me@example.com', 'to@example.com', 'subject',
+                       '<b>html</b>', 'plain')
+    # Not sent again
+    assert len(backend.gmail.messages) == 1
+
+    backend.lose_responses(method_id='drive.files.create')
+    with pytest.raises(socket.timeout):
+        drive.create_folder('folder')
+    assert len(drive.get_files("name = 'folder'")) == 1
+    backend.fail(429, 'rateLimitExceeded', method_id='drive.files.create')
+    drive.create_folder('other')
+    assert len(drive.get_files("name = 'other'")) == 1
+
+
+def test_send_bulk(backend, tmp_path):
+    recipients = [{'to': f'user_{i}@example.com', 'name': str(i)}
+                  for i in range(3)]
+    arguments = (recipients, 'me@example.com', 'Hello $name', '<b>$name</b>',
+                 '$name', str(tmp_path / 'journal.jsonl'))
+    backend.lose_responses(method_id='gmail.users.messages.send')
+    # The workers use the credentials of the given service
+    service = pool.default_pool.get('gmail', 'v1')
+    credentials_getter = pool.default_pool.credentials_getter
+    pool.default_pool.credentials_getter = None
+    try:
+        report = mail.send_bulk(*arguments, workers=4, service=service)
+    finally:
+        pool.default_pool.credentials_getter = credentials_getter
+    assert (report['sent'], report['unconfirmed']) == (2, 1)
+    assert len(backend.gmail.messages) == 3
+
+    # The unconfirmed send is not made again, unless asked
+    report = mail.send_bulk(*arguments)
+    assert (report['sent'], report['skipped'], report['unconfirmed']) \
+        == (0, 2, 1)
+    report = mail.send_bulk(*arguments, resend_unconfirmed=True)
+    assert (report['sent'], report['skipped']) == (1, 2)
+    assert len(backend.gmail.messages) == 4
+
+    backend.fail(503, method_id='gmail.users.messages.send')
+    report = mail.send_bulk(*arguments[:-1], str(tmp_path / 'other.jsonl'),
+                            workers=1)
+    assert (report['sent'], report['unconfirmed']) == (2, 1)
+
+
+def test_drive_index(backend, tmp_path):
+    index = DriveIndex(str(tmp_path / 'index.db'), max_age=None)
+    file = backend.drive.add_file('indexed', b'x')
+    index.sync()
+    assert index.get(file['id'])['name'] == 'indexed'
+    drive.delete_file(file['id'])
+    index.sync()
+    assert index.get(file['id']) is None
+    assert backend.calls['drive.changes.list'] == 1
+    assert index.by_parent(ROOT_ID) == []
+
+
+def test_mail(backend, tmp_path):
+    for i in range(60):
+        backend.gmail.add_message(f'subject {i}', f'text {i}')
+    history_path = tmp_path / 'history.json'
+    assert len(mail.sync(str(history_path))['added']) == 60
+
+    attachment = tmp_path / 'attachment.bin'
+    attachment.write_bytes(os.urandom(1024))
+    sent = mail.send_mail('me@example.com', 'to@example.com', 'subject',
+                          '<b>html</b>', 'plain', [str(attachment)])
+    assert backend.gmail.messages[sent['id']]['labelIds'] == ['SENT']
+
+    messages = list(mail.iter_messages('in:inbox', hydrate=True,
+                                       metadata_headers=['Subject'],
+                                       max_results=25))
+    assert len(messages) == 60
+    assert messages[0]['payload']['headers'] == [
+        {'name': 'Subject', 'value': 'subject 59'}]
+    assert mail.archive_messages(messages[:10],
+                                 extra_labels=['archived']) == 10
+    assert len(mail.get_messages('label:archived')) == 10
+
+    report = mail.sync(str(history_path))
+    assert not report['full_sync']
+    assert report['added'] == [sent['id']]
+    assert len(report['labels_added']) == 10
+    backend.gmail.expire_history()
+    assert mail.sync(str(history_path))['full_sync']
+
+    # Label names can contain commas
+    mail.archive_message(messages[10]['id'], extra_labels='a, b')
+    assert mail.label_ids('a, b') == [mail.label_id('a, b')]
+
+
+def test_chunk_errors(backend):
+    ids = [backend.gmail.add_message(f'subject {i}', 'text')['id']
+           for i in range(5)]
+    backend.fail(503, method_id='gmail.users.messages.batchModify')
+    assert mail.trash_messages(iter(ids)) == 5
+    assert backend.calls['gmail.users.messages.batchModify'] == 2
+    backend.fail(503, method_id='gmail.users.messages.batchDelete')
+    assert mail.delete_messages(iter(ids)) == 5
+    assert backend.calls['gmail.users.messages.batchDelete'] == 2
+    assert backend.gmail.messages == {}
+
+
+def test_errors(backend):
+    backend.fail(429, 'rateLimitExceeded', retry_after=3)
+    assert mail.get_labels()
+    assert backend.sleeps == [3]
+    backend.fail(403, 'dailyLimitExceeded')
+    with pytest.raises(HttpError):
+        mail.get_labels()
+
+
+def test_fields(backend, tmp_path):
+    folder = drive.create_folder('folder')
+    assert set(folder) == {'id', 'name'}
+    other = drive.create_folder('other', folder['id'], fields='id, parents')
+    assert other['parents'] == [folder['id']] and 'name' not in other
+    file = backend.drive.add_file('source', b'x')
+    copies = drive.copy_files([(file['id'], 'copy')], fields='id')
+    assert set(copies[0][0]) == {'id'}
+
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(b'content')
+    assert isinstance(drive.create_file(str(path), parse=False), bytes)
+    with pytest.raises(HttpError):
+        drive.update_file(str(path), 'missing', parse=False)
+
+    labels = mail.get_labels()
+    assert set(labels[0]) == {'id', 'name', 'type'}
+    mail.label_cache.clear()
+    assert set(mail.get_labels(fields='type')[0]) == {'type'}
+    assert mail.label_id(labels[0]['name']) == labels[0]['id']
+    assert mail.create_label('label', fields='id') \
+        == {'id': mail.label_id('label')}
+    sent = mail.send_mail('me@example.com', 'to@example.com', 'subject',
+                          '<b>html</b>', 'plain')
+    assert set(sent) == {'id', 'threadId', 'labelIds'}
+    assert mail.move_to_trash(sent['id'], fields='labelIds') \
+        == {'labelIds': ['SENT', 'TRASH']}
+    assert json.loads(mail.archive_message(sent['id'], parse=False)) \
+        == {**sent, 'labelIds': ['SENT', 'TRASH']}
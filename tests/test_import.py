@@ -1,8 +1,35 @@
 """Minimal testing utilities
 """
 
+from pathlib import Path
+import subprocess
+import sys
+
 
 def test_import():
     """test the project's installation
     """
     import google_services
+
+
+def test_lazy_import():
+    """importing the package loads neither the submodules nor the
+    google-api client
+    """
+    loaded = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, google_services; print(sorted(sys.modules))'],
+        check=True, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    assert 'google_services.drive' not in loaded
+    assert 'googleapiclient' not in loaded
+
+
+def test_lazy_submodules():
+    """every public submodule is imported on first access
+    """
+    import google_services
+
+    package = Path(google_services.__file__).parent
+    submodules = {path.stem for path in package.glob('[!_]*.py')}
+    assert submodules <= set(google_services._SUBMODULES)
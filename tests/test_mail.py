@@ -1,3 +1,5 @@
+import pytest
+
 from google_services import mail
 
 
@@ -21,6 +23,18 @@ def test_create_mail():
                             'test_plain') is not None
 
 
+def test_create_mail_missing_attachment(tmp_path, monkeypatch):
+    import tempfile
+
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        mail.create_mail('services.wrapper@gmail.com',
+                         'services.wrapper@gmail.com', 'test_subject',
+                         'test_html', 'test_plain',
+                         attachments=[tmp_path / 'missing.txt'])
+    assert list(tmp_path.iterdir()) == []
+
+
 def test_send_mail():
     mime_msg = mail.create_mail('services.wrapper@gmail.com',
                                 'services.wrapper@gmail.com',
@@ -31,23 +45,79 @@ def test_send_mail():
     mail.send('me', mime_msg)
 
 
+def test_send_mail_attachments(tmp_path):
+    attachment = tmp_path/'attachment.txt'
+    attachment.write_text('test_attachment\n' * 1000)
+    assert 'id' in mail.send_mail('services.wrapper@gmail.com',
+                                  'services.wrapper@gmail.com',
+                                  'test_subject',
+                                  'test_html',
+                                  'test_plain',
+                                  attachments=[attachment])
+
+
 def test_send_file():
     mail.send_file('services.wrapper@gmail.com',
                    'test_subject',
                    '1B91DlZUvPuNXBlAd5KLinuUpBGyUx8D-K_RUZK91BFc')
 
 
+def test_send_bulk(tmp_path):
+    recipients = [{'to': 'services.wrapper@gmail.com', 'key': key,
+                   'name': name}
+                  for key, name in [('first', 'First'), ('second', 'Second')]]
+    arguments = ('services.wrapper@gmail.com', 'test_subject',
+                 '<b>Hello $name</b>', 'Hello $name', tmp_path/'journal')
+    report = mail.send_bulk(recipients, *arguments)
+    assert report['sent'] == 2
+
+    report = mail.send_bulk(recipients, *arguments)
+    assert report['sent'] == 0
+    assert report['skipped'] == 2
+
+
 def test_get_messages():
     assert len(mail.get_messages('subject: "test_subject"')) > 0
 
 
+def test_iter_messages():
+    messages = mail.iter_messages('subject: "test_subject"', hydrate=True,
+                                  metadata_headers=['Subject'],
+                                  fields='id, payload/headers')
+    message = next(messages)
+    assert message['payload']['headers'] == [
+        {'name': 'Subject', 'value': 'test_subject'}]
+
+
+def test_sync(tmp_path):
+    history_path = tmp_path/'mail_history.json'
+    assert mail.sync(history_path)['full_sync']
+
+    mail.send_file('services.wrapper@gmail.com',
+                   'test_subject',
+                   '1B91DlZUvPuNXBlAd5KLinuUpBGyUx8D-K_RUZK91BFc')
+    report = mail.sync(history_path)
+    assert not report['full_sync']
+    assert len(report['added']) > 0
+
+
+def test_label_index():
+    label_id = mail.label_id('test_label')
+    assert mail.label_name(label_id) == 'test_label'
+    assert mail.label_ids(['INBOX', 'test_label']) == ['INBOX', label_id]
+
+
 def test_archive_message():
     test_messages = mail.get_messages('subject: "test_subject"')
-    labels = mail.get_labels()
-    extra_label = [l['id'] for l in labels if l['name'] == 'test_label'][0]
 
     for message in test_messages:
-        mail.archive_message(message['id'], extra_labels=extra_label)
+        mail.archive_message(message['id'], extra_labels='test_label')
+
+
+def test_archive_messages():
+    assert mail.archive_messages(
+        mail.iter_messages('subject: "test_subject"'),
+        extra_labels=['test_label']) > 0
 
 
 def test_put_to_trash():
@@ -57,8 +127,12 @@ def test_put_to_trash():
         mail.move_to_trash(message['id'])
 
 
+def test_trash_messages():
+    assert mail.trash_messages(
+        mail.iter_messages('subject: "test_subject"')) > 0
+
+
 def test_delete_label():
-    labels = mail.get_labels()
-    for label in labels:
-        if label['name'] == 'test_label':
-            mail.delete_label(label['id'])
+    mail.delete_label(mail.label_id('test_label'))
+    with pytest.raises(KeyError):
+        mail.label_id('test_label')
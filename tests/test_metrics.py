@@ -0,0 +1,187 @@
+from contextlib import contextmanager
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from google_services import config, drive, mail, metrics, retry
+from google_services.cache import Cache
+from google_services.fake import FakeBackend
+
+
+@pytest.fixture
+def recorder():
+    recorder = metrics.Recorder()
+    previous = metrics.set_hooks(recorder)
+    yield recorder
+    metrics.set_hooks(previous)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.default, 'upload_checkpoint_path',
+                        str(tmp_path / 'uploads'))
+    monkeypatch.setattr(config.default, 'quota_enabled', False)
+    monkeypatch.setattr(retry.time, 'sleep', lambda delay: None)
+    retry.breakers.clear()
+    backend = FakeBackend()
+    with backend.install():
+        yield backend
+    backend.close()
+
+
+def test_requests_and_pages(backend, recorder):
+    folder = backend.drive.add_folder('folder')
+    for i in range(25):
+        backend.drive.add_file(f'file_{i}', b'x', folder['id'])
+    backend.fail(503, method_id='drive.files.list')
+    files = list(drive.iter_files(f"'{folder['id']}' in parents",
+                                  page_size=10))
+    assert len(files) == 25
+
+    snapshot = recorder.snapshot()
+    requests = snapshot['requests']['drive.files.list']
+    assert requests['count'] == 4
+    assert requests['errors'] == 1
+    assert requests['statuses'] == {200: 3, 503: 1}
+    assert requests['response_bytes'] == backend.bytes_sent
+    assert sum(requests['histogram']) == 4
+    assert snapshot['pages']['drive.files.list'] == dict(count=3, items=25)
+    assert snapshot['retries'] == {'drive': 1}
+    # The generator is measured until exhausted
+    assert snapshot['calls']['drive.iter_files']['count'] == 1
+
+
+def test_batch_and_uploads(backend, recorder, tmp_path):
+    file = backend.drive.add_file('source', b'x')
+    drive.copy_files([(file['id'], f'copy_{i}') for i in range(3)]
+                     + [('missing', 'copy')])
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(b'x' * (512 * 1024 + 1))
+    drive.create_file(str(path), resumable=True, chunk_size=256 * 1024)
+
+    requests = recorder.snapshot()['requests']
+    assert requests['drive.batch']['count'] == 1
+    assert requests['drive.files.copy']['statuses'] == {200: 3, 404: 1}
+    # The session start, then 3 chunks
+    assert requests['drive.files.create']['statuses'] == {200: 2, 308: 2}
+    assert requests['drive.files.create']['count'] \
+        == backend.calls['drive.files.create']
+    assert requests['drive.files.create']['request_bytes'] \
+        > 512 * 1024 + 1
+
+    calls = recorder.snapshot()['calls']
+    assert calls['drive.copy_files']['count'] == 1
+    assert calls['drive.create_file']['errors'] == 0
+
+
+def test_resumable_send(backend, recorder, tmp_path, monkeypatch):
+    monkeypatch.setattr(config.default, 'resumable_upload_threshold', 0)
+    monkeypatch.setattr(config.default, 'upload_chunk_size', 256 * 1024)
+    path = tmp_path / 'attachment.bin'
+    path.write_bytes(b'x' * 600 * 1024)
+    mail.send_mail('me@example.com', 'to@example.com', 'subject',
+                   '<b>html</b>', 'plain', [str(path)])
+    requests = recorder.snapshot()['requests']['gmail.users.messages.send']
+    # The session start, then the chunks, each measured once
+    assert requests['count'] == backend.calls['gmail.users.messages.send']
+    assert requests['statuses'] == {200: 2, 308: requests['count'] - 2}
+
+    recorder.reset()
+    backend.fail(503, method_id='gmail.users.messages.send')
+    with pytest.raises(HttpError):
+        mail.send_mail('me@example.com', 'to@example.com', 'subject',
+                       '<b>html</b>', 'plain', [str(path)])
+    requests = recorder.snapshot()['requests']['gmail.users.messages.send']
+    assert requests['statuses'] == {503: 1}
+
+
+def test_unparsed_responses(backend, recorder):
+    folder = drive.create_folder('folder', parse=False)
+    requests = recorder.snapshot()['requests']['drive.files.create']
+    assert requests['statuses'] == {200: 1}
+    assert requests['response_bytes'] == len(folder)
+
+
+def test_caches(backend, recorder):
+    mail.create_label('label')
+    mail.label_cache.clear()
+    assert mail.label_id('label') == mail.label_id('label')
+    cache = recorder.snapshot()['caches']['mail.label_cache']
+    assert cache['hits'] >= 1 and cache['misses'] >= 1
+
+    Cache().get('key')
+    assert set(recorder.snapshot()['caches']) == {'mail.label_cache'}
+
+
+def test_disabled_hooks_are_skipped(backend):
+    class Failing(metrics.Hooks):
+        def request(self, *args):
+            raise AssertionError
+
+        def call(self, *args):
+            raise AssertionError
+
+        def span(self, *args, **kwargs):
+            raise AssertionError
+
+    previous = metrics.set_hooks(Failing())
+    try:
+        assert mail.get_labels()
+    finally:
+        metrics.set_hooks(previous)
+
+
+def test_combine(backend, recorder):
+    other = metrics.Recorder()
+    spans = []
+
+    class Spans(metrics.Hooks):
+        enabled = True
+
+        def span(self, name, **attributes):
+            spans.append(name)
+            return super().span(name, **attributes)
+
+    metrics.set_hooks(metrics.combine(recorder, other, Spans()))
+    mail.get_labels()
+    assert recorder.snapshot() == other.snapshot()
+    assert spans == ['mail.get_labels', 'gmail.users.labels.list']
+
+
+def test_batch_spans(backend):
+    file = backend.drive.add_file('source', b'x')
+    spans, requests = [], []
+
+    class Spans(metrics.Hooks):
+        enabled = True
+
+        @contextmanager
+        def span(self, name, **attributes):
+            spans.append(name)
+            yield
+            spans.pop()
+
+        def request(self, method_id, *args):
+            requests.append((spans[-1], method_id))
+
+    previous = metrics.set_hooks(Spans())
+    try:
+        drive.copy_files([(file['id'], 'copy_1'), (file['id'], 'copy_2')])
+    finally:
+        metrics.set_hooks(previous)
+    assert requests == [('drive.batch', 'drive.batch'),
+                        ('drive.files.copy', 'drive.files.copy'),
+                        ('drive.files.copy', 'drive.files.copy')]
+
+
+def test_prometheus(backend):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    previous = metrics.set_hooks(metrics.PrometheusHooks(registry))
+    try:
+        mail.get_labels()
+    finally:
+        metrics.set_hooks(previous)
+    assert registry.get_sample_value(
+        'google_services_requests_total',
+        dict(method='gmail.users.labels.list', status='200')) == 1
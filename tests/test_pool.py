@@ -0,0 +1,34 @@
+import threading
+
+from google_services import drive, mail, pool
+
+
+def test_service_per_thread():
+    services = []
+    thread = threading.Thread(
+        target=lambda: services.append(drive.default_service()))
+    thread.start()
+    thread.join()
+    assert services[0] is not drive.default_service()
+    assert drive.default_service() is drive.default_service()
+
+
+def test_executor_map():
+    queries = ['name="Project description template"'] * 4
+    with pool.Executor(max_workers=4) as executor:
+        results = list(executor.map(drive.get_files, queries))
+    assert len(results) == 4
+    assert all(len(files) > 0 for files in results)
+
+
+def test_executor_submit():
+    with pool.Executor(max_workers=2) as executor:
+        labels = executor.submit(mail.get_labels)
+        files = executor.submit(drive.get_files,
+                                'name="Project description template"')
+        assert len(labels.result()) > 0
+        assert len(files.result()) > 0
+
+
+def test_services_share_http():
+    assert drive.default_service()._http is mail.default_service()._http
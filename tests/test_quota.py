@@ -0,0 +1,64 @@
+import pytest
+
+from google_services import quota
+from google_services.config import Config
+
+
+class QuotaConfig(Config):
+    gmail_user_quota = 100
+    gmail_project_quota = 1000
+    quota_headroom = 1
+    quota_burst = 1
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(quota.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_cost():
+    assert quota.cost('gmail.users.messages.send') == 100
+    assert quota.cost('gmail.users.labels.list') == 1
+    assert quota.cost('gmail.users.settings.getVacation') \
+        == quota.GMAIL_DEFAULT_COST
+    assert quota.cost('drive.files.list') == 1
+
+
+def test_token_bucket():
+    bucket = quota.TokenBucket(rate=10, capacity=20)
+    assert bucket.reserve(20) == 0
+    # The reservations queue up
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.01)
+    assert bucket.reserve(5) == pytest.approx(1, abs=0.01)
+    assert bucket.utilization() == pytest.approx(30 / (10 * bucket.WINDOW))
+
+
+def test_scheduler(sleeps):
+    scheduler = quota.Scheduler(QuotaConfig)
+    # The burst of a user is its quota of one second
+    assert scheduler.acquire('gmail.users.messages.send', 'a') == 0
+    assert scheduler.acquire('gmail.users.messages.send', 'a') \
+        == pytest.approx(1, abs=0.01)
+    # Other users have their own bucket
+    assert scheduler.acquire('gmail.users.messages.send', 'b') == 0
+    assert len(sleeps) == 1
+    # Apis without quotas are not throttled
+    assert scheduler.acquire('sheets.spreadsheets.get', 'a') == 0
+
+    utilization = scheduler.utilization()
+    assert utilization[('gmail', 'user', 'a')] \
+        == pytest.approx(200 / (100 * quota.TokenBucket.WINDOW))
+    assert utilization[('gmail', 'project')] \
+        == pytest.approx(300 / (1000 * quota.TokenBucket.WINDOW))
+
+
+def test_disabled(sleeps):
+    class DisabledConfig(QuotaConfig):
+        quota_enabled = False
+
+    scheduler = quota.Scheduler(DisabledConfig)
+    for _ in range(10):
+        assert scheduler.acquire('gmail.users.messages.send') == 0
+    assert scheduler.utilization() == {}
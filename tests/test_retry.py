@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from google_services import retry
+
+
+def _error(status: int, reason: str='', **headers)->HttpError:
+    return HttpError(Response({'status': str(status), **headers}),
+                     json.dumps({'error': {'code': status, 'errors': [
+                         {'reason': reason}]}}).encode())
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry.time, 'sleep', sleeps.append)
+    retry.breakers.clear()
+    return sleeps
+
+
+def _failing(*errors):
+    """Callable raising `errors` one after the other, then returning 'ok'"""
+    errors = list(errors)
+
+    def f():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    return f
+
+
+def test_retries_transient_errors(no_sleep):
+    f = _failing(_error(503), _error(403, 'rateLimitExceeded'),
+                 ConnectionError())
+    assert retry.call(f, 'test') == 'ok'
+    assert len(no_sleep) == 3
+
+
+def test_does_not_retry_permanent_errors(no_sleep):
+    for error in [_error(404), _error(403, 'dailyLimitExceeded')]:
+        with pytest.raises(HttpError):
+            retry.call(_failing(error), 'test')
+    assert no_sleep == []
+
+
+def test_non_idempotent_calls(no_sleep):
+    # Refused before being processed
+    f = _failing(_error(429), _error(403, 'userRateLimitExceeded'),
+                 ConnectionRefusedError())
+    assert retry.call(f, 'test', idempotent=False) == 'ok'
+    # Maybe processed
+    for error in [_error(503), TimeoutError(), ConnectionResetError()]:
+        with pytest.raises(type(error)):
+            retry.call(_failing(error), 'test', idempotent=False)
+    assert len(no_sleep) == 3
+
+
+def test_retry_after(no_sleep):
+    retry.call(_failing(_error(429, **{'retry-after': '7'})), 'test')
+    assert no_sleep == [7]
+
+
+def test_backoff():
+    policy = retry.RetryPolicy(base_delay=1, max_delay=10, jitter=False)
+    assert [policy.delay(attempt) for attempt in range(5)] == [1, 2, 4, 8, 10]
+    policy.jitter = True
+    assert all(0 <= policy.delay(3) <= 8 for _ in range(100))
+
+
+def test_nested_calls_do_not_multiply_retries():
+    calls = []
+
+    def f():
+        calls.append(None)
+        raise _error(500)
+
+    with pytest.raises(HttpError):
+        retry.call(lambda: retry.call(f, 'test'), 'test')
+    assert len(calls) == retry.default_policy.max_attempts
+
+
+def test_circuit_breaker():
+    breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.before_call()
+
+    # Half open after the timeout
+    breaker._opened_at -= 60
+    breaker.before_call()
+    breaker.record_success()
+    assert not breaker.is_open
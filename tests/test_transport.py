@@ -0,0 +1,64 @@
+import io
+import threading
+
+import pytest
+
+from google_services import transport
+
+
+def test_connections_per_thread():
+    httplib_transport = transport.HttplibTransport()
+    first, second = httplib_transport.http(), httplib_transport.http()
+    assert first is not second
+    assert first.connections is second.connections
+
+    other_thread = []
+    thread = threading.Thread(
+        target=lambda: other_thread.append(httplib_transport.http()))
+    thread.start()
+    thread.join()
+    assert other_thread[0].connections is not first.connections
+
+
+def test_httpx_http():
+    httpx = pytest.importorskip('httpx')
+
+    def handler(request):
+        return httpx.Response(200, json={'method': request.method},
+                              headers={'x-test': 'yes'})
+
+    http = transport._HttpxHttp(
+        httpx.Client(transport=httpx.MockTransport(handler)))
+    response, content = http.request('https://www.googleapis.com/', 'POST',
+                                     body=b'{}')
+    assert response.status == 200
+    assert response['x-test'] == 'yes'
+    assert content == b'{"method":"POST"}'
+
+
+def test_httpx_http_stream_body():
+    httpx = pytest.importorskip('httpx')
+    from googleapiclient.http import _StreamSlice
+
+    def handler(request):
+        return httpx.Response(200, content=request.content)
+
+    http = transport._HttpxHttp(
+        httpx.Client(transport=httpx.MockTransport(handler)))
+    body = _StreamSlice(io.BytesIO(b'0123456789'), 2, 5)
+    response, content = http.request('https://www.googleapis.com/', 'PUT',
+                                     body=body)
+    assert response.status == 200
+    assert content == b'23456'
+
+
+def test_resumable_upload_statuses(monkeypatch):
+    http = transport.HttplibTransport().http()
+    assert 308 not in getattr(http, 'redirect_codes', ())
+
+    # httplib2 < 0.16
+    import httplib2
+    monkeypatch.delattr(httplib2.Http, 'redirect_codes', raising=False)
+    monkeypatch.setattr(httplib2.Http, '__init__',
+                        lambda self, timeout=None: None)
+    transport.HttplibTransport().http()